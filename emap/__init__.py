@@ -1,5 +1,5 @@
 from .db import NetlistDB
 
-from . import rewrites, extracts
+from . import rewrites, extracts, snapshot
 
 print("emap is loaded successfully.")
\ No newline at end of file
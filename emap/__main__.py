@@ -1,6 +1,8 @@
-from emap import NetlistDB
+from emap import NetlistDB, snapshot
 from emap.rewrites import *
 from emap.extracts import greedy, ilp
+from emap.extracts.solver import SOLVERS
+from functools import partial
 import argparse
 import json
 
@@ -16,22 +18,31 @@ def test_greedy_extract_dsps(db: NetlistDB, top: str):
             f, indent=2
         )
 
-def test_ilp_extract_dsps_by_count(db: NetlistDB, top: str):
+def cost_model(x: tuple) -> float:
+    if x[0] == "$muls":
+        return NetlistDB.width_of(x[1]) * NetlistDB.width_of(x[2]) * 1.0
+    elif x[0] == "$dff":
+        return NetlistDB.width_of(x[1]) * 0.5
+    else:
+        return NetlistDB.width_of(x[1]) + NetlistDB.width_of(x[2]) * 1.0
+
+def test_ilp_extract_dsps_by_count(db: NetlistDB, top: str, solver: str = "gurobi", threads: int | None = None, time_limit: float | None = None, warm_start: bool = False, count: int = 3):
     # extract DSPs by a fixed count
-    def cost_model(x: tuple) -> float:
-        if x[0] == "$muls":
-            return NetlistDB.width_of(x[1]) * NetlistDB.width_of(x[2]) * 1.0
-        elif x[0] == "$dff":
-            return NetlistDB.width_of(x[1]) * 0.5
-        else:
-            return NetlistDB.width_of(x[1]) + NetlistDB.width_of(x[2]) * 1.0
-    new_design = ilp.extract_dsps_by_count(db, "dsp48e2", count=3, cost_model=cost_model)
+    new_design = ilp.extract_dsps_by_count(db, "dsp48e2", count=count, cost_model=cost_model, solver=solver, threads=threads, time_limit=time_limit, warm_start=warm_start)
     with open("out_ilp_count.json", "w") as f:
         json.dump(
             {"creator": "nextmap", "modules": {top: new_design}},
             f, indent=2
         )
 
+def map_module(db: NetlistDB, name: str, dsp_rules: list[dict], solver: str = "gurobi", threads: int | None = None, time_limit: float | None = None, warm_start: bool = False, count: int = 3) -> dict:
+    # flow of one module in the hierarchical mode, runs in a worker process
+    # `count` DSPs per module, so a module instantiated N times takes up to N * `count` DSPs of the device
+    create_dsp_tables(db, dsp_rules)
+    for rule in dsp_rules:
+        rewrite_dsp(db, rule)
+    return ilp.extract_dsps_by_count(db, "dsp48e2", count=count, cost_model=cost_model, solver=solver, threads=threads, time_limit=time_limit, warm_start=warm_start)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--schema", nargs="?", type=str, default="emap/schema.sql", help="Path to the schema file")
@@ -39,28 +50,70 @@ if __name__ == "__main__":
     parser.add_argument("--design", type=str, help="Path to the design JSON file")
     parser.add_argument("--top", type=str, help="Name of the top module")
     parser.add_argument("--rules", type=str, help="Path to the directory of ruleset files")
+    parser.add_argument("--backend", choices=["sqlite", "numpy"], default="sqlite", help="E-graph backend, numpy keeps the tables as in-memory columns")
+    parser.add_argument("--cache-size", type=int, default=None, help="Bound the hash-consing caches to this many entries (LRU)")
+    parser.add_argument("--hierarchical", action="store_true", help="Map every unique module under --top once, instead of the flat --top module")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes in the hierarchical mode and of --parallel-dsp")
+    parser.add_argument("--snapshot", type=str, default="out_rewrite.jsonl.gz", help="Path of the e-graph snapshot written after the rewrites")
+    parser.add_argument("--from-snapshot", type=str, default=None, help="Load the e-graph from a snapshot instead of --design and skip the rewrites")
+    parser.add_argument("--solver", choices=list(SOLVERS), default="gurobi", help="MIP solver of the ILP extraction")
+    parser.add_argument("--solver-threads", type=int, default=None, help="Number of threads of the MIP solver")
+    parser.add_argument("--time-limit", type=float, default=None, help="Time limit of the MIP solver in seconds, the best solution found is extracted")
+    parser.add_argument("--dsp-count", type=int, default=3, help="Number of DSPs the ILP extraction may use, per module in the hierarchical mode")
+    parser.add_argument("--warm-start", action="store_true", help="Start the MIP of the ILP extraction from a heuristic selection")
+    parser.add_argument("--parallel-dsp", action="store_true", help="Match all DSP rules at once on a process pool of --workers processes")
+    parser.add_argument("--retime-workers", type=int, default=None, help="Retime the dffs backward by clock partitions on this many worker processes")
+    parser.add_argument("--check-plans", action="store_true", help="Report rewrites and rules whose query plans scan full tables, then exit")
     args = parser.parse_args()
-    db = NetlistDB(schema_file=args.schema, db_file=args.db, cnt=1000)
-
-    with open(args.design, "r") as f:
-        mod = json.load(f)
+    if args.backend == "numpy":
+        if args.check_plans:
+            parser.error("--check-plans requires the sqlite backend")
+        from emap.columnar import ColumnarDB
+        db = ColumnarDB(cnt=1000)
+    else:
+        db = NetlistDB(schema_file=args.schema, db_file=args.db, cnt=1000, cache_size=args.cache_size)
 
     with open(f"{args.rules}/dsp.json", "r") as f:
         dsp_rules = json.load(f)
 
     create_dsp_tables(db, dsp_rules)
-    db.build_from_json(mod["modules"][args.top])
+    if args.check_plans:
+        check_query_plans(db, dsp_rules)
+        exit(0)
+
+    if args.hierarchical:
+        from emap.hier import map_hierarchy
+        with open(args.design, "r") as f:
+            design = json.load(f)
+        with open("out_hier.json", "w") as f:
+            json.dump(map_hierarchy(design, args.top, partial(map_module, dsp_rules=dsp_rules, solver=args.solver, threads=args.solver_threads, time_limit=args.time_limit, warm_start=args.warm_start, count=args.dsp_count), workers=args.workers, schema_file=args.schema), f, indent=2)
+        exit(0)
+
+    if args.from_snapshot is not None:
+        if args.backend != "sqlite":
+            parser.error("--from-snapshot requires the sqlite backend")
+        snapshot.load_snapshot(db, args.from_snapshot)
+        test_ilp_extract_dsps_by_count(db, args.top, args.solver, args.solver_threads, args.time_limit, args.warm_start, args.dsp_count)
+        exit(0)
+
+    db.load_json(args.design, args.top)
 
     # rewrite_complex_mul(db)
-    # while rewrite_dff_backward_aby_cell(db, ["$adds", "$subs", "$muls"]) > 0:
+    # delta = Delta()
+    # while rewrite_dff_backward_aby_cell(db, ["$adds", "$subs", "$muls"], delta=delta) > 0:
     #     pass
+    if args.retime_workers is not None:
+        retime_by_clock(db, [Rewrite("dff_backward", rewrite_dff_backward_aby_cell, (["$adds", "$subs", "$muls"],))], workers=args.retime_workers, schema_file=args.schema)
     # rewrite_comm(db, ["$adds", "$muls"])
+    # db.rebuild(verbose=True)
+    print(f"hash-consing cache: {db.cache_stats()}")
 
     # for rule in dsp_rules:
     #     rewrite_dsp(db, rule)
+    if args.parallel_dsp:
+        rewrite_dsps_parallel(db, dsp_rules, workers=args.workers)
 
-    with open("out_rewrite.json", "w") as f:
-        json.dump(db.dump_tables(), f, indent=2)
+    snapshot.dump_snapshot(db, args.snapshot)
 
     # test_greedy_extract_dsps(db, args.top)
-    test_ilp_extract_dsps_by_count(db, args.top)
\ No newline at end of file
+    test_ilp_extract_dsps_by_count(db, args.top, args.solver, args.solver_threads, args.time_limit, args.warm_start, args.dsp_count)
\ No newline at end of file
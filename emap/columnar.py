@@ -0,0 +1,596 @@
+from .db import NetlistDB
+from .stream import iter_module
+import ast
+import re
+import time
+import numpy as np
+from array import array
+from collections import Counter
+from itertools import chain
+from typing import Iterable, Iterator
+
+
+"""
+columnar in-memory backend
+every value of a table is interned into an int64 id (or kept as a plain integer for INTEGER columns),
+so that selections and joins are vectorized over numpy arrays instead of going through SQL
+"""
+
+class _Table:
+    """
+    Columns of int64 ids in growable arrays.
+    Deleted rows are only masked, so the rowid of a row is its index + 1 and never changes.
+    """
+    def __init__(self, columns: tuple[str, ...], key: tuple[str, ...], ints: Iterable[str] = ()):
+        self.columns = columns
+        self.key = tuple(columns.index(col) for col in key)
+        self.ints = set(ints)   # columns holding plain integers instead of interned ids
+        self.data = {col: array("q") for col in columns}
+        self.alive = bytearray()
+        self.keys: dict[tuple, int] = {}    # primary key -> row index
+        self._arrays: dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.alive)
+
+    def column(self, col: str) -> np.ndarray:
+        # copies are cached until the next modification, an exported buffer would block appends
+        res = self._arrays.get(col)
+        if res is None:
+            if col == "alive":
+                res = np.frombuffer(bytes(self.alive), dtype=np.uint8).astype(bool)
+            else:
+                res = np.frombuffer(self.data[col], dtype=np.int64).copy() if self.data[col] else np.empty(0, dtype=np.int64)
+            self._arrays[col] = res
+        return res
+
+    def row(self, index: int) -> tuple[int, ...]:
+        return tuple(self.data[col][index] for col in self.columns)
+
+    def append(self, row: tuple[int, ...]) -> int | None:
+        """
+        Return the index of the new row, None if the primary key exists.
+        """
+        key = tuple(row[i] for i in self.key)
+        if key in self.keys:
+            return None
+        index = self.keys[key] = len(self.alive)
+        for col, value in zip(self.columns, row):
+            self.data[col].append(value)
+        self.alive.append(1)
+        self._arrays.clear()
+        return index
+
+    def delete(self, index: int) -> tuple[int, ...] | None:
+        """
+        Return the deleted row, None if it does not exist.
+        """
+        if not 0 <= index < len(self.alive) or not self.alive[index]:
+            return None
+        row = self.row(index)
+        self.alive[index] = 0
+        del self.keys[tuple(row[i] for i in self.key)]
+        self._arrays.clear()
+        return row
+
+
+# a restricted SELECT: conjunctive joins with comparisons, which covers the built-in match queries and the DSP rules
+_SELECT = re.compile(r"^\s*SELECT\s+(?P<distinct>DISTINCT\s+)?(?P<select>.+?)\s+FROM\s+(?P<from>.+?)(?:\s+WHERE\s+(?P<where>.+?))?\s*;?\s*$", re.I | re.S)
+_UNSUPPORTED = re.compile(r"\b(?:ORDER|GROUP|LIMIT|UNION|HAVING|OR|NOT|LEFT|OUTER)\b", re.I)
+_JOIN = re.compile(r"\s+(?:CROSS\s+|INNER\s+)?JOIN\s+|\s*,\s*", re.I)
+_ON = re.compile(r"\s+ON\s+", re.I)
+_AND = re.compile(r"\s+AND\s+", re.I)
+_TABLE = re.compile(r"^(\w+)(?:\s+(?:AS\s+)?(\w+))?$", re.I)
+_COND = re.compile(r"^(.+?)\s*(<=|>=|<>|!=|==|=|<|>|\bIN\b)\s*(.+)$", re.I | re.S)
+_ALIAS = re.compile(r"^(.+?)\s+AS\s+\w+$", re.I | re.S)
+_STRING = re.compile(r"'((?:[^']|'')*)'")
+_COLUMN = re.compile(r"\b([A-Za-z_]\w*)\.([A-Za-z_]\w*|\*)")
+
+_BINOPS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.floor_divide, ast.FloorDiv: np.floor_divide}
+_CMPOPS = {"=": np.equal, "==": np.equal, "<>": np.not_equal, "!=": np.not_equal, "<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal}
+
+class _Plan:
+    """
+    A parsed SELECT, see `ColumnarDB.query()`.
+    Column references are rewritten into `__c<i>`, string literals into `__s<i>` and parameters into `__p<i>`.
+    """
+    def __init__(self, db: "ColumnarDB", sql: str):
+        strings = []
+        def _string(m: re.Match) -> str:
+            strings.append(m[1].replace("''", "'"))
+            return f"__s{len(strings) - 1}"
+        text = _STRING.sub(_string, sql)
+        nparams = 0
+        while "?" in text:
+            text = text.replace("?", f"__p{nparams}", 1)
+            nparams += 1
+        self.strings, self.nparams = strings, nparams
+
+        m = _SELECT.match(text)
+        if m is None or _UNSUPPORTED.search(text):
+            raise ValueError(f"Unsupported query for the columnar backend: {sql}")
+        self.distinct = m["distinct"] is not None
+
+        # FROM, conditions in ON clauses are merged into WHERE
+        self.aliases: dict[str, str] = {}   # alias -> table
+        conds = []
+        for part in _JOIN.split(m["from"].strip()):
+            spec, *on = _ON.split(part.strip(), 1)
+            mt = _TABLE.match(spec.strip())
+            if mt is None or mt[1] not in db.tables:
+                raise ValueError(f"Unknown table `{spec}` in query: {sql}")
+            self.aliases[mt[2] or mt[1]] = mt[1]
+            conds += on
+        if m["where"]:
+            conds.append(m["where"])
+
+        self.refs: list[tuple[str, str]] = []  # (alias, column)
+        self.select = []    # ast expressions, stars are expanded into the stored columns
+        for item in _split_top(m["select"]):
+            item = item.strip()
+            if item == "*" or item.endswith(".*"):
+                for alias in (self.aliases if item == "*" else [item[:-2]]):
+                    self.select += [ast.Name(id=self._ref(alias, col)) for col in db.tables[self.aliases[alias]].columns]
+                continue
+            ma = _ALIAS.match(item)
+            self.select.append(self._parse(db, ma[1] if ma else item))
+
+        # (lhs, op, rhs, aliases), rhs is a list of expressions for IN
+        self.conds = []
+        for cond in chain.from_iterable(_AND.split(c.strip()) for c in conds):
+            mc = _COND.match(cond.strip())
+            if mc is None:
+                raise ValueError(f"Unsupported condition `{cond}` in query: {sql}")
+            lhs, op, rhs = self._parse(db, mc[1]), mc[2].upper(), mc[3].strip()
+            if op == "IN":
+                rhs = [self._parse(db, x) for x in _split_top(rhs.strip()[1:-1])]
+            else:
+                rhs = self._parse(db, rhs)
+            self.conds.append((lhs, op, rhs, self._aliases_of(lhs, rhs)))
+
+    def _ref(self, alias: str, col: str) -> str:
+        if (alias, col) not in self.refs:
+            self.refs.append((alias, col))
+        return f"__c{self.refs.index((alias, col))}"
+
+    def _parse(self, db: "ColumnarDB", expr: str) -> ast.expr:
+        # qualified columns first, then bare names of a single-table query
+        expr = _COLUMN.sub(lambda m: self._ref(m[1], m[2]), expr)
+        tree = ast.parse(expr.strip(), mode="eval").body
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and not node.id.startswith("__"):
+                if len(self.aliases) != 1:
+                    raise ValueError(f"Ambiguous column `{node.id}`")
+                node.id = self._ref(next(iter(self.aliases)), node.id)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and node.id.startswith("__c"):
+                alias, col = self.refs[int(node.id[3:])]
+                if alias not in self.aliases:
+                    raise ValueError(f"Unknown alias `{alias}`")
+                table = db.tables[self.aliases[alias]]
+                if col != "rowid" and col not in table.columns and not (col.startswith("width_") and col[6:] in table.columns):
+                    raise ValueError(f"Unknown column `{alias}.{col}`")
+        return tree
+
+    def _aliases_of(self, *exprs) -> set[str]:
+        res = set()
+        for expr in exprs:
+            for node in chain.from_iterable(ast.walk(e) for e in (expr if isinstance(expr, list) else [expr])):
+                if isinstance(node, ast.Name) and node.id.startswith("__c"):
+                    res.add(self.refs[int(node.id[3:])][0])
+        return res
+
+def _split_top(text: str) -> list[str]:
+    """
+    Split at the commas outside parentheses.
+    """
+    parts, depth, start = [], 0, 0
+    for i, ch in enumerate(text):
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+def _join_equal(left: np.ndarray, right: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized equi-join, return the index pairs (i, j) with left[i] == right[j].
+    """
+    order = np.argsort(right, kind="stable")
+    sorted_right = right[order]
+    lo = np.searchsorted(sorted_right, left, side="left")
+    hi = np.searchsorted(sorted_right, left, side="right")
+    counts = hi - lo
+    total = int(counts.sum())
+    left_idx = np.repeat(np.arange(len(left)), counts)
+    starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+    return left_idx, order[np.arange(total) + starts]
+
+def _cross(n: int, m: int) -> tuple[np.ndarray, np.ndarray]:
+    return np.repeat(np.arange(n), m), np.tile(np.arange(m), n)
+
+
+class ColumnarDB:
+    """
+    In-memory e-graph backend with the tables of `schema.sql` stored as numpy-friendly columns.
+    It implements the part of the `NetlistDB` API used by the rewrites and the extractors:
+    the execute-free query helpers, `find_or_create_*`, `tables_startswith` and `dump_tables`.
+    `query()` accepts the conjunctive SELECTs of the built-in rewrites and the DSP rules,
+    there is no e-class layer and no transactions.
+    """
+    backend = "numpy"
+    cnt: int
+
+    _SCHEMA = {
+        "ports": (("name", "wire", "direction"), ("name",)),
+        "ay_cells": (NetlistDB.CELL_COLUMNS["ay_cells"], NetlistDB.CELL_COLUMNS["ay_cells"]),
+        "aby_cells": (NetlistDB.CELL_COLUMNS["aby_cells"], NetlistDB.CELL_COLUMNS["aby_cells"]),
+        "absy_cells": (NetlistDB.CELL_COLUMNS["absy_cells"], NetlistDB.CELL_COLUMNS["absy_cells"]),
+        "dffs": (NetlistDB.CELL_COLUMNS["dffs"], NetlistDB.CELL_COLUMNS["dffs"]),
+        "instances": (("id", "module"), ("id",)),
+        "instance_ports": (("instance", "port", "wire"), ("instance", "port")),
+        "instance_params": (("instance", "param", "val"), ("instance", "param")),
+    }
+
+    next_wire = NetlistDB.next_wire
+    next_wires = NetlistDB.next_wires
+
+    def __init__(self, cnt: int = 0):
+        """
+        Arguments:
+        - `cnt`: Initial count for wire generation. Defaults to 0.
+        """
+        self.cnt = cnt
+        self.tables: dict[str, _Table] = {name: _Table(cols, key) for name, (cols, key) in ColumnarDB._SCHEMA.items()}
+        # interned bundles and strings
+        self._values: list = []
+        self._ids: dict = {}
+        self._widths = array("q")
+        self._widths_np: np.ndarray | None = None
+        self._plans: dict[str, _Plan] = {}
+        # per-table deletion counters, inserts are seen from the largest rowid
+        self.changes: dict[str, int] = {}
+        self.rule_versions: dict[tuple, dict[str, tuple[int, int]]] = {}
+        self.read_counts: tuple[dict[str, tuple[int, int]], Counter] | None = None
+        # (type, a, b) -> aby_cells rows and (d, clk) -> dffs rows, for `find_or_create_*`
+        self._aby_index: dict[tuple[int, int, int], list[int]] = {}
+        self._dff_index: dict[tuple[int, int], list[int]] = {}
+        # (table, column) -> (indexed rows, first bit of the bundle -> rows), see `rows_starting_with()`
+        self._prefixes: dict[tuple[str, str], tuple[int, dict[int | None, list[int]]]] = {}
+        self.cache_hits = self.cache_misses = 0
+
+    def _intern(self, value) -> int:
+        id_ = self._ids.get(value)
+        if id_ is None:
+            id_ = self._ids[value] = len(self._values)
+            self._values.append(value)
+            self._widths.append(NetlistDB.width_of(value) if isinstance(value, bytes) else 0)
+            self._widths_np = None
+        return id_
+
+    def _widths_array(self) -> np.ndarray:
+        if self._widths_np is None:
+            self._widths_np = np.frombuffer(self._widths, dtype=np.int64).copy() if self._widths else np.empty(0, dtype=np.int64)
+        return self._widths_np
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+    # tables
+    def create_table(self, table: str, columns: dict[str, str], key: Iterable[str]):
+        if table not in self.tables:
+            self.tables[table] = _Table(tuple(columns), tuple(key), (col for col, type_ in columns.items() if type_.upper() == "INTEGER"))
+
+    def columns_of(self, table: str) -> list[str]:
+        return list(self.tables[table].columns)
+
+    def max_rowid(self, table: str) -> int:
+        return len(self.tables[table])
+
+    def row_count(self, table: str) -> int:
+        return sum(self.tables[table].alive)
+
+    def change_count(self, table: str) -> int:
+        # deleted rows are only masked, rowids are never reused and rows are never updated
+        return 0
+
+    def table_version(self, table: str) -> tuple[int, int]:
+        # a deletion keeps the largest rowid, so it is counted
+        return len(self.tables[table]), self.changes.get(table, 0)
+
+    def tables_startswith(self, prefix: str) -> list[str]:
+        return [name for name in self.tables if name.startswith(prefix)]
+
+    def insert_rows(self, table: str, columns: Iterable[str], rows: Iterable[tuple]) -> int:
+        """
+        INSERT OR IGNORE the rows, return the number of inserted rows.
+        """
+        t = self.tables[table]
+        columns = tuple(columns)
+        order = [columns.index(col) if col in columns else None for col in t.columns]
+        cnt = 0
+        for row in rows:
+            encoded = tuple(
+                (row[i] if col in t.ints else self._intern(row[i])) if i is not None else self._intern(None)
+                for col, i in zip(t.columns, order)
+            )
+            index = t.append(encoded)
+            if index is None:
+                continue
+            cnt += 1
+            if table == "aby_cells":
+                self._aby_index.setdefault(encoded[:3], []).append(index)
+            elif table == "dffs":
+                self._dff_index.setdefault(encoded[:2], []).append(index)
+        return cnt
+
+    def delete_rows(self, table: str, rowids: Iterable[int]) -> int:
+        t = self.tables[table]
+        cnt = 0
+        for rowid in rowids:
+            row = t.delete(rowid - 1)
+            if row is None:
+                continue
+            cnt += 1
+            if table == "aby_cells":
+                self._aby_index[row[:3]].remove(rowid - 1)
+            elif table == "dffs":
+                self._dff_index[row[:2]].remove(rowid - 1)
+        if cnt:
+            self.changes[table] = self.changes.get(table, 0) + cnt
+        return cnt
+
+    def delete_cells(self, table: str, rows: Iterable[tuple]) -> int:
+        """
+        Delete cells given by the values of their `CELL_COLUMNS` (the primary key), return the number of deleted rows.
+        """
+        t = self.tables[table]
+        rowids = []
+        for row in rows:
+            index = t.keys.get(tuple(self._ids.get(value, -1) for value in row))
+            if index is not None:
+                rowids.append(index + 1)
+        return self.delete_rows(table, rowids)
+
+    def find_or_create_aby_cell(self, width: int, type_: str, a: bytes, b: bytes) -> bytes:
+        """
+        Return wire y
+        """
+        rows = self._aby_index.get((self._intern(type_), self._intern(a), self._intern(b)))
+        if rows:
+            self.cache_hits += 1
+            return self._values[self.tables["aby_cells"].data["y"][rows[0]]]
+        self.cache_misses += 1
+        y = self.next_wires(width)
+        self.insert_rows("aby_cells", ("type", "a", "b", "y"), [(type_, a, b, y)])
+        return y
+
+    def find_or_create_dff(self, width: int, d: bytes, clk: bytes) -> bytes:
+        """
+        Return wire q
+        """
+        rows = self._dff_index.get((self._intern(d), self._intern(clk)))
+        if rows:
+            self.cache_hits += 1
+            return self._values[self.tables["dffs"].data["q"][rows[0]]]
+        self.cache_misses += 1
+        q = self.next_wires(width)
+        self.insert_rows("dffs", ("d", "clk", "q"), [(d, clk, q)])
+        return q
+
+    def cache_stats(self) -> dict:
+        """
+        Return the hit/miss counters of `find_or_create_*`, every lookup is served by an in-memory index.
+        """
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "hit_rate": self.cache_hits / lookups if lookups else 0.0,
+            "evictions": 0,
+            "aby_cells": len(self._aby_index),
+            "dffs": len(self._dff_index),
+        }
+
+    def rows_starting_with(self, table: str, col: str, bits: Iterable[int]) -> list[tuple[int, bytes]]:
+        """
+        Return (rowid, bundle) of the rows whose bundle in `col` starts with one of `bits` or is empty.
+        The index of the first bits only grows by the rows appended since the last call, deleted rows are skipped.
+        """
+        t = self.tables[table]
+        size, index = self._prefixes.get((table, col), (0, {}))
+        data = t.data[col]
+        for i in range(size, len(t)):
+            bundle = self._values[data[i]]
+            index.setdefault(NetlistDB.bits_of(bundle)[0] if bundle else None, []).append(i)
+        self._prefixes[(table, col)] = (len(t), index)
+        return [
+            (i + 1, self._values[data[i]])
+            for bit in chain([None], bits) for i in index.get(bit, ()) if t.alive[i]
+        ]
+
+    def eclass_of(self, bundle: bytes) -> None:
+        # no e-class layer in this backend
+        return None
+
+    # queries
+    def query(self, sql: str, params: Iterable = ()) -> list[tuple]:
+        """
+        Evaluate a SELECT over the tables with vectorized selections and equi-joins.
+        Supported: `alias.column`, `rowid`, `width_<column>`, `*`, arithmetic, `AS`, `DISTINCT`,
+        [CROSS] JOIN ... ON and WHERE with AND-ed comparisons and IN lists.
+        """
+        plan = self._plans.get(sql)
+        if plan is None:
+            plan = self._plans[sql] = _Plan(self, sql)
+        params = tuple(params)
+        if len(params) != plan.nparams:
+            raise ValueError(f"Expected {plan.nparams} parameters, got {len(params)}")
+
+        bound: dict[str, np.ndarray] = {}   # alias -> row indices, all of the same length
+
+        def value_of(node: ast.expr, rows: dict[str, np.ndarray]):
+            if isinstance(node, ast.Constant):
+                return node.value
+            if isinstance(node, ast.Name):
+                kind, i = node.id[:3], int(node.id[3:])
+                if kind == "__s":
+                    return self._ids.get(plan.strings[i], -1)
+                if kind == "__p":
+                    param = params[i]
+                    return param if isinstance(param, int) else self._ids.get(param, -1)
+                alias, col = plan.refs[i]
+                indices = rows[alias]
+                if col == "rowid":
+                    return indices + 1
+                table = self.tables[plan.aliases[alias]]
+                if col in table.columns:
+                    return table.column(col)[indices]
+                return self._widths_array()[table.column(col[6:])[indices]]
+            if isinstance(node, ast.BinOp) and type(node.op) in _BINOPS:
+                return _BINOPS[type(node.op)](value_of(node.left, rows), value_of(node.right, rows))
+            if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+                value = value_of(node.operand, rows)
+                return value if isinstance(node.op, ast.UAdd) else -value
+            raise ValueError(f"Unsupported expression: {ast.unparse(node)}")
+
+        def holds(cond, rows: dict[str, np.ndarray]) -> np.ndarray:
+            lhs, op, rhs, _ = cond
+            if op == "IN":
+                return np.isin(value_of(lhs, rows), [value_of(x, rows) for x in rhs])
+            return _CMPOPS[op](value_of(lhs, rows), value_of(rhs, rows))
+
+        # selections, `rowid = ?` is a direct lookup
+        def is_rowid_lookup(cond) -> bool:
+            lhs, op, rhs, _ = cond
+            return op == "=" and isinstance(lhs, ast.Name) and plan.refs[int(lhs.id[3:])][1] == "rowid" and not plan._aliases_of(rhs)
+
+        candidates: dict[str, np.ndarray] = {}
+        for alias, table in plan.aliases.items():
+            t = self.tables[table]
+            conds = [cond for cond in plan.conds if cond[3] == {alias}]
+            lookups = [cond for cond in conds if is_rowid_lookup(cond)]
+            if lookups:
+                index = value_of(lookups[0][2], {}) - 1
+                indices = np.array([index] if 0 <= index < len(t) and t.alive[index] else [], dtype=np.int64)
+            else:
+                indices = np.flatnonzero(t.column("alive"))
+            for cond in conds:
+                indices = indices[np.broadcast_to(holds(cond, {alias: indices}), indices.shape)]
+            candidates[alias] = indices
+        # constant conditions
+        if not all(np.all(holds(cond, {})) for cond in plan.conds if not cond[3]):
+            candidates = {alias: indices[:0] for alias, indices in candidates.items()}
+        applied = {id(cond) for cond in plan.conds if len(cond[3]) <= 1}
+
+        # joins, start from the smallest selection and follow equalities between columns
+        def join_key(cond, alias: str):
+            lhs, op, rhs, aliases = cond
+            if op != "=" or len(aliases) != 2 or alias not in aliases or not isinstance(lhs, ast.Name) or not isinstance(rhs, ast.Name):
+                return None
+            if not (aliases - {alias}) <= bound.keys():
+                return None
+            return (lhs, rhs) if plan.refs[int(rhs.id[3:])][0] == alias else (rhs, lhs)
+
+        while len(bound) < len(plan.aliases):
+            rest = [alias for alias in plan.aliases if alias not in bound]
+            joinable = [(alias, cond) for alias in rest for cond in plan.conds if id(cond) not in applied and join_key(cond, alias)]
+            if not bound or not joinable:
+                alias = min(rest, key=lambda a: len(candidates[a]))
+                if not bound:
+                    bound[alias] = candidates[alias]
+                else:
+                    n = len(next(iter(bound.values())))
+                    left_idx, right_idx = _cross(n, len(candidates[alias]))
+                    bound = {a: indices[left_idx] for a, indices in bound.items()}
+                    bound[alias] = candidates[alias][right_idx]
+            else:
+                alias, cond = min(joinable, key=lambda x: len(candidates[x[0]]))
+                left, right = join_key(cond, alias)
+                left_idx, right_idx = _join_equal(
+                    np.asarray(value_of(left, bound)),
+                    np.asarray(value_of(right, {alias: candidates[alias]}))
+                )
+                bound = {a: indices[left_idx] for a, indices in bound.items()}
+                bound[alias] = candidates[alias][right_idx]
+                applied.add(id(cond))
+            # filters whose aliases are all bound
+            for cond in plan.conds:
+                if id(cond) not in applied and cond[3] <= bound.keys():
+                    mask = holds(cond, bound)
+                    bound = {a: indices[mask] for a, indices in bound.items()}
+                    applied.add(id(cond))
+
+        # projection, interned ids are decoded back into values
+        n = len(next(iter(bound.values()))) if bound else 0
+        columns = []
+        for expr in plan.select:
+            value = value_of(expr, bound)
+            if isinstance(expr, ast.Name) and expr.id.startswith("__c"):
+                alias, col = plan.refs[int(expr.id[3:])]
+                table = self.tables[plan.aliases[alias]]
+                if col in table.columns and col not in table.ints:
+                    columns.append([self._values[i] for i in value.tolist()])
+                    continue
+            if isinstance(expr, ast.Name) and expr.id.startswith("__s"):
+                columns.append([plan.strings[int(expr.id[3:])]] * n)
+                continue
+            columns.append(np.broadcast_to(value, (n,)).tolist())
+        rows = list(zip(*columns))
+        return list(dict.fromkeys(rows)) if plan.distinct else rows
+
+    # loading
+    def _insert_items(self, items: Iterable[tuple[str, str, dict]], submodules: Iterable[str] = ()) -> int:
+        cnt = 0
+        for kind, name, value in items:
+            rows = NetlistDB._port_rows(name, value) if kind == "port" else NetlistDB._cell_rows(name, value, submodules)
+            for table, row in rows:
+                cnt += self.insert_rows(table, self.tables[table].columns, [row])
+        return cnt
+
+    def build_from_json(self, mod: dict, submodules: Iterable[str] = ()):
+        self._insert_items(chain(
+            (("port", name, port) for name, port in mod["ports"].items()),
+            (("cell", name, cell) for name, cell in mod["cells"].items())
+        ), frozenset(submodules))
+
+    def load_json(self, json_file: str, top: str) -> int:
+        """
+        Stream module `top` from a Yosys JSON file, see `NetlistDB.load_json()`.
+        Return the number of rows.
+        """
+        phase_time = time.time()
+        with open(json_file, "r") as f:
+            cnt = self._insert_items(iter_module(f, top))
+        elapsed = time.time() - phase_time
+        print(f"load_json() loaded {cnt} rows in {elapsed:.2f} seconds ({cnt / max(elapsed, 1e-9):.0f} rows/s).")
+        return cnt
+
+    def iter_rows(self, table: str) -> Iterator[tuple]:
+        """
+        Yield (rowid, *values) for every row of the table.
+        """
+        t = self.tables[table]
+        for index in np.flatnonzero(t.column("alive")).tolist():
+            yield (index + 1, *(value if col in t.ints else self._values[value] for col, value in zip(t.columns, t.row(index))))
+
+    def dump_tables(self) -> dict:
+        db = {}
+        for table, t in self.tables.items():
+            # the width columns are generated in `schema.sql`, so they are dumped as well
+            widths = [col for col in t.columns if table in NetlistDB.CELL_COLUMNS and col != "type"]
+            db[table] = [
+                {
+                    **{col: NetlistDB.to_bits(v) if isinstance(v, bytes) else v for col, v in zip(t.columns, row)},
+                    **{f"width_{col}": NetlistDB.width_of(row[t.columns.index(col)]) for col in widths}
+                }
+                for _, *row in self.iter_rows(table)
+            ]
+        return db
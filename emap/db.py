@@ -1,128 +1,662 @@
+from .stream import iter_module
 import sqlite3
-from typing import Iterable
+import time
+from array import array
+from collections import Counter, OrderedDict
+from itertools import chain
+from typing import Iterable, Iterator
 
 
 class NetlistDB(sqlite3.Connection):
+    """
+    Wire bundles are stored as BLOBs of packed int32 bits.
+    Real wires keep their Yosys ids (>= 2), constant bits are encoded as below.
+    Comparing two bundles is a plain memcmp in SQLite and never parses text.
+    """
     cnt: int
+    cache_size: int | None
+
+    CONST_BITS = {"0": 0, "1": 1, "x": -1, "z": -2}
+    CONST_NAMES = {v: k for k, v in CONST_BITS.items()}
+    BIT_SIZE = array("i").itemsize
+
+    # stored columns of the cell tables, the generated width_* columns are excluded
+    CELL_COLUMNS = {
+        "ay_cells": ("type", "a", "y"),
+        "aby_cells": ("type", "a", "b", "y"),
+        "absy_cells": ("type", "a", "b", "s", "y"),
+        "dffs": ("d", "clk", "q"),
+    }
 
     # auxiliary functions
     @staticmethod
-    def to_str(v: Iterable) -> str:
-        return ",".join(str(x) for x in v)
+    def to_bundle(bits: Iterable[int | str]) -> bytes:
+        """
+        Convert Yosys JSON bits into a bundle.
+        """
+        return array("i", (NetlistDB.CONST_BITS[x] if isinstance(x, str) else x for x in bits)).tobytes()
 
     @staticmethod
-    def width_of(s: str) -> int:
-        return s.count(",") + 1 if s else 0
+    def bits_of(bundle: bytes) -> array:
+        """
+        Return the integer bits of a bundle.
+        """
+        bits = array("i")
+        bits.frombytes(bundle)
+        return bits
 
     @staticmethod
-    def to_bits(s: str) -> list[int | str]:
-        return [x if x in {"0", "1", "x"} else int(x) for x in s.split(",")]
+    def to_set(*bundles: bytes) -> set[int]:
+        """
+        Return the union of the integer bits of the given bundles.
+        """
+        return set(chain.from_iterable(NetlistDB.bits_of(bundle) for bundle in bundles))
+
+    @staticmethod
+    def width_of(bundle: bytes) -> int:
+        return len(bundle) // NetlistDB.BIT_SIZE if bundle else 0
+
+    @staticmethod
+    def split_at(bundle: bytes, n: int) -> tuple[bytes, bytes]:
+        """
+        Split a bundle into its lowest `n` bits and the rest.
+        """
+        n *= NetlistDB.BIT_SIZE
+        return bundle[:n], bundle[n:]
+
+    @staticmethod
+    def to_bits(bundle: bytes) -> list[int | str]:
+        """
+        Convert a bundle back into Yosys JSON bits.
+        """
+        return [NetlistDB.CONST_NAMES[x] if x < 2 else x for x in NetlistDB.bits_of(bundle)]
 
     @staticmethod
     def to_int(x: str | int) -> int:
         return x if isinstance(x, int) else int(x, base=2)
 
-    def find_or_create_aby_cell(self, width: int, type_: str, a: str, b: str) -> str:
+    def find_or_create_aby_cell(self, width: int, type_: str, a: bytes, b: bytes) -> bytes:
         """
         Return wire y
         """
+        key = (type_, a, b)
+        y = self._cache_get(self._aby_cache, key)
+        if y is not None:
+            return y
         cur = self.execute("SELECT y FROM aby_cells WHERE type = ? AND a = ? AND b = ?", (type_, a, b))
         res = cur.fetchone()
         if res is None:  # not exists
             y = self.next_wires(width)
             self.execute("INSERT INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", (type_, a, b, y))
-            return y
         else:
-            return res[0]
+            y = res[0]
+        self._cache_put(self._aby_cache, key, y)
+        return y
 
-    def find_or_create_dff(self, width: int, d: str, clk: str) -> str:
+    def find_or_create_dff(self, width: int, d: bytes, clk: bytes) -> bytes:
         """
         Return wire q
         """
+        key = (d, clk)
+        q = self._cache_get(self._dff_cache, key)
+        if q is not None:
+            return q
         cur = self.execute("SELECT q FROM dffs WHERE d = ? AND clk = ?", (d, clk))
         res = cur.fetchone()
         if res is None:
             q = self.next_wires(width)
             self.execute("INSERT INTO dffs (d, clk, q) VALUES (?, ?, ?)", (d, clk, q))
-            return q
         else:
-            return res[0]
+            q = res[0]
+        self._cache_put(self._dff_cache, key, q)
+        return q
+
+    def find_or_create_aby_cells(self, table: str, out: str, type_: str, a: str, b: str, width: str) -> int:
+        """
+        Set-based `find_or_create_aby_cell()` over the rows of the staging table `table`, aliased as `m`.
+        `type_`, `a`, `b` and `width` are SQL expressions over `m`, the y of each cell is written to column `out`.
+        Missing cells get fresh wires, one cell per distinct (type, a, b) with the width of its first row.
+        Return the number of created cells.
+        """
+        resolve = f"""
+            UPDATE {table} AS m SET {out} = (SELECT y FROM aby_cells WHERE type = {type_} AND a = {a} AND b = {b})
+            WHERE {out} IS NULL
+        """
+        self.execute(resolve)
+        # bare columns of a min() aggregate come from the row with the smallest rowid
+        missing = self.execute(f"""
+            SELECT {type_}, {a}, {b}, {width}, min(m.rowid) FROM {table} AS m WHERE {out} IS NULL
+            GROUP BY 1, 2, 3 ORDER BY 5
+        """).fetchall()
+        self.executemany(
+            "INSERT INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)",
+            [(type_, a, b, self.next_wires(width)) for type_, a, b, width, _ in missing]
+        )
+        if missing:
+            self.execute(resolve)
+        return len(missing)
+
+    # hash-consing
+    # `find_or_create_*` look up (type, a, b) -> y and (d, clk) -> q in memory before querying
+    # TEMP triggers evict the entry of a deleted or updated row, so raw SQL keeps the caches coherent
+    _HASHCONS_TRIGGERS = """
+    CREATE TEMP TRIGGER IF NOT EXISTS aby_cells_hashcons_delete AFTER DELETE ON main.aby_cells
+    BEGIN
+        SELECT hashcons_evict_aby(old.type, old.a, old.b, old.y);
+    END;
+    CREATE TEMP TRIGGER IF NOT EXISTS aby_cells_hashcons_update AFTER UPDATE OF type, a, b, y ON main.aby_cells
+    BEGIN
+        SELECT hashcons_evict_aby(old.type, old.a, old.b, old.y);
+    END;
+    CREATE TEMP TRIGGER IF NOT EXISTS dffs_hashcons_delete AFTER DELETE ON main.dffs
+    BEGIN
+        SELECT hashcons_evict_dff(old.d, old.clk, old.q);
+    END;
+    CREATE TEMP TRIGGER IF NOT EXISTS dffs_hashcons_update AFTER UPDATE OF d, clk, q ON main.dffs
+    BEGIN
+        SELECT hashcons_evict_dff(old.d, old.clk, old.q);
+    END;
+    """
+
+    def _cache_get(self, cache: OrderedDict, key: tuple) -> bytes | None:
+        out = cache.get(key)
+        if out is None:
+            self.cache_misses += 1
+        else:
+            self.cache_hits += 1
+            if self.cache_size is not None:
+                cache.move_to_end(key)
+        return out
+
+    def _cache_put(self, cache: OrderedDict, key: tuple, out: bytes):
+        cache[key] = out
+        if self.cache_size is not None and len(cache) > self.cache_size:
+            cache.popitem(last=False)   # least recently used
+            self.cache_evictions += 1
+
+    def _cache_evict(self, cache: OrderedDict, key: tuple, out: bytes):
+        # another row with the same inputs may be cached, keep it
+        if cache.get(key) == out:
+            del cache[key]
+
+    def clear_cache(self):
+        self._aby_cache.clear()
+        self._dff_cache.clear()
+
+    def cache_stats(self) -> dict:
+        """
+        Return the hit/miss counters and the sizes of the hash-consing caches.
+        """
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "hit_rate": self.cache_hits / lookups if lookups else 0.0,
+            "evictions": self.cache_evictions,
+            "aby_cells": len(self._aby_cache),
+            "dffs": len(self._dff_cache),
+        }
+
+    def rollback(self):
+        # cached rows may have been inserted by the rolled back transaction
+        self.clear_cache()
+        self.read_counts = None
+        super().rollback()
+        # the triggers may have been created by the rolled back transaction
+        self._eclass_triggers = False
+        self.track_eclasses()
+
+    # e-classes
+    # a union-find over bundles, `eclasses.root` is the canonical id of the e-class
+    # the `eclass` column of a cell table caches the root of its output bundle, NULL if the bundle is not registered,
+    # `find()`, `union()` and `rebuild()` keep it up to date, and the triggers of `track_eclasses()` on insert
+    def track_eclasses(self):
+        """
+        Give the rows inserted into the cell tables the e-class of their output, once `eclasses` has rows.
+        The TEMP triggers double the cost of an insert, so an e-graph without e-classes goes without them.
+        """
+        if self._eclass_triggers or self.execute("SELECT 1 FROM eclasses LIMIT 1").fetchone() is None:
+            return
+        for table, cols in NetlistDB.CELL_COLUMNS.items():
+            self.execute(f"""
+                CREATE TEMP TRIGGER IF NOT EXISTS {table}_eclass_insert AFTER INSERT ON main.{table}
+                WHEN new.eclass IS NULL AND EXISTS (SELECT 1 FROM eclasses WHERE bundle = new.{cols[-1]})
+                BEGIN
+                    UPDATE {table} SET eclass = (SELECT root FROM eclasses WHERE bundle = new.{cols[-1]}) WHERE rowid = new.rowid;
+                END
+            """)
+        self._eclass_triggers = True
+
+    def eclass_of(self, bundle: bytes) -> int | None:
+        """
+        Return the canonical id of the e-class of the bundle, None if the bundle is not registered.
+        """
+        res = self.execute("SELECT root FROM eclasses WHERE bundle = ?", (bundle,)).fetchone()
+        return None if res is None else res[0]
+
+    def find(self, bundle: bytes) -> int:
+        """
+        Return the canonical id of the e-class of the bundle, registering it if needed.
+        """
+        if self.execute("INSERT OR IGNORE INTO eclasses (bundle) VALUES (?)", (bundle,)).rowcount:
+            self.track_eclasses()
+            root = self.eclass_of(bundle)
+            for table, cols in NetlistDB.CELL_COLUMNS.items():
+                self.execute(f"UPDATE {table} SET eclass = ? WHERE {cols[-1]} = ?", (root, bundle))
+            return root
+        return self.eclass_of(bundle)
+
+    def union(self, bundle1: bytes, bundle2: bytes) -> bool:
+        """
+        Merge the e-classes of two bundles, the smaller e-class is relabeled.
+        Return False if they are already in the same e-class.
+        Call `rebuild()` afterwards to merge the rows that became congruent.
+        """
+        root1, root2 = self.find(bundle1), self.find(bundle2)
+        if root1 == root2:
+            return False
+        size1, size2 = (self.execute("SELECT count(*) FROM eclasses WHERE root = ?", (root,)).fetchone()[0] for root in (root1, root2))
+        if size1 < size2:
+            root1, root2 = root2, root1
+        self.execute("UPDATE eclasses SET root = ? WHERE root = ?", (root1, root2))
+        for table in NetlistDB.CELL_COLUMNS:
+            self.execute(f"UPDATE {table} SET eclass = ? WHERE eclass = ?", (root1, root2))
+        return True
+
+    def same_eclass(self, bundle1: bytes, bundle2: bytes) -> bool:
+        root1 = self.eclass_of(bundle1)
+        return root1 is not None and root1 == self.eclass_of(bundle2)
+
+    def referenced_bits(self, cells: bool = True) -> set[int]:
+        """
+        Return the bits read by any row: cell inputs, ports, blackbox ports and DSP proposal inputs.
+        Set `cells` to False to leave out the inputs of the cell tables.
+        """
+        bits = set()
+        for table, cols in NetlistDB.CELL_COLUMNS.items() if cells else ():
+            for col in cols[:-1]:
+                if col != "type":
+                    for (bundle,) in self.execute(f"SELECT DISTINCT {col} FROM {table}"):
+                        bits.update(NetlistDB.bits_of(bundle))
+        for (bundle,) in self.execute("SELECT wire FROM ports UNION SELECT wire FROM instance_ports"):
+            bits.update(NetlistDB.bits_of(bundle))
+        # DSP proposal tables, `value` first and the output last
+        known = {*NetlistDB.CELL_COLUMNS, "ports", "eclasses", "instances", "instance_params", "instance_ports"}
+        cur = self.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+        for (table,) in cur.fetchall():
+            if table in known:
+                continue
+            cols = [row[1] for row in self.execute(f"PRAGMA table_info({table})")]
+            for col in cols[1:-1]:
+                for (bundle,) in self.execute(f"SELECT DISTINCT {col} FROM {table}"):
+                    if isinstance(bundle, bytes):
+                        bits.update(NetlistDB.bits_of(bundle))
+        return bits
+
+    def rebuild(self, verbose: bool = False) -> int:
+        """
+        Restore congruence after rewrites: two rows with the same type and equivalent inputs
+        have equivalent outputs. Then merge rows:
+        - rows with the same output and equivalent inputs, the row with canonical inputs (or the oldest row) is kept;
+        - rows with an equivalent output that nothing reads.
+        Finally refresh the `eclass` column of the cell tables, rows inserted later get it from a trigger.
+        Return the number of e-class merges.
+        """
+        phase_time = time.time()
+        for table, cols in NetlistDB.CELL_COLUMNS.items():
+            for col in cols:
+                if col != "type":
+                    self.execute(f"INSERT OR IGNORE INTO eclasses (bundle) SELECT DISTINCT {col} FROM {table}")
+        self.track_eclasses()
+        ids: dict[bytes, int] = dict(self.execute("SELECT bundle, id FROM eclasses"))
+        parent: dict[int, int] = dict(self.execute("SELECT id, root FROM eclasses"))
+        old_roots = dict(parent)
+        size: dict[int, int] = {}
+        for root in parent.values():
+            size[root] = size.get(root, 0) + 1
+
+        def find(x: int) -> int:
+            root = x
+            while parent[root] != root:
+                root = parent[root]
+            while parent[x] != root:
+                parent[x], x = root, parent[x]
+            return root
+
+        rows = {
+            table: self.execute(f"SELECT rowid, {', '.join(cols)} FROM {table}").fetchall()
+            for table, cols in NetlistDB.CELL_COLUMNS.items()
+        }
+
+        def key_of(table: str, row: tuple) -> tuple:
+            # the output is the last column, the type is kept as is
+            *inputs, out = row[1:]
+            return (table, *(x if isinstance(x, str) else find(ids[x]) for x in inputs), len(out))
+
+        # congruence closure, iterate until no more merges
+        merges = 0
+        changed = True
+        while changed:
+            changed = False
+            outputs: dict[tuple, int] = {}
+            for table, table_rows in rows.items():
+                for row in table_rows:
+                    out = find(ids[row[-1]])
+                    other = find(outputs.setdefault(key_of(table, row), out))
+                    if other != out:
+                        if size[other] < size[out]:
+                            other, out = out, other
+                        parent[out] = other
+                        size[other] += size[out]
+                        merges += 1
+                        changed = True
+
+        self.executemany("UPDATE eclasses SET root = ? WHERE id = ?", (
+            (root, id_) for id_ in parent if (root := find(id_)) != old_roots[id_]
+        ))
+
+        # merge rows of the same congruence group, deleting a row may make another row unread
+        # the reads of the cell rows are counted once and decremented as rows are deleted
+        external = self.referenced_bits(cells=False)
+        reads = Counter()
+        for table_rows in rows.values():
+            for row in table_rows:
+                for x in row[1:-1]:
+                    if isinstance(x, bytes):
+                        reads.update(NetlistDB.bits_of(x))
+
+        def referenced(bundle: bytes) -> bool:
+            return any(reads[bit] > 0 or bit in external for bit in NetlistDB.bits_of(bundle))
+
+        deleted = 0
+        changed = True
+        while changed:
+            changed = False
+            groups: dict[tuple, list[tuple[str, tuple]]] = {}
+            for table, table_rows in rows.items():
+                for row in table_rows:
+                    groups.setdefault(key_of(table, row), []).append((table, row))
+            to_delete: list[tuple[str, tuple]] = []
+            for group in groups.values():
+                if len(group) == 1:
+                    continue
+                # prefer rows whose inputs are canonical, then older rows
+                group.sort(key=lambda item: (
+                    any(ids[x] != find(ids[x]) for x in item[1][1:-1] if isinstance(x, bytes)),
+                    item[1][0]
+                ))
+                keeper = group[0][1][-1]
+                seen = set()
+                for table, row in group:
+                    out = row[-1]
+                    if out in seen or (out != keeper and not referenced(out)):
+                        to_delete.append((table, row))
+                    seen.add(out)
+            for table in rows:
+                rowids = {row[0] for table_, row in to_delete if table_ == table}
+                if rowids:
+                    self.executemany(f"DELETE FROM {table} WHERE rowid = ?", ((rowid,) for rowid in rowids))
+                    for row in rows[table]:
+                        if row[0] in rowids:
+                            for x in row[1:-1]:
+                                if isinstance(x, bytes):
+                                    reads.subtract(NetlistDB.bits_of(x))
+                    rows[table] = [row for row in rows[table] if row[0] not in rowids]
+                    changed = True
+            deleted += len(to_delete)
+
+        for table, cols in NetlistDB.CELL_COLUMNS.items():
+            self.execute(f"UPDATE {table} SET eclass = (SELECT root FROM eclasses WHERE bundle = {table}.{cols[-1]})")
+        self.commit()
+
+        if verbose:
+            print(f"rebuild() merged {merges} e-classes and deleted {deleted} rows in {time.time() - phase_time:.2f} seconds.")
+        return merges
+
+    # execute-free query helpers
+    # rewrites and extractors go through these so that they also run on `emap.columnar.ColumnarDB`
+    backend = "sqlite"
+
+    def query(self, sql: str, params: Iterable = ()) -> list[tuple]:
+        return self.execute(sql, tuple(params)).fetchall()
+
+    def insert_rows(self, table: str, columns: Iterable[str], rows: Iterable[tuple]) -> int:
+        """
+        INSERT OR IGNORE the rows, return the number of inserted rows.
+        """
+        columns = tuple(columns)
+        cur = self.executemany(
+            f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            rows
+        )
+        return cur.rowcount
+
+    def delete_rows(self, table: str, rowids: Iterable[int]) -> int:
+        cur = self.executemany(f"DELETE FROM {table} WHERE rowid = ?", ((rowid,) for rowid in rowids))
+        return cur.rowcount
+
+    def delete_cells(self, table: str, rows: Iterable[tuple]) -> int:
+        """
+        Delete cells given by the values of their `CELL_COLUMNS` (the primary key), return the number of deleted rows.
+        """
+        cols = NetlistDB.CELL_COLUMNS[table]
+        cur = self.executemany(f"DELETE FROM {table} WHERE {' AND '.join(f'{col} = ?' for col in cols)}", rows)
+        return cur.rowcount
+
+    def create_table(self, table: str, columns: dict[str, str], key: Iterable[str]):
+        """
+        Create a table from {column: SQL type} with the primary key `key`.
+        """
+        self.execute("CREATE TABLE IF NOT EXISTS {} ({}, PRIMARY KEY ({}));".format(
+            table,
+            ",".join(f"{col} {type_}" for col, type_ in columns.items()),
+            ",".join(key)
+        ))
+        self.count_changes(table)
+
+    def columns_of(self, table: str) -> list[str]:
+        """
+        Return the stored columns of the table, generated columns are excluded.
+        """
+        return [row[1] for row in self.execute(f"PRAGMA table_info({table})")]
+
+    def max_rowid(self, table: str) -> int:
+        return self.execute(f"SELECT max(rowid) FROM {table}").fetchone()[0] or 0
+
+    def row_count(self, table: str) -> int:
+        return self.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+    def change_count(self, table: str) -> int:
+        """
+        Return the number of rows deleted from the table, or updated (in its cell columns for a cell table), so far.
+        SQLite may reuse the rowids above the largest remaining one, see `emap.rewrites.Delta`.
+        """
+        return self.changes.get(table, 0)
+
+    def table_version(self, table: str) -> tuple[int, int]:
+        """
+        Return the version of the table, it differs from every earlier version once a row was inserted,
+        deleted or updated, see `change_count()` (`eclass` updates by `rebuild()` do not count).
+        Rewrites compare versions to skip re-running on unchanged tables, see `emap.rewrites.tracked`.
+        """
+        return self.max_rowid(table), self.changes.get(table, 0)
 
     def tables_startswith(self, prefix: str) -> list[str]:
         cur = self.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE ?;", (prefix + "%",))
         return [row[0] for row in cur.fetchall()]
 
-    def next_wire(self) -> str:
+    def next_wire(self) -> int:
         self.cnt += 1
-        return str(self.cnt)
+        return self.cnt
 
-    def next_wires(self, n: int) -> str:
-        return ",".join(self.next_wire() for _ in range(n))
+    def next_wires(self, n: int) -> bytes:
+        bundle = array("i", range(self.cnt + 1, self.cnt + n + 1)).tobytes()
+        self.cnt += n
+        return bundle
 
-    def __init__(self, schema_file: str, db_file: str, cnt: int = 0):
+    def __init__(self, schema_file: str, db_file: str, cnt: int = 0, cache_size: int | None = None):
         """
         Arguments:
         - `schema_file`: Path to the SQL schema file.
         - `db_file`: Path to the SQLite database file. Use ":memory:" for an in-memory database.
         - `cnt`: Initial count for wire generation. Defaults to 0.
+        - `cache_size`: Maximum number of entries per hash-consing cache, least recently used entries are evicted. Defaults to unbounded.
         """
         super().__init__(db_file)
         with open(schema_file, "r") as f:
             self.executescript(f.read())
         self.cnt = cnt
-        self.create_function("width_of", 1, NetlistDB.width_of)
+        # NOTE: prefer the stored width_* columns, this callback is kept for ad-hoc queries
+        self.create_function("width_of", 1, NetlistDB.width_of, deterministic=True)
 
-    def build_from_json(self, mod: dict):
-        ports: dict = mod["ports"]
-        cells: dict = mod["cells"]
+        self.cache_size = cache_size
+        self.cache_hits = self.cache_misses = self.cache_evictions = 0
+        self._aby_cache: OrderedDict[tuple[str, bytes, bytes], bytes] = OrderedDict()
+        self._dff_cache: OrderedDict[tuple[bytes, bytes], bytes] = OrderedDict()
+        self.create_function("hashcons_evict_aby", 4, lambda type_, a, b, y: self._cache_evict(self._aby_cache, (type_, a, b), y))
+        self.create_function("hashcons_evict_dff", 3, lambda d, clk, q: self._cache_evict(self._dff_cache, (d, clk), q))
+        self.executescript(NetlistDB._HASHCONS_TRIGGERS)
+
+        # per-table change counters, inserts are seen from the largest rowid
+        self.changes: dict[str, int] = {}
+        # {(rewrite, arguments): versions of the tables it read}, see `emap.rewrites.tracked`
+        self.rule_versions: dict[tuple, dict[str, tuple[int, int]]] = {}
+        # (versions of the tables, read counts of the bits) of the last subsumption, see `emap.rewrites.subsume`
+        self.read_counts: tuple[dict[str, tuple[int, int]], Counter] | None = None
+        self.create_function("count_change", 1, lambda table: self.changes.__setitem__(table, self.changes.get(table, 0) + 1))
+        for table in self.tables_startswith(""):
+            if table != "eclasses":     # maintained by `union()` and `rebuild()`, read by no rewrite
+                self.count_changes(table)
+        self._eclass_triggers = False
+        self.track_eclasses()
+
+    def count_changes(self, table: str):
+        """
+        Count the deletions and updates of the table in `change_count()`, updates of a cell table only in its cell columns.
+        Tables created by `create_table()` are counted already.
+        """
+        of = f" OF {', '.join(NetlistDB.CELL_COLUMNS[table])}" if table in NetlistDB.CELL_COLUMNS else ""
+        self.execute(f"CREATE TEMP TRIGGER IF NOT EXISTS {table}_count_delete AFTER DELETE ON main.{table} BEGIN SELECT count_change('{table}'); END")
+        self.execute(f"CREATE TEMP TRIGGER IF NOT EXISTS {table}_count_update AFTER UPDATE{of} ON main.{table} BEGIN SELECT count_change('{table}'); END")
+
+    _INSERTS = {
+        "ports": "INSERT INTO ports (name, wire, direction) VALUES (?, ?, ?)",
+        "aby_cells": "INSERT INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)",
+        "dffs": "INSERT OR IGNORE INTO dffs (d, clk, q) VALUES (?, ?, ?)",
+        "absy_cells": "INSERT INTO absy_cells (type, a, b, s, y) VALUES (?, ?, ?, ?, ?)",
+        "ay_cells": "INSERT INTO ay_cells (type, a, y) VALUES (?, ?, ?)",
+        "instances": "INSERT INTO instances (id, module) VALUES (?, ?)",
+        "instance_params": "INSERT INTO instance_params (instance, param, val) VALUES (?, ?, ?)",
+        "instance_ports": "INSERT INTO instance_ports (instance, port, wire) VALUES (?, ?, ?)",
+    }
+
+    @staticmethod
+    def _port_rows(name: str, port: dict) -> Iterator[tuple[str, tuple]]:
+        yield "ports", (name, NetlistDB.to_bundle(port["bits"]), port["direction"])
 
-        # build ports
-        db_ports = [(name, NetlistDB.to_str(port["bits"]), port["direction"]) for name, port in ports.items()]
-        self.executemany("INSERT INTO ports (name, wire, direction) VALUES (?, ?, ?)", db_ports)
-
-        # build cells
-        for name, cell in cells.items():
-            type_: str = cell["type"]
-            params: dict = cell["parameters"]
-            conns: dict = cell["connections"]
-            if type_ in {"$and", "$or", "$xor", "$add", "$sub", "$mul", "$mod"}:
-                type_ += "s" if NetlistDB.to_int(params["A_SIGNED"]) and NetlistDB.to_int(params["B_SIGNED"]) else "u"
-                a, b, y = NetlistDB.to_str(conns["A"]), NetlistDB.to_str(conns["B"]), NetlistDB.to_str(conns["Y"])
-                self.execute("INSERT INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", (type_, a, b, y))
-            elif type_ == "$dff":
-                if not NetlistDB.to_int(params["CLK_POLARITY"]):
-                    raise ValueError("$dff with negative clock polarity is not supported")
-                d, clk, q = NetlistDB.to_str(conns["D"]), NetlistDB.to_str(conns["CLK"]), NetlistDB.to_str(conns["Q"])
-                self.execute("INSERT OR IGNORE INTO dffs (d, clk, q) VALUES (?, ?, ?)", (d, clk, q))
-            elif type_ == "$mux":
-                a, b, s, y = NetlistDB.to_str(conns["A"]), NetlistDB.to_str(conns["B"]), NetlistDB.to_str(conns["S"]), NetlistDB.to_str(conns["Y"])
-                self.execute("INSERT INTO absy_cells (type, a, b, s, y) VALUES (?, ?, ?, ?, ?)", ("$mux", a, b, s, y))
-            elif type_ in {"$not", "$logic_not"}:
-                a, y = NetlistDB.to_str(conns["A"]), NetlistDB.to_str(conns["Y"])
-                self.execute("INSERT INTO ay_cells (type, a, y) VALUES (?, ?, ?)", (type_, a, y))
-            elif type_ in {
-                "$eq", "$ge", "$le", "$gt", "$lt",
-                "$logic_and", "$logic_or"
-            }:
-                a, b, y = NetlistDB.to_str(conns["A"]), NetlistDB.to_str(conns["B"]), NetlistDB.to_str(conns["Y"])
-                self.execute("INSERT INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", (type_, a, b, y))
+    @staticmethod
+    def _cell_rows(name: str, cell: dict, submodules: Iterable[str] = ()) -> Iterator[tuple[str, tuple]]:
+        """
+        Yield (table, row) for each row that a Yosys cell adds to the database.
+        Instances of `submodules` are kept as blackboxes, see `emap.hier`.
+        """
+        type_: str = cell["type"]
+        params: dict = cell["parameters"]
+        conns: dict = cell["connections"]
+        if type_ in {"$and", "$or", "$xor", "$add", "$sub", "$mul", "$mod"}:
+            type_ += "s" if NetlistDB.to_int(params["A_SIGNED"]) and NetlistDB.to_int(params["B_SIGNED"]) else "u"
+            a, b, y = NetlistDB.to_bundle(conns["A"]), NetlistDB.to_bundle(conns["B"]), NetlistDB.to_bundle(conns["Y"])
+            yield "aby_cells", (type_, a, b, y)
+        elif type_ == "$dff":
+            if not NetlistDB.to_int(params["CLK_POLARITY"]):
+                raise ValueError("$dff with negative clock polarity is not supported")
+            d, clk, q = NetlistDB.to_bundle(conns["D"]), NetlistDB.to_bundle(conns["CLK"]), NetlistDB.to_bundle(conns["Q"])
+            yield "dffs", (d, clk, q)
+        elif type_ == "$mux":
+            a, b, s, y = NetlistDB.to_bundle(conns["A"]), NetlistDB.to_bundle(conns["B"]), NetlistDB.to_bundle(conns["S"]), NetlistDB.to_bundle(conns["Y"])
+            yield "absy_cells", ("$mux", a, b, s, y)
+        elif type_ in {"$not", "$logic_not"}:
+            a, y = NetlistDB.to_bundle(conns["A"]), NetlistDB.to_bundle(conns["Y"])
+            yield "ay_cells", (type_, a, y)
+        elif type_ in {
+            "$eq", "$ge", "$le", "$gt", "$lt",
+            "$logic_and", "$logic_or"
+        }:
+            a, b, y = NetlistDB.to_bundle(conns["A"]), NetlistDB.to_bundle(conns["B"]), NetlistDB.to_bundle(conns["Y"])
+            yield "aby_cells", (type_, a, b, y)
+        else:
+            attrs = cell["attributes"]
+            if "module_not_derived" in attrs and NetlistDB.to_int(attrs["module_not_derived"]) or type_ in submodules: # blackbox cell
+                yield "instances", (name, type_)
+                for param, val in params.items():
+                    yield "instance_params", (name, param, val)
+                for port in conns:
+                    yield "instance_ports", (name, port, NetlistDB.to_bundle(conns[port]))
             else:
-                attrs = cell["attributes"]
-                if "module_not_derived" in attrs and NetlistDB.to_int(attrs["module_not_derived"]): # blackbox cell
-                    self.execute("INSERT INTO instances (id, module) VALUES (?, ?)", (name, type_))
-                    self.executemany(
-                        "INSERT INTO instance_params (instance, param, val) VALUES (?, ?, ?)",
-                        ((name, param, val) for param, val in params.items())
-                    )
-                    self.executemany(
-                        "INSERT INTO instance_ports (instance, port, wire) VALUES (?, ?, ?)",
-                        ((name, port, NetlistDB.to_str(conns[port])) for port in conns)
-                    )
-                else:
-                    raise ValueError(f"Unsupported cell type: {type_}")
+                raise ValueError(f"Unsupported cell type: {type_}")
+
+    def _insert_items(self, items: Iterable[tuple[str, str, dict]], batch_size: int, submodules: Iterable[str] = ()) -> int:
+        """
+        Insert ("port" | "cell", name, value) items, grouping rows per table into batches.
+        Rows keep their order within each table, so rowids do not depend on the batch size.
+        Return the number of rows.
+        """
+        batches: dict[str, list[tuple]] = {table: [] for table in NetlistDB._INSERTS}
+        cnt = 0
+        for kind, name, value in items:
+            rows = NetlistDB._port_rows(name, value) if kind == "port" else NetlistDB._cell_rows(name, value, submodules)
+            for table, row in rows:
+                batch = batches[table]
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    self.executemany(NetlistDB._INSERTS[table], batch)
+                    cnt += len(batch)
+                    batch.clear()
+        for table, batch in batches.items():
+            if batch:
+                self.executemany(NetlistDB._INSERTS[table], batch)
+                cnt += len(batch)
+        return cnt
 
+    def build_from_json(self, mod: dict, batch_size: int = 10000, submodules: Iterable[str] = ()):
+        ports: dict = mod["ports"]
+        cells: dict = mod["cells"]
+
+        self._insert_items(chain(
+            (("port", name, port) for name, port in ports.items()),
+            (("cell", name, cell) for name, cell in cells.items())
+        ), batch_size, frozenset(submodules))
         self.commit()
 
+    def load_json(self, json_file: str, top: str, batch_size: int = 10000) -> int:
+        """
+        Stream module `top` from a Yosys JSON file into the database.
+        Equivalent to `build_from_json()`, but cells are decoded one at a time
+        and all rows are inserted in a single transaction with load-time pragmas.
+        Return the number of rows.
+        """
+        phase_time = time.time()
+        if self.in_transaction:
+            self.commit()
+        synchronous = self.execute("PRAGMA synchronous").fetchone()[0]
+        journal_mode = self.execute("PRAGMA journal_mode").fetchone()[0]
+        self.execute("PRAGMA synchronous = OFF")
+        self.execute("PRAGMA journal_mode = MEMORY")
+        try:
+            with open(json_file, "r") as f:
+                cnt = self._insert_items(iter_module(f, top), batch_size)
+            self.commit()
+        except BaseException:
+            self.rollback()
+            raise
+        finally:
+            self.execute(f"PRAGMA journal_mode = {journal_mode}")
+            self.execute(f"PRAGMA synchronous = {synchronous}")
+
+        elapsed = time.time() - phase_time
+        print(f"load_json() loaded {cnt} rows in {elapsed:.2f} seconds ({cnt / max(elapsed, 1e-9):.0f} rows/s).")
+        return cnt
+
     def dump_tables(self) -> dict:
         # get all tables
         cur = self.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';")
@@ -130,7 +664,11 @@ class NetlistDB(sqlite3.Connection):
         for (table,) in cur.fetchall():
             cur.execute(f"SELECT * FROM {table}")
             rows = cur.fetchall()
-            db[table] = [dict(zip([col[0] for col in cur.description], row)) for row in rows]
+            # bundles are converted back into Yosys bits at the edge
+            db[table] = [
+                dict(zip([col[0] for col in cur.description], (NetlistDB.to_bits(v) if isinstance(v, bytes) else v for v in row)))
+                for row in rows
+            ]
 
         return db
 
@@ -1 +1 @@
-from . import greedy, ilp, utils
\ No newline at end of file
+from . import greedy, ilp, solver, utils
\ No newline at end of file
@@ -1,79 +1,121 @@
 from ..db import NetlistDB
 from .utils import Cell, DFF, db_to_normalized, db_to_json
 from typing import Callable
+import heapq
 
 
-def _delete_subset_rows(db: NetlistDB, table: str, output: str, wires: set[str]):
+def _prefix_range(bit: int) -> tuple[bytes, bytes | None]:
+    # the bundles starting with `bit` are in [low, high), high is None past the largest prefix
+    low = NetlistDB.to_bundle([bit])
+    if low == b"\xff" * len(low):
+        return low, None
+    return low, (int.from_bytes(low, "big") + 1).to_bytes(len(low), "big")
+
+def _subset_rowids(db: NetlistDB, table: str, output: str, wires: set[int]) -> list[int]:
     """
-    Delete rows in the specified table where the output wires are a subset of the given wires.
+    Return the rowids of the rows in the specified table where the output wires are a subset of the given wires.
     """
-    # this is a helper function to delete rows in the same eclass
-    # costly since it requires a full scan of the table
-    cur = db.execute(f"SELECT rowid, {output} FROM {table}")
-    for row in cur.fetchall():
-        if set(row[1].split(",")) <= wires:
-            db.execute(f"DELETE FROM {table} WHERE rowid = ?", (row[0],))
+    # this is a helper function to find rows in the same eclass
+    # such an output starts with one of the wires (or is empty), so only the rows of these first bits are read
+    if db.backend != "sqlite":
+        rows = db.rows_starting_with(table, output, wires)
+    else:
+        # ranges of the index on the output, created with the table (`create_dsp_tables()` and schema.sql)
+        rows = db.query(f"SELECT rowid, {output} FROM {table} WHERE {output} = x''")
+        for low, high in map(_prefix_range, wires):
+            if high is None:
+                rows += db.query(f"SELECT rowid, {output} FROM {table} WHERE {output} >= ?", (low,))
+            else:
+                rows += db.query(f"SELECT rowid, {output} FROM {table} WHERE {output} >= ? AND {output} < ?", (low, high))
+    return [rowid for rowid, out in rows if NetlistDB.to_set(out) <= wires]
+
+def _covered(wires: set[int], fixed: list[tuple], by_wire: dict[int, list[int]], start: int = 0) -> bool:
+    # whether the output `wires` is a subset of the output of a fixed DSP from the `start`-th on
+    if not wires:
+        return len(fixed) > start
+    return any(k >= start and wires <= fixed[k][3] for k in by_wire.get(next(iter(wires)), ()))
 
 def fix_one_dsp(db: NetlistDB, name: str) -> int:
     """
     Return the largest value of the DSP.
     0 if no DSP is found.
     """
-    tables = db.tables_startswith(name)
-
-    # for each table, find the row with largest value
-    largest = (0, None, None)   # (value, row, table)
-    for table in tables:
-        cur = db.execute(f"SELECT rowid, * FROM {table} ORDER BY value DESC LIMIT 1")
-        row = cur.fetchone()
-        if row is not None and row[1] > largest[0]:
-            largest = (row[1], row, table)
-
-    if largest[0] > 0 and largest[1] is not None:
-        _, row, table = largest
-        # first, remove all rows with the same or subset output (in the same eclass)
-        # suppose `output` is in the last column
-        output_wires = set(row[-1].split(","))
-        _delete_subset_rows(db, "aby_cells", "y", output_wires)
-        _delete_subset_rows(db, "dffs", "q", output_wires)
-        for table_ in tables:
-            _delete_subset_rows(db, table_, "out", output_wires)
-        # then, insert the row with value 0
-        db.execute(f"INSERT INTO {table} VALUES ({','.join(['?'] * (len(row) - 1))})", (0, *row[2:]))
-        db.commit()
-
-    return largest[0]
+    values = fix_dsps(db, name, 1)
+    return values[0] if values else 0
 
 def fix_dsps(db: NetlistDB, name: str, count: int = 1) -> list[int]:
     """
-    Fix multiple DSPs by calling `fix_one_dsp` repeatedly.
+    Fix up to `count` DSPs, each time the DSP of the largest value, the first table and the smallest rowid on ties.
+    A fixed DSP gets value 0, and the rows whose outputs are subsets of its output (in the same eclass) are removed,
+    so a DSP whose output is a subset of a fixed one is no longer a candidate.
     Return the values of the fixed DSPs.
     """
-    fixed_values = []
-    for _ in range(count):
-        value = fix_one_dsp(db, name)
-        if value > 0:
-            fixed_values.append(value)
-        else:
-            break
-    return fixed_values
+    tables = db.tables_startswith(name)
+
+    # one heap over the candidates of every table, removed candidates are skipped when they come up
+    heap = [
+        (-value, i, rowid, out)
+        for i, table in enumerate(tables)
+        for rowid, value, out in db.query(f"SELECT rowid, value, out FROM {table} WHERE value > 0")
+    ]
+    heapq.heapify(heap)
+    fixed: list[tuple[int, str, tuple, set[int]]] = []  # (value, table, row, output wires)
+    by_wire: dict[int, list[int]] = {}  # wire -> fixed DSPs driving it
+    while heap and len(fixed) < count:
+        value, i, rowid, out = heapq.heappop(heap)
+        wires = NetlistDB.to_set(out)
+        if _covered(wires, fixed, by_wire):
+            continue
+        row = db.query(f"SELECT * FROM {tables[i]} WHERE rowid = ?", (rowid,))[0]
+        for wire in wires:
+            by_wire.setdefault(wire, []).append(len(fixed))
+        fixed.append((-value, tables[i], row, wires))
+
+    # then, remove all rows with the same or subset output (in the same eclass) and insert the fixed rows with value 0
+    # in one transaction, a fixed row whose output is a subset of a later one is removed as well
+    deleted: dict[str, set[int]] = {}
+    referenced: set[int] | None = None
+    for _, _, row, wires in fixed:
+        # suppose `output` is in the last column
+        deleted.setdefault("aby_cells", set()).update(_subset_rowids(db, "aby_cells", "y", wires))
+        deleted.setdefault("dffs", set()).update(_subset_rowids(db, "dffs", "q", wires))
+        for table_ in tables:
+            deleted.setdefault(table_, set()).update(_subset_rowids(db, table_, "out", wires))
+        # rows merged into the same e-class by `NetlistDB.rebuild()`, unless another row or a port reads their outputs
+        eclass = db.eclass_of(row[-1])
+        if eclass is not None:
+            if referenced is None:
+                referenced = db.referenced_bits()
+            for table_, cols in NetlistDB.CELL_COLUMNS.items():
+                deleted.setdefault(table_, set()).update(
+                    rowid for rowid, out in db.query(f"SELECT rowid, {cols[-1]} FROM {table_} WHERE eclass = ?", (eclass,))
+                    if referenced.isdisjoint(NetlistDB.bits_of(out))
+                )
+    for table_, rowids in deleted.items():
+        db.delete_rows(table_, sorted(rowids))
+    for k, (_, table, row, wires) in enumerate(fixed):
+        if not _covered(wires, fixed, by_wire, k + 1):
+            db.insert_rows(table, db.columns_of(table), [(0, *row[1:])])
+    if fixed:
+        db.commit()
+    return [value for value, _, _, _ in fixed]
 
 def extract_dsps_bottom_up(db: NetlistDB, name: str, cost_model: Callable) -> dict:
     """
     Return the JSON format of the module.
-    Simple bottom-up extraction algorithm.
+    Simple bottom-up extraction algorithm: add the reachable cell of the lowest cost per newly reached output bit,
+    or if no cell makes progress, the DFF of the lowest cost per newly reached bit, until the outputs are reached.
+    Readiness counters and wire -> cells indexes make every step cost the cells around the newly reached bits.
     WARNING: Unable to handle blackboxes, but can be supported in the future.
     """
-    reachable: set[str] = set()
-    targets: set[str] = set()
+    reachable: set[int] = set()
+    targets: set[int] = set()
 
     # first, add all inputs to reachable and all outputs to targets
-    cur = db.execute("SELECT wire FROM ports WHERE direction = 'input'")
-    for (input,) in cur.fetchall():
-        reachable.update(input.split(","))
-    cur.execute("SELECT wire FROM ports WHERE direction = 'output'")
-    for (output,) in cur.fetchall():
-        targets.update(output.split(","))
+    for (input,) in db.query("SELECT wire FROM ports WHERE direction = 'input'"):
+        reachable.update(NetlistDB.bits_of(input))
+    for (output,) in db.query("SELECT wire FROM ports WHERE direction = 'output'"):
+        targets.update(NetlistDB.bits_of(output))
     targets -= reachable
 
     cells, dffs = db_to_normalized(db, cost_model)
@@ -82,48 +124,102 @@ def extract_dsps_bottom_up(db: NetlistDB, name: str, cost_model: Callable) -> di
     # for simplicity, we only consider the DSPs that are already fixed
     dsp_tables = db.tables_startswith(name)
     for dsp_table in dsp_tables:
-        cur.execute(f"SELECT rowid, * FROM {dsp_table} WHERE value = 0")
-        cells.update(Cell(table=dsp_table, rowid=row[0], inputs=set(",".join(row[2:-1]).split(",")), outputs=set(row[-1].split(",")), cost=0) for row in cur)
+        rows = db.query(f"SELECT rowid, * FROM {dsp_table} WHERE value = 0")
+        cells.update(Cell(table=dsp_table, rowid=row[0], inputs=NetlistDB.to_set(*row[2:-1]), outputs=NetlistDB.to_set(row[-1]), cost=0) for row in rows)
+
+    # worklist: a cell is ready once none of its inputs is missing, the ready cells and the DFFs sit in heaps
+    # keyed by (cost per progress, position), the position in the sets keeps the ties of a full rescan
+    cells_, dffs_ = list(cells), list(dffs)
+    missing = [len(cell.inputs - reachable) for cell in cells_]    # inputs not reachable
+    left = [len(cell.outputs - reachable) for cell in cells_]      # outputs not reachable
+    d_left = [len(dff.d - reachable - dff.q) for dff in dffs_]
+    q_left = [len(dff.q - reachable) for dff in dffs_]
+    cell_alive, dff_alive = [True] * len(cells_), [True] * len(dffs_)
+    # inverted wire -> cells/DFFs indexes of the bits not reachable yet
+    readers: dict[int, list[int]] = {}
+    drivers: dict[int, list[int]] = {}
+    dff_d: dict[int, list[int]] = {}
+    dff_q: dict[int, list[int]] = {}
+    for i, cell in enumerate(cells_):
+        for bit in cell.inputs - reachable:
+            readers.setdefault(bit, []).append(i)
+        for bit in cell.outputs - reachable:
+            drivers.setdefault(bit, []).append(i)
+    for j, dff in enumerate(dffs_):
+        for bit in dff.d - reachable - dff.q:
+            dff_d.setdefault(bit, []).append(j)
+        for bit in dff.q - reachable:
+            dff_q.setdefault(bit, []).append(j)
+
+    def cell_key(i: int) -> float:
+        return float(cells_[i].cost) / left[i]
+
+    def dff_key(j: int) -> float:
+        return float(dffs_[j].cost) * d_left[j] / q_left[j]    # cost * (inputs not reachable) / (outputs not reachable)
+
+    # an entry is stale once its key changed, a new entry was pushed then
+    # keys that are not below inf are never chosen, as in a rescan
+    cell_heap = [(key, i) for i in range(len(cells_)) if missing[i] == 0 and left[i] > 0 and (key := cell_key(i)) < float("inf")]
+    dff_heap = [(key, j) for j in range(len(dffs_)) if q_left[j] > 0 and (key := dff_key(j)) < float("inf")]
+    heapq.heapify(cell_heap)
+    heapq.heapify(dff_heap)
+
+    def reach(bits: set[int]):
+        cells_touched, dffs_touched = set(), set()
+        for bit in bits:
+            if bit in reachable:
+                continue
+            reachable.add(bit)
+            for i in readers.pop(bit, ()):
+                missing[i] -= 1
+                cells_touched.add(i)
+            for i in drivers.pop(bit, ()):
+                left[i] -= 1
+                cells_touched.add(i)
+            for j in dff_d.pop(bit, ()):
+                d_left[j] -= 1
+                dffs_touched.add(j)
+            for j in dff_q.pop(bit, ()):
+                q_left[j] -= 1
+                dffs_touched.add(j)
+        for i in cells_touched:
+            if cell_alive[i] and missing[i] == 0 and left[i] > 0 and (key := cell_key(i)) < float("inf"):
+                heapq.heappush(cell_heap, (key, i))
+        for j in dffs_touched:
+            if dff_alive[j] and q_left[j] > 0 and (key := dff_key(j)) < float("inf"):
+                heapq.heappush(dff_heap, (key, j))
+
+    def pop(heap: list, alive: list[bool], progress: list[int], key: Callable[[int], float]) -> int | None:
+        while heap:
+            k, i = heapq.heappop(heap)
+            if alive[i] and progress[i] > 0 and k == key(i):
+                alive[i] = False
+                return i
+        return None
 
     res: list[Cell | DFF] = []
     while targets:  # while there are still targets to reach
         # try to make heuristically biggest progress by adding a cell
-        choice = (float("inf"), None)   # (cost_per_progress, cell)
-        for cell in cells:
-            if cell.inputs <= reachable:    # reachable
-                diff = len(cell.outputs - reachable)  # how many outputs can be reached
-                if diff == 0:   # no progress can be made
-                    continue
-                cost_per_progress = float(cell.cost) / diff
-                if cost_per_progress < choice[0]:   # update choice
-                    choice = (cost_per_progress, cell)
-        if choice[1] is None:   # cells cannot make progress, consider DFFs
-            choice = (float("inf"), None)   # (cost_per_progress, dff)
-            for dff in dffs:
-                diff = len(dff.q - reachable)
-                if diff == 0:
-                    continue
-                cost_per_progress = float(dff.cost) * len(dff.d - reachable - dff.q) / diff # cost * (inputs not reachable) / (outputs not reachable)
-                if cost_per_progress < choice[0]:   # update choice
-                    choice = (cost_per_progress, dff)
-            if choice[1] is None:   # no DFFs can make progress
+        i = pop(cell_heap, cell_alive, left, cell_key)
+        if i is None:   # cells cannot make progress, consider DFFs
+            j = pop(dff_heap, dff_alive, q_left, dff_key)
+            if j is None:   # no DFFs can make progress
                 raise ValueError("No more cells or DFFs can make progress towards the targets.")
-            else:
-                # add DFF outputs to reachable
-                reachable.update(choice[1].q)
-                # add DFF inputs to targets
-                targets.update(choice[1].d - reachable)
-                # remove DFF outputs from targets
-                targets -= choice[1].q
-                res.append(choice[1])
-                dffs.remove(choice[1])
+            dff = dffs_[j]
+            # add DFF outputs to reachable
+            reach(dff.q)
+            # add DFF inputs to targets
+            targets.update(dff.d - reachable)
+            # remove DFF outputs from targets
+            targets -= dff.q
+            res.append(dff)
         else:
+            cell = cells_[i]
             # add the cell to reachable
-            reachable.update(choice[1].outputs)
-            res.append(choice[1])
-            cells.remove(choice[1])
+            reach(cell.outputs)
+            res.append(cell)
             # remove the cell's outputs from targets
-            targets -= choice[1].outputs
+            targets -= cell.outputs
 
     # NOTE: alternatively, call yosys command `clean -purge` to do this for you
     # at the end, we need to prune some wires that are not used and driven more than once
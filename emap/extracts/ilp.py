@@ -1,10 +1,16 @@
 from ..db import NetlistDB
+from .solver import Program, Solver, Solution, get_solver
 from .utils import Cell, DFF, db_to_normalized, db_to_json
-from typing import Iterable, Callable
-import gurobipy as grb
+from itertools import chain
+from typing import TYPE_CHECKING, Iterable, Callable
+from collections import Counter
+import heapq
 import time
 import json
 
+if TYPE_CHECKING:
+    import numpy as np
+
 
 def _group_wires(bundles: list[set]) -> dict[str, set]:
     """
@@ -48,9 +54,9 @@ def _group_wires_fast(bundles: list[set]) -> dict[str, set]:
     """
     phase_time = time.time()
     from ..cpp.build import emapcc
-    # new_bundles, groups = emapcc.group_wires([{-1 if w == "x" else int(w) for w in bundle} for bundle in bundles])
+    # new_bundles, groups = emapcc.group_wires(bundles)
     cnt = len(set().union(*bundles))
-    new_bundles, groups = emapcc.group_wires_v2([{-1 if w == "x" else int(w) for w in bundle} for bundle in bundles])   # faster when set size and element frequency are bounded
+    new_bundles, groups = emapcc.group_wires_v2(bundles)   # faster when set size and element frequency are bounded
     for i, bundle in enumerate(bundles):
         bundle.clear()
         bundle.update(f"group{gid}" for gid in new_bundles[i])
@@ -85,8 +91,8 @@ def _prune_cells_fast(cells: list[Cell]):
     from ..cpp.build import emapcc
     removed_indices = emapcc.prune_cells([(
         cell.cost,
-        sorted(-1 if w == "x" else int(w) for w in cell.inputs),
-        sorted(-1 if w == "x" else int(w) for w in cell.outputs)
+        sorted(cell.inputs),
+        sorted(cell.outputs)
     ) for cell in cells])
     write = 0
     for read in range(len(cells)):
@@ -96,24 +102,290 @@ def _prune_cells_fast(cells: list[Cell]):
     cells[:] = cells[:write]  # truncate the list to the new length
     print(f"_prune_cells_fast() finished in {time.time() - phase_time:.2f} seconds, removed {len(removed_indices)} cells, remaining {len(cells)} cells.")
 
-def extract_dsps_by_cost(db: NetlistDB, name: str, cost_model: Callable) -> dict:
+def _wire_index(cells: list[Cell], dffs: list[DFF]) -> tuple[dict, dict]:
+    """
+    Return the wire -> drivers and wire -> readers indexes of the cells and dffs, built in one pass.
+    Drivers and readers are positions in `cells + dffs`, a dff reads its d and clk and drives its q.
+    Wires are bits before `_group_wires_fast()` and groups after it.
+    """
+    drivers: dict[int | str, list[int]] = {}
+    readers: dict[int | str, list[int]] = {}
+    for i, cell in enumerate(cells):
+        for wire in cell.outputs:
+            drivers.setdefault(wire, []).append(i)
+        for wire in cell.inputs:
+            readers.setdefault(wire, []).append(i)
+    for i, dff in enumerate(dffs, start=len(cells)):
+        for wire in dff.q:
+            drivers.setdefault(wire, []).append(i)
+        for wire in chain(dff.d, dff.clk):
+            readers.setdefault(wire, []).append(i)
+    return drivers, readers
+
+def _classify_blackbox_ports(db: NetlistDB, drivers: dict, readers: dict, input: set[int], output: set[int]):
+    """
+    Add the blackbox port bits to `input` or `output`, in place.
+    A bit driven by a cell or dff is read by the blackbox, so it is an output of the extracted logic,
+    a bit read by a cell or dff is driven by the blackbox, so it is an input.
+    Other bits connect a port to the blackbox and take the opposite direction of the port.
+    """
+    for (wire,) in db.query("SELECT wire FROM instance_ports"):
+        for bit in NetlistDB.bits_of(wire):
+            if bit in drivers:
+                output.add(bit)
+            elif bit in readers:
+                input.add(bit)
+            elif bit in output:
+                input.add(bit)
+            elif bit in input:
+                output.add(bit)
+
+def _build_program(
+    groups: list[str], cells: list[Cell], dffs: list[DFF], input: set, output: set,
+    dsps: Iterable[int] = (), count: int | None = None, names: bool = False
+) -> Program:
+    """
+    Build the extraction program in one pass over the cells and dffs, minimizing the total cost over
+    the binary variables x (wire groups), y (cells) and z (dffs), subject to:
+    - every output group is chosen,
+    - a chosen group that is not an input has a chosen producer, a cell or a dff,
+    - a chosen cell or dff has its inputs (and clocks) chosen,
+    - at most `count` of the cells `dsps` are chosen, if `count` is given.
+    Rows are named as the former `addConstr()` calls if `names` is set.
+    """
+    import numpy as np
+
+    def gname_to_index(name: str) -> int:
+        return int(name[5:])
+
+    y0, z0 = len(groups), len(groups) + len(cells)
+    # group -> producers (cells and dffs), the positions in `cells + dffs` are the columns from y0 on
+    producers, _ = _wire_index(cells, dffs)
+
+    indptr, indices, data, sense, rhs = [0], [], [], [], []
+    row_names = [] if names else None
+
+    def add_row(cols: list[int], coeffs: list[float], sense_: str, rhs_: float, name: str | None = None):
+        indices.extend(cols)
+        data.extend(coeffs)
+        indptr.append(len(indices))
+        sense.append(sense_)
+        rhs.append(rhs_)
+        if names:
+            row_names.append(name)
+
+    # output constraints
+    for group in output:
+        add_row([gname_to_index(group)], [1.0], ">", 1.0, names and f"output_{group}_constraint")
+    # wire constraints, if the wire is chosen, at least one of the cells or dffs must be chosen
+    for group in groups:
+        if group not in input:
+            cols = [y0 + i for i in producers.get(group, ())]
+            add_row([*cols, gname_to_index(group)], [1.0] * len(cols) + [-1.0], ">", 0.0, names and f"wire_{group}_constraint")
+    # cell constraints, if the cell is chosen, all its inputs must be chosen
+    for i, cell in enumerate(cells):
+        for group in cell.inputs:
+            add_row([gname_to_index(group), y0 + i], [1.0, -1.0], ">", 0.0, names and f"cell_{i}_input_{group}_constraint")
+    # dff constraints, if the dff is chosen, all its inputs and clocks must be chosen
+    for i, dff in enumerate(dffs):
+        for group in dff.d:
+            add_row([gname_to_index(group), z0 + i], [1.0, -1.0], ">", 0.0, names and f"dff_{i}_input_{group}_constraint")
+        for group in dff.clk:
+            add_row([gname_to_index(group), z0 + i], [1.0, -1.0], ">", 0.0, names and f"dff_{i}_clk_{group}_constraint")
+    # dsp count constraint
+    if count is not None:
+        cols = [y0 + i for i in dsps]
+        add_row(cols, [1.0] * len(cols), "<", float(count), "dsp_count_constraint")
+
+    cost = np.zeros(z0 + len(dffs))
+    cost[y0:z0] = [cell.cost for cell in cells]
+    cost[z0:] = [dff.cost for dff in dffs]
+    return Program(
+        [("x", len(groups)), ("y", len(cells)), ("z", len(dffs))], cost,
+        np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int32), np.array(data),
+        np.array(sense), np.array(rhs), row_names
+    )
+
+def _chosen(program: Program, values: "np.ndarray", cells: list[Cell], dffs: list[DFF]) -> list[Cell | DFF]:
+    # the cells and dffs chosen by a solution
+    import numpy as np
+    y0, z0 = program.offset("y"), program.offset("z")
+    res: list[Cell | DFF] = [cells[i] for i in np.flatnonzero(values[y0:z0] > 0.5)]
+    res += [dffs[i] for i in np.flatnonzero(values[z0:] > 0.5)]
+    return res
+
+def _greedy_start(
+    program: Program, cells: list[Cell], dffs: list[DFF], input: set, output: set,
+    dsps: Iterable[int] = (), count: int | None = None
+) -> "np.ndarray | None":
+    """
+    Return a feasible 0-1 value of the variables of `program` built by `_build_program()`, or None if the heuristic fails.
+    Bottom-up, every group gets the area flow of its cheapest producer (a cell or dff costs itself plus its inputs,
+    shared by the readers of the group in the previous cover, loops through dffs are cut), then top-down from
+    the outputs, every needed group that is not an input takes its cheapest producer.
+    The DSPs `dsps` cost a penalty on top, the smallest penalty (by bisection) whose selection has at most
+    `count` DSPs is kept, i.e. a Lagrangian relaxation of the DSP count constraint.
+    """
+    import numpy as np
+
+    def gname_to_index(name: str) -> int:
+        return int(name[5:])
+
+    y0, z0 = program.offset("y"), program.offset("z")
+    drivers, readers = _wire_index(cells, dffs)
+    is_dsp = set(dsps)
+    inf = float("inf")
+
+    def inputs_of(k: int) -> Iterable[str]:
+        # k is a position in `cells + dffs`
+        if k < len(cells):
+            return cells[k].inputs
+        dff = dffs[k - len(cells)]
+        return chain(dff.d, dff.clk)
+
+    def outputs_of(k: int) -> set[str]:
+        return cells[k].outputs if k < len(cells) else dffs[k - len(cells)].q
+
+    inputs_count = [len(list(inputs_of(k))) for k in range(len(cells) + len(dffs))]
+
+    def cover(cost_of: list[float], refs: Counter) -> list[int] | None:
+        # area flow in Knuth's order, a cell or dff is costed once all its inputs are, a dff left in a loop
+        # is costed by the inputs reached so far, and a group shares the cost of its producer with its
+        # `refs` readers in the previous cover
+        dist: dict[str, float] = {}
+        missing = list(inputs_count)
+        acc = [0.0] * len(cost_of)
+
+        def release(k: int) -> list[tuple[float, str]]:
+            return [((cost_of[k] + acc[k]) / max(refs[group], 1), group) for group in outputs_of(k) if group not in dist]
+
+        heap = [(0.0, group) for group in input]
+        heap += [item for k in range(len(cost_of)) if missing[k] == 0 for item in release(k)]
+        while True:
+            heapq.heapify(heap)
+            while heap:
+                cost, group = heapq.heappop(heap)
+                if group in dist:
+                    continue
+                dist[group] = cost
+                for k in readers.get(group, ()):
+                    missing[k] -= 1
+                    acc[k] += cost
+                    if missing[k] == 0:
+                        for item in release(k):
+                            heapq.heappush(heap, item)
+            heap = [item for k in range(len(cells), len(cost_of)) if missing[k] > 0 for item in release(k)]
+            if not heap:
+                break
+            for k in range(len(cells), len(cost_of)):
+                missing[k] = 0
+
+        def estimate(k: int) -> float:
+            return cost_of[k] + acc[k] if missing[k] <= 0 else inf
+
+        chosen = []
+        produced = set(input)
+        work = sorted(output, key=gname_to_index, reverse=True)
+        while work:
+            group = work.pop()
+            if group in produced:
+                continue
+            k = min(drivers.get(group, ()), key=lambda k: (estimate(k), k), default=None)
+            if k is None or estimate(k) == inf:
+                return None
+            chosen.append(k)
+            produced |= outputs_of(k)
+            work += sorted((g for g in inputs_of(k) if g not in produced), key=gname_to_index, reverse=True)
+        return chosen
+
+    def select(penalty: float) -> list[int] | None:
+        # area flow starts from tree costs and from the fanouts in the e-graph, each later cover takes
+        # the reader counts of the one before, and the cheapest cover with the penalty is kept
+        cost_of = [cell.cost + penalty if i in is_dsp else cell.cost for i, cell in enumerate(cells)]
+        cost_of += [dff.cost for dff in dffs]
+        best = None
+        for refs in (Counter(), Counter({group: len(set(ks)) for group, ks in readers.items()})):
+            for _ in range(4):
+                chosen = cover(cost_of, refs)
+                if chosen is None:
+                    break
+                key = sum(cost_of[k] for k in chosen)
+                if best is None or key < best[0]:
+                    best = (key, chosen)
+                refs = Counter(group for k in chosen for group in inputs_of(k))
+                refs.update(output)
+        return None if best is None else best[1]
+
+    def fits(chosen: list[int] | None) -> bool:
+        return chosen is not None and (count is None or sum(k in is_dsp for k in chosen) <= count)
+
+    chosen = select(0.0)
+    if not fits(chosen):
+        # a penalty above the cost of every other cell makes any DSP dearer than a tree without it
+        low, high = 0.0, 1.0 + sum(cell.cost for cell in cells) + sum(dff.cost for dff in dffs)
+        chosen = select(high)
+        if not fits(chosen):
+            return None
+        for _ in range(16):
+            penalty = (low + high) / 2
+            selection = select(penalty)
+            if fits(selection):
+                high, chosen = penalty, selection
+            else:
+                low = penalty
+
+    values = np.zeros(program.n)
+    values[[gname_to_index(group) for group in output]] = 1.0
+    for k in chosen:
+        values[(y0 + k) if k < len(cells) else (z0 + k - len(cells))] = 1.0
+        values[[gname_to_index(group) for group in inputs_of(k)]] = 1.0
+    return values
+
+def _solve(program: Program, solver: Solver, names: bool, optimal: bool, build_time: float = 0.0, start: "np.ndarray | None" = None) -> Solution:
+    """
+    Solve `program` built in `build_time` seconds from the MIP start `start` if given,
+    writing it to egraph_extraction.lp if `names` is set.
+    Raise a ValueError if it has no solution, or no optimal one if `optimal` is set.
+    """
+    solution = solver.solve(program, "egraph_extraction.lp" if names else None, start)
+    print(f"ILP model built in {build_time + solution.build_time:.2f} seconds with {program.n} variables and {len(program.rhs)} constraints.")
+    first = "no incumbent" if solution.first_time is None else f"the first incumbent after {solution.first_time:.2f} seconds"
+    print(f"ILP model solved by {solver.name} in {solution.solve_time:.2f} seconds, {first}.")
+
+    if solution.status == "infeasible":
+        raise ValueError("ILP model is infeasible, no solution found.")
+    if solution.status == "unbounded":
+        raise ValueError("ILP model is unbounded, no solution found.")
+    if solution.values is None or (optimal and solution.status != "optimal"):
+        raise ValueError("ILP model could not find an optimal solution." if optimal else "ILP model could not find a solution.")
+    print(f"ILP model solved with objective value: {solution.objective}")
+    return solution
+
+def extract_dsps_by_cost(
+    db: NetlistDB, name: str, cost_model: Callable, names: bool = False, solver: str | Solver = "gurobi",
+    threads: int | None = None, time_limit: float | None = None, mip_gap: float | None = None, verbose: bool = False
+) -> dict:
+    """
+    Extract the cheapest design with the fixed DSPs only, see `greedy.fix_dsps()`.
+    Set `names` to name the constraints and write the model to egraph_extraction.lp.
+    `solver` is a `Solver` or the name of a backend in `solver.SOLVERS`, created with `threads`, `time_limit` and `mip_gap`.
+    The solution must be optimal, within `mip_gap` if given.
+    """
     cells, dffs = db_to_normalized(db, cost_model)
 
     # it's also possible to let users define the cost model for DSPs
     # for simplicity, we only consider the DSPs that are already fixed
     dsp_tables = db.tables_startswith(name)
     for dsp_table in dsp_tables:
-        cur = db.execute(f"SELECT rowid, * FROM {dsp_table} WHERE value = 0")
-        cells.update(Cell(table=dsp_table, rowid=row[0], inputs=set(",".join(row[2:-1]).split(",")), outputs=set(row[-1].split(",")), cost=0) for row in cur)
+        rows = db.query(f"SELECT rowid, * FROM {dsp_table} WHERE value = 0")
+        cells.update(Cell(table=dsp_table, rowid=row[0], inputs=NetlistDB.to_set(*row[2:-1]), outputs=NetlistDB.to_set(row[-1]), cost=0) for row in rows)
 
     cells, dffs = list(cells), list(dffs)
     input, output = set(), set()
-    cur.execute("SELECT wire FROM ports WHERE direction = 'input'")
-    for (wire,) in cur.fetchall():
-        input.update(wire.split(","))
-    cur.execute("SELECT wire FROM ports WHERE direction = 'output'")
-    for (wire,) in cur.fetchall():
-        output.update(wire.split(","))
+    for (wire,) in db.query("SELECT wire FROM ports WHERE direction = 'input'"):
+        input.update(NetlistDB.bits_of(wire))
+    for (wire,) in db.query("SELECT wire FROM ports WHERE direction = 'output'"):
+        output.update(NetlistDB.bits_of(wire))
     bundles = [input, output]
     bundles += [cell.inputs for cell in cells]
     bundles += [cell.outputs for cell in cells]
@@ -124,121 +396,47 @@ def extract_dsps_by_cost(db: NetlistDB, name: str, cost_model: Callable) -> dict
     _prune_cells(cells)
     groups = list(_group_wires_fast(bundles))   # this also modifies the input bundles into groups
 
-    # call gurobi to solve it
-    ilp_model = grb.Model("egraph_extraction")
-    ilp_model.setParam("OutputFlag", 0)
-    x = ilp_model.addVars(len(groups), vtype=grb.GRB.BINARY, name="x") # choices of wires
-    y = ilp_model.addVars(len(cells), vtype=grb.GRB.BINARY, name="y") # choices of cells
-    z = ilp_model.addVars(len(dffs), vtype=grb.GRB.BINARY, name="z") # choices of dffs
-
-    def gname_to_index(name: str) -> int:
-        return int(name[5:])
-
-    # output constraints
-    for group in output:
-        ilp_model.addConstr(x[gname_to_index(group)] >= 1, f"output_{group}_constraint")
-
-    # wire constraints
-    for group in groups:
-        if group not in input:  # if the wire is not an input, it can be chosen or not
-            # if the wire is chosen, at least one of the cells or dffs must be chosen
-            ilp_model.addConstr(grb.quicksum(y[i] for i in range(len(cells)) if group in cells[i].outputs) + grb.quicksum(z[i] for i in range(len(dffs)) if group in dffs[i].q) >= x[gname_to_index(group)], f"wire_{group}_constraint")
-
-    # cell constraints
-    for i, cell in enumerate(cells):
-        for group in cell.inputs:
-            ilp_model.addConstr(x[gname_to_index(group)] >= y[i], f"cell_{i}_input_{group}_constraint")    # if the cell is chosen, all its inputs must be chosen
-
-    # dff constraints
-    for i, dff in enumerate(dffs):
-        for group in dff.d:
-            ilp_model.addConstr(x[gname_to_index(group)] >= z[i], f"dff_{i}_input_{group}_constraint")  # if the dff is chosen, all its inputs must be chosen
-        for group in dff.clk:
-            ilp_model.addConstr(x[gname_to_index(group)] >= z[i], f"dff_{i}_clk_{group}_constraint")    # if the dff is chosen, all its clocks must be chosen
-
-    ilp_model.setObjective(
-        grb.quicksum(y[i] * cells[i].cost for i in range(len(cells))) +
-        grb.quicksum(z[i] * dffs[i].cost for i in range(len(dffs))),
-        grb.GRB.MINIMIZE
-    )   # minimize the total cost
-
-    ilp_model.write("egraph_extraction.lp")
-    ilp_model.optimize()
-
-    if ilp_model.status != grb.GRB.OPTIMAL:
-        raise ValueError("ILP model could not find an optimal solution.")
-    if ilp_model.status == grb.GRB.INFEASIBLE:
-        raise ValueError("ILP model is infeasible, no solution found.")
-    if ilp_model.status == grb.GRB.UNBOUNDED:
-        raise ValueError("ILP model is unbounded, no solution found.")
-    print(f"ILP model solved with objective value: {ilp_model.objVal}")
+    solver = get_solver(solver, threads=threads, time_limit=time_limit, mip_gap=mip_gap, verbose=verbose)
+    phase_time = time.time()
+    program = _build_program(groups, cells, dffs, input, output, names=names)
+    solution = _solve(program, solver, names, True, time.time() - phase_time)
 
     # extract the solution
-    res: list[Cell | DFF] = []
-    for i, yvar in y.items():
-        if yvar.X > 0.5:
-            res.append(cells[i])
-    for i, zvar in z.items():
-        if zvar.X > 0.5:
-            res.append(dffs[i])
-
-    return db_to_json(db, res, name)
+    return db_to_json(db, _chosen(program, solution.values, cells, dffs), name)
 
-def extract_dsps_by_count(db: NetlistDB, name: str, count: int, cost_model: Callable, verbose: bool = False) -> dict:
+def extract_dsps_by_count(
+    db: NetlistDB, name: str, count: int, cost_model: Callable, verbose: bool = False, names: bool = False,
+    solver: str | Solver = "gurobi", threads: int | None = None, time_limit: float | None = None, mip_gap: float | None = 0.05,
+    warm_start: bool = False
+) -> dict:
     """
     Extract DSPs by a fixed count.
     It guarantees that the number of DSPs extracted is no more than `count`.
     No need to call greedy.fix_dsps() ahead.
+    Set `names` to name the constraints and write the model to egraph_extraction.lp.
+    `solver` is a `Solver` or the name of a backend in `solver.SOLVERS`, created with `threads`, `time_limit` and `mip_gap`
+    (5% by default), the best solution found within `time_limit` is extracted.
+    Set `warm_start` to pass the selection of `_greedy_start()` as a MIP start.
     """
     cells, dffs = db_to_normalized(db, cost_model)
 
     dsp_tables = db.tables_startswith(name)
     for dsp_table in dsp_tables:
-        cur = db.execute(f"SELECT rowid, * FROM {dsp_table}")
-        cells.update(Cell(table=dsp_table, rowid=row[0], inputs=set(",".join(row[2:-1]).split(",")), outputs=set(row[-1].split(",")), cost=0) for row in cur)
+        rows = db.query(f"SELECT rowid, * FROM {dsp_table}")
+        cells.update(Cell(table=dsp_table, rowid=row[0], inputs=NetlistDB.to_set(*row[2:-1]), outputs=NetlistDB.to_set(row[-1]), cost=0) for row in rows)
 
     cells, dffs = list(cells), list(dffs)
     input, output = {-1, 0, 1}, set()   # DC, GND and VCC are always inputs
-    cur.execute("SELECT wire FROM ports WHERE direction = 'input'")
-    for (wire,) in cur.fetchall():
-        input.update(wire.split(","))
-    cur.execute("SELECT wire FROM ports WHERE direction = 'output'")
-    for (wire,) in cur.fetchall():
-        output.update(wire.split(","))
+    for (wire,) in db.query("SELECT wire FROM ports WHERE direction = 'input'"):
+        input.update(NetlistDB.bits_of(wire))
+    for (wire,) in db.query("SELECT wire FROM ports WHERE direction = 'output'"):
+        output.update(NetlistDB.bits_of(wire))
 
     # blackbox inputs and outputs
-    cur.execute("SELECT wire FROM instance_ports")
-    for (wire,) in cur:
-        for bit in wire.split(","):
-            found = False
-            for cell in cells:
-                if bit in cell.outputs:
-                    output.add(bit)
-                    found = True
-                    break
-            if not found:
-                for dff in dffs:
-                    if bit in dff.q:
-                        output.add(bit)
-                        found = True
-                        break
-            if not found:
-                for cell in cells:
-                    if bit in cell.inputs:
-                        input.add(bit)
-                        found = True
-                        break
-            if not found:
-                for dff in dffs:
-                    if bit in dff.d or bit in dff.clk:
-                        input.add(bit)
-                        found = True
-                        break
-            if not found:
-                if bit in output:
-                    input.add(bit)
-                elif bit in input:
-                    output.add(bit)
+    phase_time = time.time()
+    drivers, readers = _wire_index(cells, dffs)
+    _classify_blackbox_ports(db, drivers, readers, input, output)
+    print(f"Blackbox ports classified in {time.time() - phase_time:.2f} seconds.")
 
     bundles = [input, output]
     bundles += [cell.inputs for cell in cells]
@@ -266,76 +464,21 @@ def extract_dsps_by_count(db: NetlistDB, name: str, count: int, cost_model: Call
     # groups = list(_group_wires(bundles))    # this also modifies the input bundles into groups
     groups = list(_group_wires_fast(bundles))
 
-    # call gurobi to solve it
-    ilp_model = grb.Model("egraph_extraction")
-    ilp_model.setParam("OutputFlag", verbose) # silent
-    x = ilp_model.addVars(len(groups), vtype=grb.GRB.BINARY, name="x") # choices of wires
-    y = ilp_model.addVars(len(cells), vtype=grb.GRB.BINARY, name="y") # choices of cells
-    z = ilp_model.addVars(len(dffs), vtype=grb.GRB.BINARY, name="z") # choices of dffs
-
-    def gname_to_index(name: str) -> int:
-        return int(name[5:])
-
-    # output constraints
-    phase_time = time.time()
-    ilp_model.addConstrs((x[gname_to_index(group)] >= 1 for group in output), "output_constraints")
-    # for group in output:
-    #     ilp_model.addConstr(x[gname_to_index(group)] >= 1, f"output_{group}_constraint")
-    print(f"Output constraints added in {time.time() - phase_time:.2f} seconds.")
-
-    # wire constraints
-    phase_time = time.time()
-    ilp_model.addConstrs((grb.quicksum(y[i] for i in range(len(cells)) if group in cells[i].outputs) + grb.quicksum(z[i] for i in range(len(dffs)) if group in dffs[i].q) >= x[gname_to_index(group)] for group in groups if group not in input), "wire_constraints")
-    # for group in groups:
-    #     if group not in input:  # if the wire is not an input, it can be chosen or not
-    #         # if the wire is chosen, at least one of the cells or dffs must be chosen
-    #         ilp_model.addConstr(grb.quicksum(y[i] for i in range(len(cells)) if group in cells[i].outputs) + grb.quicksum(z[i] for i in range(len(dffs)) if group in dffs[i].q) >= x[gname_to_index(group)], f"wire_{group}_constraint")
-    print(f"Wire constraints added in {time.time() - phase_time:.2f} seconds.")
-
-    # cell constraints
+    solver = get_solver(solver, threads=threads, time_limit=time_limit, mip_gap=mip_gap, verbose=verbose)
     phase_time = time.time()
-    for i, cell in enumerate(cells):
-        for group in cell.inputs:
-            ilp_model.addConstr(x[gname_to_index(group)] >= y[i], f"cell_{i}_input_{group}_constraint")    # if the cell is chosen, all its inputs must be chosen
-    print(f"Cell constraints added in {time.time() - phase_time:.2f} seconds.")
-
-    # dff constraints
-    phase_time = time.time()
-    for i, dff in enumerate(dffs):
-        for group in dff.d:
-            ilp_model.addConstr(x[gname_to_index(group)] >= z[i], f"dff_{i}_input_{group}_constraint")  # if the dff is chosen, all its inputs must be chosen
-        for group in dff.clk:
-            ilp_model.addConstr(x[gname_to_index(group)] >= z[i], f"dff_{i}_clk_{group}_constraint")    # if the dff is chosen, all its clocks must be chosen
-    print(f"DFF constraints added in {time.time() - phase_time:.2f} seconds.")
-
-    # dsp count constraint
-    phase_time = time.time()
-    ilp_model.addConstr(grb.quicksum(y[i] for i in range(len(cells)) if cells[i].table.startswith(name)) <= count, "dsp_count_constraint")
-    print(f"DSP count constraint added in {time.time() - phase_time:.2f} seconds.")
-
-    ilp_model.setParam("MIPGap", 0.05)  # accept 5% gap
-    ilp_model.setObjective(
-        grb.quicksum(y[i] * cells[i].cost for i in range(len(cells))) +
-        grb.quicksum(z[i] * dffs[i].cost for i in range(len(dffs))),
-        grb.GRB.MINIMIZE
-    )   # minimize the total cost
-
-    ilp_model.write("egraph_extraction.lp")
-    ilp_model.optimize()
-
-    if ilp_model.status == grb.GRB.INFEASIBLE:
-        raise ValueError("ILP model is infeasible, no solution found.")
-    if ilp_model.status == grb.GRB.UNBOUNDED:
-        raise ValueError("ILP model is unbounded, no solution found.")
-    print(f"ILP model solved with objective value: {ilp_model.objVal}")
+    dsps = [i for i, cell in enumerate(cells) if cell.table.startswith(name)]
+    program = _build_program(groups, cells, dffs, input, output, dsps, count, names=names)
+    build_time = time.time() - phase_time
+
+    start = None
+    if warm_start:
+        phase_time = time.time()
+        start = _greedy_start(program, cells, dffs, input, output, dsps, count)
+        if start is None:
+            print(f"_greedy_start() found no selection in {time.time() - phase_time:.2f} seconds, solving cold.")
+        else:
+            print(f"_greedy_start() finished in {time.time() - phase_time:.2f} seconds with objective value: {program.cost @ start}")
+    solution = _solve(program, solver, names, False, build_time, start)
 
     # extract the solution
-    res: list[Cell | DFF] = []
-    for i, yvar in y.items():
-        if yvar.X > 0.5:
-            res.append(cells[i])
-    for i, zvar in z.items():
-        if zvar.X > 0.5:
-            res.append(dffs[i])
-
-    return db_to_json(db, res, name)
\ No newline at end of file
+    return db_to_json(db, _chosen(program, solution.values, cells, dffs), name)
@@ -0,0 +1,219 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+import time
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+"""
+MIP solver backends of the ILP extractors
+a `Program` is a 0-1 minimization in CSR form, every backend solves it with the same controls
+(threads, time limit, relative MIP gap), the solver packages are imported when a backend is created
+and numpy when a program is solved, so that `import emap` needs none of them
+"""
+
+@dataclass
+class Program:
+    """
+    Minimize `cost v` subject to `A v (sense) rhs` over binary variables v, A in CSR arrays.
+    `blocks` names consecutive runs of variables, e.g. [("x", 10), ("y", 5)].
+    """
+    blocks: list[tuple[str, int]]
+    cost: "np.ndarray"
+    indptr: "np.ndarray"
+    indices: "np.ndarray"
+    data: "np.ndarray"
+    sense: "np.ndarray"   # ">" or "<" per row
+    rhs: "np.ndarray"
+    names: list[str] | None = None     # of the rows
+
+    @property
+    def n(self) -> int:
+        return sum(size for _, size in self.blocks)
+
+    def offset(self, block: str) -> int:
+        start = 0
+        for name, size in self.blocks:
+            if name == block:
+                return start
+            start += size
+        raise KeyError(block)
+
+@dataclass
+class Solution:
+    status: str     # "optimal", "feasible" (a limit stopped the search), "infeasible", "unbounded" or "unknown"
+    objective: float | None
+    values: "np.ndarray | None"
+    build_time: float
+    solve_time: float
+    first_time: float | None = None     # seconds from the start of the solve to the first incumbent
+
+class Solver(ABC):
+    """
+    A MIP backend. `threads`, `time_limit` (seconds) and `mip_gap` (relative) are left to the solver defaults if None.
+    """
+    name = ""
+
+    def __init__(self, threads: int | None = None, time_limit: float | None = None, mip_gap: float | None = None, verbose: bool = False):
+        self.threads = threads
+        self.time_limit = time_limit
+        self.mip_gap = mip_gap
+        self.verbose = verbose
+
+    @abstractmethod
+    def solve(self, program: Program, write: str | None = None, start: "np.ndarray | None" = None) -> Solution:
+        """
+        Solve `program`, and write the model to the file `write` first if given.
+        `start` is a 0-1 value of every variable passed as a MIP start, it should be feasible.
+        """
+
+class GurobiSolver(Solver):
+    name = "gurobi"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        import gurobipy
+        self.grb = gurobipy
+
+    def solve(self, program: Program, write: str | None = None, start: "np.ndarray | None" = None) -> Solution:
+        import numpy as np
+        import scipy.sparse
+        grb = self.grb
+
+        phase_time = time.time()
+        model = grb.Model("egraph_extraction")
+        model.setParam("OutputFlag", self.verbose)
+        if self.threads is not None:
+            model.setParam("Threads", self.threads)
+        if self.time_limit is not None:
+            model.setParam("TimeLimit", self.time_limit)
+        if self.mip_gap is not None:
+            model.setParam("MIPGap", self.mip_gap)
+        for block, size in program.blocks:
+            model.addMVar(size, vtype=grb.GRB.BINARY, name=block)
+        model.update()
+        A = scipy.sparse.csr_matrix((program.data, program.indices, program.indptr), shape=(len(program.rhs), program.n))
+        constrs = model.addMConstr(A, None, program.sense, program.rhs)
+        if program.names is not None:
+            model.update()
+            model.setAttr("ConstrName", constrs.tolist(), program.names)
+        model.setMObjective(None, program.cost, 0.0, None, None, None, grb.GRB.MINIMIZE)
+        if start is not None:
+            model.setAttr("Start", model.getVars(), start.tolist())
+        model.update()
+        build_time = time.time() - phase_time
+        if write is not None:
+            model.write(write)
+
+        first_time = None
+
+        def callback(model, where):
+            nonlocal first_time
+            if where == grb.GRB.Callback.MIPSOL and first_time is None:
+                first_time = time.time() - phase_time
+
+        phase_time = time.time()
+        model.optimize(callback)
+        solve_time = time.time() - phase_time
+        status = {
+            grb.GRB.OPTIMAL: "optimal",
+            grb.GRB.INFEASIBLE: "infeasible",
+            grb.GRB.UNBOUNDED: "unbounded",
+            grb.GRB.INF_OR_UNBD: "infeasible",
+        }.get(model.status, "unknown")
+        if status == "unknown" and model.SolCount > 0:
+            status = "feasible"
+        if model.SolCount == 0:
+            return Solution(status, None, None, build_time, solve_time)
+        return Solution(status, model.ObjVal, np.array(model.getAttr("X", model.getVars())), build_time, solve_time, first_time)
+
+class HighsSolver(Solver):
+    name = "highs"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        import highspy
+        self.highspy = highspy
+
+    def solve(self, program: Program, write: str | None = None, start: "np.ndarray | None" = None) -> Solution:
+        import numpy as np
+        highspy = self.highspy
+
+        phase_time = time.time()
+        h = highspy.Highs()
+        h.setOptionValue("output_flag", bool(self.verbose))
+        if self.threads is not None:
+            h.setOptionValue("threads", self.threads)
+        if self.time_limit is not None:
+            h.setOptionValue("time_limit", float(self.time_limit))
+        if self.mip_gap is not None:
+            h.setOptionValue("mip_rel_gap", float(self.mip_gap))
+        n, m = program.n, len(program.rhs)
+        lp = highspy.HighsLp()
+        lp.num_col_, lp.num_row_ = n, m
+        lp.col_cost_ = program.cost.astype(np.float64)
+        lp.col_lower_ = np.zeros(n)
+        lp.col_upper_ = np.ones(n)
+        greater = program.sense == ">"
+        lp.row_lower_ = np.where(greater, program.rhs, -highspy.kHighsInf).astype(np.float64)
+        lp.row_upper_ = np.where(greater, highspy.kHighsInf, program.rhs).astype(np.float64)
+        lp.a_matrix_.format_ = highspy.MatrixFormat.kRowwise
+        lp.a_matrix_.num_col_, lp.a_matrix_.num_row_ = n, m
+        lp.a_matrix_.start_ = program.indptr.astype(np.int32)
+        lp.a_matrix_.index_ = program.indices.astype(np.int32)
+        lp.a_matrix_.value_ = program.data.astype(np.float64)
+        lp.integrality_ = [highspy.HighsVarType.kInteger] * n
+        if program.names is not None:
+            lp.row_names_ = program.names
+            lp.col_names_ = [f"{block}_{i}" for block, size in program.blocks for i in range(size)]
+        h.passModel(lp)
+        if start is not None:
+            solution = highspy.HighsSolution()
+            solution.col_value = start.astype(np.float64).tolist()
+            solution.value_valid = True
+            h.setSolution(solution)
+        build_time = time.time() - phase_time
+        if write is not None:
+            h.writeModel(write)
+
+        first_time = None
+
+        def callback(event):
+            nonlocal first_time
+            if first_time is None:
+                first_time = time.time() - phase_time
+
+        h.cbMipImprovingSolution.subscribe(callback)
+        phase_time = time.time()
+        h.run()
+        solve_time = time.time() - phase_time
+        model_status = h.getModelStatus()
+        status = {
+            highspy.HighsModelStatus.kOptimal: "optimal",
+            highspy.HighsModelStatus.kInfeasible: "infeasible",
+            highspy.HighsModelStatus.kUnbounded: "unbounded",
+            highspy.HighsModelStatus.kUnboundedOrInfeasible: "infeasible",
+        }.get(model_status, "unknown")
+        info = h.getInfo()
+        if info.primal_solution_status != highspy.SolutionStatus.kSolutionStatusFeasible:
+            return Solution(status, None, None, build_time, solve_time)
+        if status == "unknown":
+            status = "feasible"
+        return Solution(status, info.objective_function_value, np.array(h.getSolution().col_value), build_time, solve_time, first_time)
+
+SOLVERS: dict[str, type[Solver]] = {
+    GurobiSolver.name: GurobiSolver,
+    HighsSolver.name: HighsSolver,
+}
+
+def get_solver(solver: str | Solver, **kwargs) -> Solver:
+    """
+    Return `solver` if it is a `Solver`, else a new backend of that name created with `kwargs`.
+    """
+    if isinstance(solver, Solver):
+        return solver
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown solver {solver}, choose from {', '.join(SOLVERS)}")
+    return SOLVERS[solver](**kwargs)
@@ -5,8 +5,8 @@ from dataclasses import dataclass
 class Cell:
     table: str
     rowid: int
-    inputs: set[str]
-    outputs: set[str]
+    inputs: set[int]
+    outputs: set[int]
     cost: float
 
     def __hash__(self):
@@ -20,9 +20,9 @@ class Cell:
 @dataclass(frozen=True)
 class DFF:
     rowid: int
-    d: set[str]
-    clk: set[str]
-    q: set[str]
+    d: set[int]
+    clk: set[int]
+    q: set[int]
     cost: float
 
     def __hash__(self):
@@ -35,15 +35,15 @@ class DFF:
 
 def db_to_normalized(db: NetlistDB, cost_model) -> tuple[set[Cell], set[DFF]]:
     cells: set[Cell] = set()
-    cur = db.execute("SELECT rowid, * FROM ay_cells")
-    cells.update(Cell(table="ay_cells", rowid=rowid, inputs=set(a.split(",")), outputs=set(y.split(",")), cost=cost_model((type_, a, y))) for rowid, type_, a, y in cur)
-    cur.execute("SELECT rowid, * FROM aby_cells")
-    cells.update(Cell(table="aby_cells", rowid=rowid, inputs=set(",".join((a, b)).split(",")), outputs=set(y.split(",")), cost=cost_model((type_, a, b, y))) for rowid, type_, a, b, y in cur)
-    cur.execute("SELECT rowid, * FROM absy_cells")
-    cells.update(Cell(table="absy_cells", rowid=rowid, inputs=set(",".join((a, b, s)).split(",")), outputs=set(y.split(",")), cost=cost_model((type_, a, b, s, y))) for rowid, type_, a, b, s, y in cur)
+    rows = db.query("SELECT rowid, type, a, y FROM ay_cells")
+    cells.update(Cell(table="ay_cells", rowid=rowid, inputs=NetlistDB.to_set(a), outputs=NetlistDB.to_set(y), cost=cost_model((type_, a, y))) for rowid, type_, a, y in rows)
+    rows = db.query("SELECT rowid, type, a, b, y FROM aby_cells")
+    cells.update(Cell(table="aby_cells", rowid=rowid, inputs=NetlistDB.to_set(a, b), outputs=NetlistDB.to_set(y), cost=cost_model((type_, a, b, y))) for rowid, type_, a, b, y in rows)
+    rows = db.query("SELECT rowid, type, a, b, s, y FROM absy_cells")
+    cells.update(Cell(table="absy_cells", rowid=rowid, inputs=NetlistDB.to_set(a, b, s), outputs=NetlistDB.to_set(y), cost=cost_model((type_, a, b, s, y))) for rowid, type_, a, b, s, y in rows)
 
-    cur.execute("SELECT rowid, d, clk, q FROM dffs")
-    dffs: set[DFF] = {DFF(rowid=rowid, d=set(d.split(",")), clk={clk}, q=set(q.split(",")), cost=cost_model(("$dff", d, clk, q))) for rowid, d, clk, q in cur}
+    rows = db.query("SELECT rowid, d, clk, q FROM dffs")
+    dffs: set[DFF] = {DFF(rowid=rowid, d=NetlistDB.to_set(d), clk=NetlistDB.to_set(clk), q=NetlistDB.to_set(q), cost=cost_model(("$dff", d, clk, q))) for rowid, d, clk, q in rows}
 
     return cells, dffs
 
@@ -51,8 +51,9 @@ def _cell_to_json(db: NetlistDB, cell: Cell, name: str) -> dict:
     """
     Convert a Cell object to JSON format.
     """
-    cur = db.execute(f"SELECT * FROM {cell.table} WHERE rowid = ?", (cell.rowid,))
-    row = cur.fetchone()
+    columns = ", ".join(NetlistDB.CELL_COLUMNS.get(cell.table, ("*",)))
+    rows = db.query(f"SELECT {columns} FROM {cell.table} WHERE rowid = ?", (cell.rowid,))
+    row = rows[0] if rows else None
     if row is None:
         raise ValueError(f"Cell {cell.table}{cell.rowid} not found in the database.")
 
@@ -143,7 +144,7 @@ def _cell_to_json(db: NetlistDB, cell: Cell, name: str) -> dict:
             }
         }
     elif cell.table.startswith(name):
-        col_names = [desc[0] for desc in cur.description]
+        col_names = db.columns_of(cell.table)
         return {
             # for simplicity, we omit signed/zero-extension
             "hide_name": 1,
@@ -160,8 +161,8 @@ def _dff_to_json(db: NetlistDB, dff: DFF) -> dict:
     """
     Convert a DFF object to JSON format.
     """
-    cur = db.execute("SELECT d, clk, q FROM dffs WHERE rowid = ?", (dff.rowid,))
-    row = cur.fetchone()
+    rows = db.query("SELECT d, clk, q FROM dffs WHERE rowid = ?", (dff.rowid,))
+    row = rows[0] if rows else None
     if row is None:
         raise ValueError(f"DFF with rowid {dff.rowid} not found in the database.")
 
@@ -189,8 +190,8 @@ def db_to_json(db: NetlistDB, choices: list[Cell | DFF], name: str) -> dict:
     mod = {}
 
     # build ports
-    cur = db.execute("SELECT * FROM ports")
-    mod["ports"] = {name: {"direction": direction, "bits": NetlistDB.to_bits(wire)} for name, wire, direction in cur}
+    rows = db.query("SELECT name, wire, direction FROM ports")
+    mod["ports"] = {name: {"direction": direction, "bits": NetlistDB.to_bits(wire)} for name, wire, direction in rows}
 
     # build cells
     mod["cells"] = {}
@@ -201,10 +202,9 @@ def db_to_json(db: NetlistDB, choices: list[Cell | DFF], name: str) -> dict:
             mod["cells"][f"$dff{choice.rowid}"] = _dff_to_json(db, choice)
 
     # build blackboxes
-    cur = db.execute("SELECT id, module FROM instances")
-    for id, module in cur:
-        params = {param: val for param, val in db.execute("SELECT param, val FROM instance_params WHERE instance = ?", (id,))}
-        conns = {port: NetlistDB.to_bits(wire) for port, wire in db.execute("SELECT port, wire FROM instance_ports WHERE instance = ?", (id,))}
+    for id, module in db.query("SELECT id, module FROM instances"):
+        params = {param: val for param, val in db.query("SELECT param, val FROM instance_params WHERE instance = ?", (id,))}
+        conns = {port: NetlistDB.to_bits(wire) for port, wire in db.query("SELECT port, wire FROM instance_ports WHERE instance = ?", (id,))}
         blackbox = {
             "hide_name": 1,
             "type": module,
@@ -0,0 +1,109 @@
+from .db import NetlistDB
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator
+import os
+import tempfile
+import time
+
+
+"""
+hierarchical mapping
+every unique module gets its own e-graph, instances of other modules are kept as blackboxes,
+so modules are independent of each other and a module instantiated N times is mapped once
+"""
+
+SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "schema.sql")
+
+def is_blackbox(mod: dict) -> bool:
+    attrs = mod.get("attributes", {})
+    return any(NetlistDB.to_int(attrs.get(attr, 0)) for attr in ("blackbox", "whitebox"))
+
+def submodules_of(mod: dict, modules: dict) -> set[str]:
+    """
+    Return the modules of the design instantiated by `mod`.
+    """
+    return {cell["type"] for cell in mod["cells"].values() if cell["type"] in modules}
+
+def hierarchy(modules: dict, top: str) -> list[str]:
+    """
+    Return the modules reachable from `top`, submodules before their parents.
+    """
+    order, visited = [], set()
+
+    def visit(name: str):
+        visited.add(name)
+        for sub in sorted(submodules_of(modules[name], modules)):
+            if sub not in visited:
+                visit(sub)
+        order.append(name)
+
+    visit(top)
+    return order
+
+def _bits_of(mod: dict) -> Iterator[int | str]:
+    for port in mod["ports"].values():
+        yield from port["bits"]
+    for cell in mod["cells"].values():
+        for bits in cell["connections"].values():
+            yield from bits
+
+def _map_module(job: tuple) -> tuple[str, dict, float]:
+    """
+    Worker of `map_hierarchy()`, build the e-graph of one module and run `flow` on it.
+    """
+    name, mod, submodules, flow, schema_file, cnt = job
+    phase_time = time.time()
+    # fresh wires must not collide with the wires of this module
+    cnt = max([cnt, *(bit for bit in _bits_of(mod) if isinstance(bit, int))])
+    db = NetlistDB(schema_file, ":memory:", cnt=cnt)
+    db.build_from_json(mod, submodules=submodules)
+    # the extractors write debug files (group.json, egraph_extraction.lp) to the working directory,
+    # every module gets a directory of its own so that concurrent workers do not overwrite them
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix=f"emap_{name}_") as tmp:
+        os.chdir(tmp)
+        try:
+            mapped = flow(db, name)
+        finally:
+            os.chdir(cwd)
+    db.close()
+    return name, mapped, time.time() - phase_time
+
+def map_hierarchy(
+    design: dict, top: str, flow: Callable[[NetlistDB, str], dict],
+    workers: int | None = None, schema_file: str = SCHEMA_FILE, cnt: int = 1000000
+) -> dict:
+    """
+    Map every unique non-blackbox module reachable from `top` with `flow(db, name)`,
+    which runs the rewrites and returns the extracted module in Yosys JSON.
+    Modules are mapped on a pool of `workers` processes, or in this process if `workers` is 1,
+    so `flow` must be picklable (a module-level function or a `functools.partial` of one).
+    `flow` runs in a temporary working directory, paths it opens must be absolute.
+    Return the multi-module Yosys JSON design, blackbox modules are copied as they are.
+    """
+    modules: dict = design["modules"]
+    order = hierarchy(modules, top)
+    blackboxes = [name for name in order if is_blackbox(modules[name])]
+    jobs = [
+        (name, modules[name], frozenset(submodules_of(modules[name], modules)), flow, schema_file, cnt)
+        for name in order if name not in blackboxes
+    ]
+    print(f"map_hierarchy() found {len(jobs)} modules to map and {len(blackboxes)} blackboxes under {top}.")
+
+    phase_time = time.time()
+    if workers == 1 or len(jobs) <= 1:
+        results = list(map(_map_module, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_map_module, jobs))
+    mapped = {}
+    for name, mod, elapsed in results:
+        print(f"map_hierarchy() mapped module {name} in {elapsed:.2f} seconds.")
+        # keep attributes such as `top`
+        mapped[name] = {"attributes": modules[name].get("attributes", {})} | mod
+    print(f"map_hierarchy() finished in {time.time() - phase_time:.2f} seconds.")
+
+    return {
+        "creator": "nextmap",
+        "modules": {name: mapped[name] if name in mapped else modules[name] for name in order}
+    }
@@ -1,5 +1,12 @@
+from .delta import Delta
+from .pattern import Pattern
+from .tracking import tables_of, tracked
 from .basic import *
 from .arith import *
 from .retiming import *
 
-from .dsp import *
\ No newline at end of file
+from .dsp import *
+from .profile import Profiler, RuleProfile
+from .runner import Rewrite, RoundRobinScheduler, BackoffScheduler, saturate, dsp_rewrites
+from .partition import clock_partitions, retime_by_clock
+from .check import check_query_plans
\ No newline at end of file
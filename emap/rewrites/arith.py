@@ -1,4 +1,9 @@
 from ..db import NetlistDB
+from .delta import Delta, stage
+from .subsume import subsume_cells
+from .tracking import tables_of, tracked
+from .pattern import Pattern
+from itertools import chain
 
 
 """
@@ -6,54 +11,95 @@ more advanced rewrites for arithmetic cells
 disabled by default
 """
 
-def rewrite_complex_mul(db: NetlistDB, subsume: bool = False) -> int:
-    assert not subsume, "Subsumption is not supported for complex multiplication rewrites"
-
-    cur = db.execute("""
-        SELECT mul1.a, mul2.a, mul2.b, mul1.b, add1.y, sub1.y
-        FROM aby_cells AS add1 JOIN aby_cells AS mul1 JOIN aby_cells AS mul2
-            JOIN aby_cells AS sub1 JOIN aby_cells AS mul3 JOIN aby_cells AS mul4
-        ON add1.a = mul1.y AND add1.b = mul2.y AND sub1.a = mul3.y AND sub1.b = mul4.y
-            AND mul1.a = mul3.a AND mul1.b = mul4.b AND mul2.a = mul4.a AND mul2.b = mul3.b
-        WHERE add1.type = '$adds' AND mul1.type = '$muls' AND mul2.type = '$muls'
-            AND sub1.type = '$subs' AND mul3.type = '$muls' AND mul4.type = '$muls'
-            AND width_of(mul1.a) = width_of(mul2.a) AND width_of(mul1.b) = width_of(mul2.b)
-            AND width_of(mul1.y) = width_of(mul2.y)
-    """)
+# match queries
+# CROSS JOIN pins the join order so that every inner loop is an index lookup on a join column
+# unary + keeps the width filters off the indexes of the inner loops
+_COMPLEX_MUL_SQL = """
+    SELECT mul1.a, mul2.a, mul2.b, mul1.b, add1.y, sub1.y, add1.a, add1.b, sub1.a, sub1.b
+    FROM aby_cells AS add1 CROSS JOIN aby_cells AS mul1 CROSS JOIN aby_cells AS mul2
+        CROSS JOIN aby_cells AS mul3 CROSS JOIN aby_cells AS sub1 CROSS JOIN aby_cells AS mul4
+    ON add1.a = mul1.y AND add1.b = mul2.y AND sub1.a = mul3.y AND sub1.b = mul4.y
+        AND mul1.a = mul3.a AND mul1.b = mul4.b AND mul2.a = mul4.a AND mul2.b = mul3.b
+    WHERE add1.type = '$adds' AND mul1.type = '$muls' AND mul2.type = '$muls'
+        AND sub1.type = '$subs' AND mul3.type = '$muls' AND mul4.type = '$muls'
+        AND mul1.width_a = +mul2.width_a AND mul1.width_b = +mul2.width_b
+        AND mul1.width_y = +mul2.width_y
+"""
+# the same match as a pattern, cyclic so it runs as a generic join off SQLite
+_COMPLEX_MUL = Pattern("?y1:$adds(a=?m1:$muls(a=?a, b=?d), b=?m2:$muls(a=?b, b=?c)), ?y2:$subs(a=?m3:$muls(a=?a, b=?c), b=?m4:$muls(a=?b, b=?d))")
+_COMPLEX_MUL_SELECT = ["?a", "?b", "?c", "?d", "?y1", "?y2", "?m1", "?m2", "?m3", "?m4"]
+_COMPLEX_MUL_WHERE = ["width(?a) = width(?b)", "width(?d) = width(?c)", "width(?m1) = width(?m2)"]
+_SPLIT_WIDE_MUL = Pattern("?y:$mulu(a=?a, b=?b)")
+_SPLIT_WIDE_MUL_SELECT = ["?a", "?b", "?y"]
+_SPLIT_WIDE_MUL_WHERE = ["width(?a) <= {a_width}", "width(?b) > {b_width}", "width(?y) > {b_width}"]
+
+@tracked(tables_of(_COMPLEX_MUL_SQL))
+def rewrite_complex_mul(db: NetlistDB, subsume: bool = False, delta: Delta | None = None) -> int:
+    # subsume: delete the $adds and the $subs, and the four $muls if nothing else reads them
+
+    if db.backend == "sqlite":
+        # set-based: stage the matches, build each level of intermediate cells in bulk, then insert in two statements
+        stage(db, "complex_mul_matches", ("a", "b", "c", "d", "y1", "y2", "m1", "m2", "m3", "m4"), _COMPLEX_MUL_SQL, (), delta,
+              outputs=("a_sub_b", "c_sub_d", "c_add_d", "factor", "factor1", "factor2"))
+        for out, type_, a, b, width in (
+            ("a_sub_b", "'$subs'", "m.a", "m.b", "length(m.a) / 4"),
+            ("c_sub_d", "'$subs'", "m.c", "m.d", "length(m.c) / 4"),
+            ("c_add_d", "'$adds'", "m.c", "m.d", "length(m.c) / 4"),
+            ("factor", "'$muls'", "m.a_sub_b", "m.d", "length(m.y1) / 4"),
+            ("factor1", "'$muls'", "m.c_sub_d", "m.a", "length(m.y1) / 4"),
+            ("factor2", "'$muls'", "m.c_add_d", "m.b", "length(m.y2) / 4"),
+        ):
+            db.find_or_create_aby_cells("complex_mul_matches", out, type_, a, b, width)
+        db.execute("INSERT OR IGNORE INTO aby_cells (type, a, b, y) SELECT '$adds', factor, factor1, y1 FROM temp.complex_mul_matches")
+        cnt = db.execute("INSERT OR IGNORE INTO aby_cells (type, a, b, y) SELECT '$adds', factor, factor2, y2 FROM temp.complex_mul_matches").rowcount
+        if subsume:
+            subsume_cells(db, "aby_cells", db.query(
+                "SELECT '$adds', m1, m2, y1 FROM temp.complex_mul_matches UNION SELECT '$subs', m3, m4, y2 FROM temp.complex_mul_matches"
+            ))
+        db.commit()
+        return cnt
+
+    rows = _COMPLEX_MUL.match(db, _COMPLEX_MUL_SELECT, _COMPLEX_MUL_WHERE, delta)
 
     cnt = 0
-    for a, b, c, d, y1, y2 in cur.fetchall():
+    for a, b, c, d, y1, y2, *_ in rows:
         a_sub_b = db.find_or_create_aby_cell(NetlistDB.width_of(a), "$subs", a, b)
         factor = db.find_or_create_aby_cell(NetlistDB.width_of(y1), "$muls", a_sub_b, d)
         c_sub_d = db.find_or_create_aby_cell(NetlistDB.width_of(c), "$subs", c, d)
         factor1 = db.find_or_create_aby_cell(NetlistDB.width_of(y1), "$muls", c_sub_d, a)
         c_add_d = db.find_or_create_aby_cell(NetlistDB.width_of(c), "$adds", c, d)
         factor2 = db.find_or_create_aby_cell(NetlistDB.width_of(y2), "$muls", c_add_d, b)
-        cur.execute("INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", ("$adds", factor, factor1, y1))
-        cur.execute("INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", ("$adds", factor, factor2, y2))
-        cnt += cur.rowcount > 0
+        db.insert_rows("aby_cells", ("type", "a", "b", "y"), [("$adds", factor, factor1, y1)])
+        cnt += db.insert_rows("aby_cells", ("type", "a", "b", "y"), [("$adds", factor, factor2, y2)]) > 0
+    if subsume:
+        subsume_cells(db, "aby_cells", chain.from_iterable(
+            (("$adds", m1, m2, y1), ("$subs", m3, m4, y2)) for _, _, _, _, y1, y2, m1, m2, m3, m4 in rows
+        ))
 
     db.commit()
     return cnt
 
-def rewrite_split_wide_mul(db: NetlistDB, a_width: int, b_width: int, subsume: bool = False) -> int:
-    assert not subsume, "Subsumption is not supported for wide multiplication rewrites"
+@tracked(tables_of(_SPLIT_WIDE_MUL))
+def rewrite_split_wide_mul(db: NetlistDB, a_width: int, b_width: int, subsume: bool = False, delta: Delta | None = None) -> int:
     # for simplicity, we only rewrite unsigned multiplication
     # each time it splits `b` into two parts if the width of `b` is larger than `b_width`
     # and the width of `a` is no larger than `a_width`
+    # subsume: delete the wide multiplication
 
-    cur = db.execute("SELECT a, b, y FROM aby_cells WHERE type = '$mulu' AND width_of(a) <= ? AND width_of(b) > ? AND width_of(y) > ?", (a_width, b_width, b_width))
+    where = [cond.format(a_width=int(a_width), b_width=int(b_width)) for cond in _SPLIT_WIDE_MUL_WHERE]
+    rows = _SPLIT_WIDE_MUL.match(db, _SPLIT_WIDE_MUL_SELECT, where, delta)
 
     cnt = 0
-    for a, b, y in cur.fetchall():
-        bs, ys = b.split(","), y.split(",")
-        blo, bhi = bs[:a_width], bs[a_width:]
-        ylo, yhi = ys[:a_width], ys[a_width:]
-        a_blo = db.next_wires(len(ys) - a_width)+ "," + ",".join(ylo)
-        cur.execute("INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", ("$mulu", a, ",".join(blo), a_blo))
-        a_bhi = db.find_or_create_aby_cell(len(ys) - a_width, "$mulu", a, ",".join(bhi))
-        cur.execute("INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", ("$addu", a_bhi, a_blo, ",".join(yhi)))
-        cnt += cur.rowcount > 0
+    for a, b, y in rows:
+        y_width = NetlistDB.width_of(y)
+        blo, bhi = NetlistDB.split_at(b, a_width)
+        ylo, yhi = NetlistDB.split_at(y, a_width)
+        a_blo = db.next_wires(y_width - a_width) + ylo
+        db.insert_rows("aby_cells", ("type", "a", "b", "y"), [("$mulu", a, blo, a_blo)])
+        a_bhi = db.find_or_create_aby_cell(y_width - a_width, "$mulu", a, bhi)
+        cnt += db.insert_rows("aby_cells", ("type", "a", "b", "y"), [("$addu", a_bhi, a_blo, yhi)]) > 0
+    if subsume:
+        subsume_cells(db, "aby_cells", (("$mulu", a, b, y) for a, b, y in rows))
 
     db.commit()
     return cnt
\ No newline at end of file
@@ -1,48 +1,61 @@
 from ..db import NetlistDB
+from .delta import Delta, match, stage
+from .subsume import subsume_cells
+from .tracking import tables_of, tracked
 
 
 """
 basic rewrites for logic and arithmetic cells
 """
 
-def rewrite_comm(db: NetlistDB, target_types: list[str], subsume: bool = False) -> int:
+# match queries, `{}` is replaced with the placeholders of `target_types`
+_COMM_SQL = "SELECT type, a, b, y FROM aby_cells WHERE type IN ({})"
+_ASSOC_TO_RIGHT_SQL = """
+    SELECT cell1.type, cell1.a, cell1.b, cell2.b, cell2.y, cell2.a
+    FROM aby_cells AS cell1 JOIN aby_cells AS cell2 ON cell1.y = cell2.a
+    WHERE cell1.type = cell2.type AND cell1.type IN ({})
+"""
+
+@tracked(tables_of(_COMM_SQL))
+def rewrite_comm(db: NetlistDB, target_types: list[str], subsume: bool = False, delta: Delta | None = None) -> int:
     # return the number of rows rewritten
     assert not subsume, "Subsumption is not supported for commutative arithmetic cells"
 
-    cur = db.execute("SELECT type, a, b, y FROM aby_cells WHERE type IN ({})".format(",".join("?" * len(target_types))), target_types)
-    newrows = [(type_, b, a, y) for type_, a, b, y in cur]
-    cur.executemany("INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", newrows)
+    rows = match(db, _COMM_SQL.format(",".join("?" * len(target_types))), target_types, delta=delta)
+    newrows = [(type_, b, a, y) for type_, a, b, y in rows]
+    cnt = db.insert_rows("aby_cells", ("type", "a", "b", "y"), newrows)
     db.commit()
 
-    return cur.rowcount
+    return cnt
 
-def rewrite_assoc_to_right(db: NetlistDB, target_types: list[str], subsume: bool = False) -> int:
+@tracked(tables_of(_ASSOC_TO_RIGHT_SQL))
+def rewrite_assoc_to_right(db: NetlistDB, target_types: list[str], subsume: bool = False, delta: Delta | None = None) -> int:
     # return the number of rows rewritten
     # e.g. (a + b) + c => a + (b + c)
     # NOTE: the width of b + c would be the same as (a + b) + c to preserve the semantics
-    assert not subsume, "Subsumption is not supported for associative arithmetic cells"
+    # subsume: delete (a + b) + c, and a + b if nothing else reads it
+
+    sql = _ASSOC_TO_RIGHT_SQL.format(",".join("?" * len(target_types)))
+    if db.backend == "sqlite":
+        # set-based: stage the matches, build the missing b + c in bulk, then insert in one statement
+        stage(db, "assoc_matches", ("type", "a", "b", "c", "y", "a_add_b"), sql, target_types, delta, outputs=("b_add_c",))
+        db.find_or_create_aby_cells("assoc_matches", "b_add_c", "m.type", "m.b", "m.c", "length(m.y) / 4")
+        cnt = db.execute("INSERT OR IGNORE INTO aby_cells (type, a, b, y) SELECT type, a, b_add_c, y FROM temp.assoc_matches").rowcount
+        if subsume:
+            subsume_cells(db, "aby_cells", db.query("SELECT type, a_add_b, c, y FROM temp.assoc_matches"))
+        db.commit()
+        return cnt
 
-    cur = db.execute("""
-        SELECT cell1.type, cell1.a, cell1.b, cell2.b, cell2.y
-        FROM aby_cells AS cell1 JOIN aby_cells AS cell2 ON cell1.y = cell2.a
-        WHERE cell1.type = cell2.type AND cell1.type IN ({})
-        """.format(",".join("?" * len(target_types))),
-        target_types
-    )
+    rows = match(db, sql, target_types, delta=delta)
 
     # first, build b + c if not exists
-    rows = cur.fetchall()
     newrows = []
-    for type_, a, b, c, y in rows:
-        cur.execute("SELECT y from aby_cells WHERE type = ? AND a = ? AND b = ?", (type_, b, c))
-        res = cur.fetchone()
-        if res is None:   # not exists
-            b_add_c = db.next_wires(NetlistDB.width_of(y))
-            cur.execute("INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", (type_, b, c, b_add_c))
-        else:
-            b_add_c = res[0]
+    for type_, a, b, c, y, _ in rows:
+        b_add_c = db.find_or_create_aby_cell(NetlistDB.width_of(y), type_, b, c)
         newrows.append((type_, a, b_add_c, y))
-    cur.executemany("INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", newrows)
+    cnt = db.insert_rows("aby_cells", ("type", "a", "b", "y"), newrows)
+    if subsume:
+        subsume_cells(db, "aby_cells", ((type_, a_add_b, c, y) for type_, _, _, c, y, a_add_b in rows))
     db.commit()
 
-    return cur.rowcount
\ No newline at end of file
+    return cnt
\ No newline at end of file
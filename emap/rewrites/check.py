@@ -0,0 +1,76 @@
+from ..db import NetlistDB
+from . import basic, arith, retiming
+from .dsp import pattern_of, plan_match_sql
+from typing import Iterable
+import re
+
+
+"""
+query plan checker for rewrites and DSP rulesets
+"""
+
+# built-in match queries with representative parameters
+_TYPES = ["$adds", "$muls"]
+_IN_TYPES = ",".join("?" * len(_TYPES))
+BUILTIN_QUERIES = {
+    "rewrite_comm": (basic._COMM_SQL.format(_IN_TYPES), _TYPES),
+    "rewrite_assoc_to_right": (basic._ASSOC_TO_RIGHT_SQL.format(_IN_TYPES), _TYPES),
+    "rewrite_complex_mul": (arith._COMPLEX_MUL_SQL, ()),
+    "rewrite_split_wide_mul": (arith._SPLIT_WIDE_MUL.sql(
+        arith._SPLIT_WIDE_MUL_SELECT, [cond.format(a_width=17, b_width=26) for cond in arith._SPLIT_WIDE_MUL_WHERE]
+    ), ()),
+    "rewrite_dff_forward_aby_cell": (retiming._DFF_FORWARD_ABY_CELL_SQL.format(_IN_TYPES), _TYPES),
+    "rewrite_dff_backward_aby_cell": (retiming._DFF_BACKWARD_ABY_CELL_SQL.format(_IN_TYPES), _TYPES),
+    "rewrite_split_wide_dff": (retiming._SPLIT_WIDE_DFF_SQL, (17,)),
+}
+
+_CONSTRAINT = re.compile(r"\((.*)\)$")
+_CONSTRAINT_COLUMN = re.compile(r"(\w+)[=<>]")
+
+def full_scans(db: NetlistDB, sql: str, params: tuple | list = ()) -> list[str]:
+    """
+    Return the query plan steps of `sql` that scan a whole table or build an automatic index.
+    Inner loops that are only constrained by `type` or width columns are reported too,
+    since they rescan the same range for every outer row.
+    """
+    scans = []
+    loops = 0
+    for _, parent, _, detail in db.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+        if detail.startswith(("SCAN CONSTANT ROW", "SCAN SUBQUERY", "USE TEMP B-TREE")):
+            continue
+        if detail.startswith("SCAN ") or "AUTOMATIC" in detail:
+            scans.append(detail)
+        elif detail.startswith("SEARCH ") and parent == 0 and loops > 0:
+            constraint = _CONSTRAINT.search(detail)
+            columns = set(_CONSTRAINT_COLUMN.findall(constraint.group(1))) if constraint else set()
+            if all(column == "type" or column.startswith("width_") for column in columns):
+                scans.append(detail)
+        loops += detail.startswith(("SCAN ", "SEARCH "))
+    return scans
+
+def check_query_plans(db: NetlistDB, rules: Iterable[dict] = (), verbose: bool = True) -> dict[str, list[str]]:
+    """
+    Run EXPLAIN QUERY PLAN on every built-in rewrite and every `match_sql` or acyclic `pattern` in `rules`.
+    Return a dictionary mapping each slow query to its full scans.
+    The DSP tables of `rules` must exist, see `create_dsp_tables()`.
+    """
+    queries = dict(BUILTIN_QUERIES)
+    for rule in rules:
+        if "pattern" not in rule:
+            queries[rule["name"]] = (plan_match_sql(rule["match_sql"]), ())
+            continue
+        pattern, select, where = pattern_of(rule)
+        if not pattern.cyclic:   # cyclic patterns run as a generic join outside SQLite
+            queries[rule["name"]] = (pattern.sql(select, where, db), ())
+
+    slow = {}
+    for name, (sql, params) in queries.items():
+        scans = full_scans(db, sql, params)
+        if scans:
+            slow[name] = scans
+            if verbose:
+                print(f"{name} scans full tables: {'; '.join(scans)}")
+
+    if verbose:
+        print(f"Checked {len(queries)} queries, {len(slow)} of them scan full tables.")
+    return slow
@@ -0,0 +1,121 @@
+from ..db import NetlistDB
+from typing import Callable, Iterable
+import re
+
+
+"""
+semi-naive evaluation of the match queries
+a fixpoint loop passes the same `Delta` to every call of a rewrite, each call then only joins
+the rows inserted since its previous call (the delta) with the rest of the tables
+"""
+
+_FROM = re.compile(r"\bFROM\s+(.+?)(?:\s+WHERE\s+|\s*$)", re.I | re.S)
+_JOIN = re.compile(r"\s+(?:CROSS\s+|INNER\s+)?JOIN\s+|\s*,\s*", re.I)
+_ON = re.compile(r"\s+ON\s+", re.I)
+_TABLE = re.compile(r"^(\w+)(?:\s+(?:AS\s+)?(\w+))?$", re.I)
+_WHERE = re.compile(r"\bWHERE\b", re.I)
+_UNSUPPORTED = re.compile(r"\b(?:ORDER|GROUP|LIMIT|UNION|HAVING)\b", re.I)
+
+def aliases_of(sql: str) -> dict[str, str]:
+    """
+    Return {alias: table} of the FROM clause of a conjunctive SELECT, in join order.
+    """
+    m = _FROM.search(sql)
+    if m is None or _UNSUPPORTED.search(sql):
+        raise ValueError(f"Unsupported query for delta evaluation: {sql}")
+    aliases = {}
+    for part in _JOIN.split(m[1].strip()):
+        mt = _TABLE.match(_ON.split(part.strip(), 1)[0].strip())
+        if mt is None:
+            raise ValueError(f"Unsupported table `{part}` in query: {sql}")
+        aliases[mt[2] or mt[1]] = mt[1]
+    return aliases
+
+
+class Delta:
+    """
+    Rowid watermarks of the match queries, keyed by the query and its parameters.
+    The first call of a query evaluates it in full, a later call evaluates the union over its aliases of
+    (aliases before: rows up to the watermark) x (this alias: rows above the watermark) x (aliases after: all rows),
+    so every match with at least one new row is found exactly once and no old match is found again.
+    A deletion may let SQLite reuse rowids below a watermark and an update changes rows in place,
+    the watermark of the table is then dropped.
+    """
+    def __init__(self):
+        self._marks: dict[tuple, dict[str, tuple[int, int]]] = {}
+        self._aliases: dict[str, dict[str, str]] = {}
+        self._plans: dict[tuple, str] = {}
+
+    def reset(self):
+        self._marks.clear()
+        self._plans.clear()
+
+    def plan(self, key: tuple, make: Callable[[], str]) -> str:
+        """
+        Return the query planned for `key` by the first call of `make()`.
+        """
+        if key not in self._plans:
+            self._plans[key] = make()
+        return self._plans[key]
+
+    def advance(self, db: NetlistDB, key: tuple, tables: Iterable[str]) -> tuple[dict[str, int] | None, dict[str, int]]:
+        """
+        Advance the watermarks of `key` over `tables`.
+        Return the previous watermarks, None on the first call, and the current largest rowids.
+        """
+        now = {table: (db.max_rowid(table), db.change_count(table)) for table in set(tables)}
+        before = self._marks.get(key)
+        self._marks[key] = now
+        if before is None:
+            return None, {table: mark for table, (mark, _) in now.items()}
+        return (
+            {table: mark if changes == now[table][1] else 0 for table, (mark, changes) in before.items()},
+            {table: mark for table, (mark, _) in now.items()}
+        )
+
+    def variants(self, db: NetlistDB, sql: str, params: Iterable = ()) -> list[tuple[str, tuple]]:
+        """
+        Return the (sql, params) queries to run instead of `sql` and advance the watermarks of `sql`.
+        """
+        params = tuple(params)
+        aliases = self._aliases.get(sql)
+        if aliases is None:
+            aliases = self._aliases[sql] = aliases_of(sql)
+        marks, now = self.advance(db, (sql, params), aliases.values())
+        if marks is None:
+            return [(sql, params)]
+
+        glue = " AND " if _WHERE.search(sql) else " WHERE "
+        res = []
+        names = list(aliases)
+        for i, alias in enumerate(names):
+            if marks[aliases[alias]] >= now[aliases[alias]]:
+                continue    # nothing new in this table
+            conds = [f"{old}.rowid <= ?" for old in names[:i]] + [f"{alias}.rowid > ?"]
+            extra = tuple(marks[aliases[old]] for old in names[:i]) + (marks[aliases[alias]],)
+            res.append((sql.rstrip().rstrip(";") + glue + " AND ".join(conds), params + extra))
+        return res
+
+    def query(self, db: NetlistDB, sql: str, params: Iterable = ()) -> list[tuple]:
+        """
+        Return the matches of `sql` with at least one row inserted since the previous call.
+        """
+        return [row for variant, variant_params in self.variants(db, sql, params) for row in db.query(variant, variant_params)]
+
+def match(db: NetlistDB, sql: str, params: Iterable = (), delta: Delta | None = None) -> list[tuple]:
+    """
+    Run a match query, only on the new rows if `delta` is given.
+    """
+    return db.query(sql, params) if delta is None else delta.query(db, sql, params)
+
+def stage(db: NetlistDB, table: str, columns: Iterable[str], sql: str, params: Iterable = (), delta: Delta | None = None, outputs: Iterable[str] = ()) -> int:
+    """
+    Stage the matches of a query in the TEMP table `table`, only the new ones if `delta` is given (SQLite only).
+    The selected values fill `columns`, `outputs` are extra columns left NULL.
+    Return the number of matches.
+    """
+    columns = tuple(columns)
+    db.execute(f"DROP TABLE IF EXISTS temp.{table}")
+    db.execute(f"CREATE TEMP TABLE {table} ({', '.join((*columns, *outputs))})")
+    variants = [(sql, tuple(params))] if delta is None else delta.variants(db, sql, params)
+    return sum(db.execute(f"INSERT INTO temp.{table} ({', '.join(columns)}) {variant}", variant_params).rowcount for variant, variant_params in variants)
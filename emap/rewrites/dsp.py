@@ -1,4 +1,12 @@
 from ..db import NetlistDB
+from .delta import Delta, match
+from .pattern import Pattern, parse
+from .profile import Profiler
+from .tracking import tables_of, tracked
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import re
+import sqlite3
+import time
 
 
 """
@@ -8,16 +16,128 @@ dsp proposal rewrites
 def create_dsp_tables(db: NetlistDB, rules: list[dict]):
     """
     Create tables for DSP proposals in the database.
+    On SQLite, the output `out` of a proposal gets an index for the range scans of `greedy.fix_dsps()`.
     """
     for rule in rules:
-        db.execute("CREATE TABLE IF NOT EXISTS {} (value INTEGER, {}, PRIMARY KEY ({}));".format(
+        db.create_table(
             rule["name"],
-            ",".join(f"{port['name']} VARCHAR(64)" for port in rule["ports"]),
-            ",".join(port["name"] for port in rule["ports"] if port["is_input"])
-        ))
+            {"value": "INTEGER", **{port["name"]: "BLOB" for port in rule["ports"]}},
+            [port["name"] for port in rule["ports"] if port["is_input"]]
+        )
+        if db.backend == "sqlite":
+            db.execute(f"CREATE INDEX IF NOT EXISTS {rule['name']}_out ON {rule['name']} (out)")
 
-def rewrite_dsp(db: NetlistDB, rule: dict, subsume: bool = False) -> int:
+_WIDTH_OF = re.compile(r"width_of\((\w+)\.(a|b|s|y|d|clk|q)\)")
+
+def plan_match_sql(match_sql: str) -> str:
+    """
+    Replace `width_of(alias.port)` calls in a legacy `match_sql` with the stored width columns.
+    The planned query never calls back into Python and can use the width indexes.
+    """
+    return _WIDTH_OF.sub(r"\1.width_\2", match_sql)
+
+def pattern_of(rule: dict) -> tuple[Pattern, list[str], list[str]]:
+    """
+    Return the pattern of a rule written with `pattern` instead of `match_sql`, its select and where expressions.
+    `value` is the cost expression, every port is the variable of its name, `where` lists the conditions.
+    """
+    select = [rule["value"], *(f"?{port['name']}" for port in rule["ports"])]
+    return parse(rule["pattern"]), select, rule.get("where", [])
+
+def reads_of(rule: dict, *args, **kwargs) -> set[str] | None:
+    """
+    Return the tables read by a rule, derived from its `pattern` or `match_sql`, None if `match_sql` cannot be parsed.
+    """
+    if "pattern" in rule:
+        return tables_of(parse(rule["pattern"]))
+    try:
+        return tables_of(rule["match_sql"])
+    except ValueError:
+        return None
+
+@tracked(reads_of, key=lambda rule, subsume=False, delta=None: (rule["name"], subsume))
+def rewrite_dsp(db: NetlistDB, rule: dict, subsume: bool = False, delta: Delta | None = None) -> int:
     assert not subsume, "DSP rewrites do not support subsumption yet"
 
-    cur = db.execute("INSERT OR IGNORE INTO {} {}".format(rule["name"], rule["match_sql"]))
-    return cur.rowcount
\ No newline at end of file
+    if "pattern" in rule:
+        pattern, select, where = pattern_of(rule)
+        if db.backend != "sqlite" or pattern.cyclic:
+            return db.insert_rows(rule["name"], db.columns_of(rule["name"]), pattern.match(db, select, where, delta))
+        sql = pattern.sql(select, where, db) if delta is None else delta.plan((rule["name"],), lambda: pattern.sql(select, where, db))
+    else:
+        sql = plan_match_sql(rule["match_sql"])
+    if db.backend == "sqlite":
+        # stays inside SQLite, no rows go through Python
+        variants = [(sql, ())] if delta is None else delta.variants(db, sql)
+        return sum(db.execute("INSERT OR IGNORE INTO {} {}".format(rule["name"], variant), params).rowcount for variant, params in variants)
+    return db.insert_rows(rule["name"], db.columns_of(rule["name"]), match(db, sql, delta=delta))
+
+# parallel matching
+# the rules only read the core tables, so every worker process matches on its own read-only copy of the e-graph
+_worker_db: sqlite3.Connection | None = None
+
+def _init_worker(data: bytes):
+    global _worker_db
+    _worker_db = sqlite3.connect(":memory:")
+    _worker_db.deserialize(data)
+    _worker_db.execute("PRAGMA query_only = 1")
+
+def _match_rule(name: str, sql: str) -> tuple[str, list[tuple], float]:
+    phase_time = time.time()
+    rows = _worker_db.execute(sql).fetchall()
+    return name, rows, time.time() - phase_time
+
+def rewrite_dsps_parallel(db: NetlistDB, rules: list[dict], workers: int | None = None, verbose: bool = True, profiler: Profiler | None = None) -> dict[str, int]:
+    """
+    Match all `rules` concurrently on a pool of `workers` processes, then insert the proposals into the DSP tables.
+    Return the number of new proposals of each rule.
+    Cyclic pattern rules, and every rule on the columnar backend, run with `rewrite_dsp()` in this process.
+    Every rule is profiled by `profiler` if given, the matching time of a worker counts as SQL time.
+    """
+    phase_time = time.time()
+    jobs, local, states = [], [], {}
+    cnts, slowest = {}, 0.0
+    for rule in rules:
+        state = rewrite_dsp.changed(db, rule)
+        if state is None:
+            cnts[rule["name"]] = 0     # none of its tables changed since it last ran
+            if profiler is not None:
+                profiler.skip(rule["name"])
+        elif db.backend != "sqlite":
+            local.append(rule)
+        elif "pattern" not in rule:
+            jobs.append((rule["name"], plan_match_sql(rule["match_sql"])))
+            states[rule["name"]] = state
+        else:
+            pattern, select, where = pattern_of(rule)
+            if pattern.cyclic:
+                local.append(rule)
+            else:
+                jobs.append((rule["name"], pattern.sql(select, where, db)))
+                states[rule["name"]] = state
+
+    if jobs:
+        db.commit()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db.serialize(),)) as pool:
+            futures = [pool.submit(_match_rule, name, sql) for name, sql in jobs]
+            # merge in completion order, while the slower rules are still matching
+            for future in as_completed(futures):
+                name, rows, elapsed = future.result()
+                insert_time = time.time()
+                cnts[name] = db.insert_rows(name, db.columns_of(name), rows)
+                slowest = max(slowest, elapsed)
+                if profiler is not None:
+                    insert_time = time.time() - insert_time
+                    profiler.record(name, elapsed + insert_time, elapsed + insert_time, len(rows), cnts[name])
+        db.commit()
+        db.rule_versions.update(state for state in states.values() if state[0] is not None)
+    for rule in local:
+        if profiler is None:
+            cnts[rule["name"]] = rewrite_dsp(db, rule)
+        else:
+            with profiler.measure(db, rule["name"]):
+                cnts[rule["name"]] = rewrite_dsp(db, rule)
+
+    if verbose:
+        print(f"rewrite_dsps_parallel() matched {len(rules)} rules in {time.time() - phase_time:.2f} seconds, the slowest rule took {slowest:.2f} seconds.")
+    return cnts
@@ -0,0 +1,228 @@
+from ..db import NetlistDB
+from ..hier import SCHEMA_FILE
+from .runner import Rewrite, saturate
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+
+
+"""
+clock-partitioned retiming
+retiming matches never cross `clk` values, so the e-graph is split into partitions of one clock and one
+connected region (aby_cells and dffs linked by shared bundles), regions without dffs are partitions of their own,
+every partition is rewritten to a fixpoint
+in a worker e-graph of its own, then the new rows are merged back with their fresh wires renumbered
+"""
+
+_TABLES = ("aby_cells", "dffs")
+
+def _find(parent: dict[bytes, bytes], x: bytes) -> bytes:
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+def _union(parent: dict[bytes, bytes], bundles: tuple[bytes, ...]):
+    for bundle in bundles:
+        parent.setdefault(bundle, bundle)
+    root = _find(parent, bundles[0])
+    for bundle in bundles[1:]:
+        other = _find(parent, bundle)
+        if other != root:
+            parent[other] = root
+
+def clock_partitions(db: NetlistDB) -> dict[tuple[bytes, bytes], dict[str, list[tuple]]]:
+    """
+    Return {(clk, region): {"aby_cells": rows, "dffs": rows}}, rows are tuples of `CELL_COLUMNS`.
+    A region is named by one of its bundles, its partition of `clk` holds the dffs of `clk`
+    and every aby_cell of the region. A region without dffs is one partition of the empty clock b"".
+    """
+    cells = db.query("SELECT type, a, b, y FROM aby_cells")
+    dffs = db.query("SELECT d, clk, q FROM dffs")
+    parent: dict[bytes, bytes] = {}
+    for _, a, b, y in cells:
+        _union(parent, (y, a, b))
+    for d, _, q in dffs:
+        _union(parent, (q, d))
+
+    regions: dict[bytes, list[tuple]] = {}
+    for row in cells:
+        regions.setdefault(_find(parent, row[3]), []).append(row)
+    partitions: dict[tuple[bytes, bytes], dict[str, list[tuple]]] = {}
+    for row in dffs:
+        region = _find(parent, row[2])
+        partitions.setdefault((row[1], region), {"aby_cells": regions.get(region, []), "dffs": []})["dffs"].append(row)
+    # combinational regions, so that rewrites of the aby_cells reach every cell
+    clocked = {region for _, region in partitions}
+    for region, rows in regions.items():
+        if region not in clocked:
+            partitions[(b"", region)] = {"aby_cells": rows, "dffs": []}
+    return partitions
+
+def _bundles(row: tuple) -> list[bytes]:
+    # the data bundles of an aby_cell (type, a, b, y) or a dff (d, clk, q), clocks do not connect regions
+    return [row[1], row[2], row[3]] if len(row) == 4 else [row[0], row[2]]
+
+def _pack(partitions: list[dict[str, list[tuple]]], n: int) -> tuple[list[dict[str, list[tuple]]], list[int]]:
+    # largest partitions first, each into the lightest job, return the jobs and the job of every partition
+    jobs = [{table: {} for table in _TABLES} for _ in range(min(n, len(partitions)))]
+    loads = [0] * len(jobs)
+    assigned = [0] * len(partitions)
+    for k in sorted(range(len(partitions)), key=lambda k: -sum(map(len, partitions[k].values()))):
+        i = loads.index(min(loads))
+        for table in _TABLES:
+            jobs[i][table].update(dict.fromkeys(partitions[k][table]))
+        loads[i] += sum(map(len, partitions[k].values()))
+        assigned[k] = i
+    return [{table: list(rows) for table, rows in job.items()} for job in jobs], assigned
+
+def _retime_job(job: tuple) -> tuple[dict[str, list[tuple]], float]:
+    """
+    Worker of `retime_by_clock()`, rewrite the rows of some partitions to a fixpoint.
+    Return the new rows of each table.
+    """
+    rows, rewrites, schema_file, cnt, max_iters = job
+    phase_time = time.time()
+    db = NetlistDB(schema_file, ":memory:", cnt=cnt)
+    for table in _TABLES:
+        db.insert_rows(table, NetlistDB.CELL_COLUMNS[table], rows[table])
+    marks = {table: db.max_rowid(table) for table in _TABLES}
+    saturate(db, rewrites, max_iters=max_iters, verbose=False)
+    new = {
+        table: db.query(f"SELECT {', '.join(NetlistDB.CELL_COLUMNS[table])} FROM {table} WHERE rowid > ? ORDER BY rowid", (marks[table],))
+        for table in _TABLES
+    }
+    db.close()
+    return new, time.time() - phase_time
+
+_LOOKUPS = {
+    "aby_cells": "SELECT y FROM aby_cells WHERE type = ? AND a = ? AND b = ?",
+    "dffs": "SELECT q FROM dffs WHERE d = ? AND clk = ?",
+}
+
+def _merge(db: NetlistDB, new: dict[str, list[tuple]], base: int) -> tuple[int, list[tuple]]:
+    """
+    Insert the new rows of a worker, whose fresh wires are the bits above `base`.
+    Fresh bits get new wires of `db`, a fresh output whose hash-cons key exists in `db` (created by
+    another worker) is mapped to the existing output instead.
+    Return the number of inserted rows and the merged rows in the order they got defined.
+    """
+    mapping: dict[int, int] = {}
+    bundles: dict[bytes, bytes] = {}
+
+    def remap(bundle: bytes) -> bytes | None:
+        # None until every fresh bit is mapped
+        if bundle in bundles:
+            return bundles[bundle]
+        bits = NetlistDB.bits_of(bundle)
+        if max(bits, default=0) > base:
+            for i, bit in enumerate(bits):
+                if bit > base:
+                    if bit not in mapping:
+                        return None
+                    bits[i] = mapping[bit]
+        bundles[bundle] = bits.tobytes()
+        return bundles[bundle]
+
+    # rows are ready once the rows defining their fresh inputs are merged
+    pending = [(table, row) for table in _TABLES for row in new[table]]
+    merged = []
+    while pending:
+        rest = []
+        for table, row in pending:
+            key = tuple(remap(value) if isinstance(value, bytes) else value for value in row[:-1])
+            if None in key:
+                rest.append((table, row))
+                continue
+            out = NetlistDB.bits_of(row[-1])
+            fresh = [bit for bit in out if bit > base and bit not in mapping]
+            existing = db.execute(_LOOKUPS[table], key).fetchone() if fresh and len(fresh) == len(out) else None
+            if existing is not None and len(existing[0]) == len(row[-1]):
+                mapping.update(zip(out, NetlistDB.bits_of(existing[0])))
+            elif fresh:
+                mapping.update(zip(fresh, NetlistDB.bits_of(db.next_wires(len(fresh)))))
+            merged.append((table, (*key, remap(row[-1]))))
+        if len(rest) == len(pending):
+            raise RuntimeError("Fresh wires of a retiming worker are never defined")
+        pending = rest
+
+    cnt = sum(db.insert_rows(table, NetlistDB.CELL_COLUMNS[table], [row for table_, row in merged if table_ == table]) for table in _TABLES)
+    return cnt, [row for _, row in merged]
+
+def retime_by_clock(
+    db: NetlistDB, rewrites: list[Rewrite], workers: int | None = None, schema_file: str = SCHEMA_FILE,
+    max_iters: int = 30, max_rounds: int = 10, verbose: bool = True
+) -> int:
+    """
+    Rewrite every partition of `clock_partitions()` with `saturate(rewrites)` on a pool of `workers` processes,
+    or in this process if `workers` is 1, then merge the new rows into `db`.
+    The rewrites must only read aby_cells and dffs and must not subsume.
+    A round reruns the partitions that got new rows from the jobs of other partitions,
+    e.g. a dff of one clock retimed into a cell read by a dff of another clock, until nothing changes.
+    Other backends run `saturate(rewrites)` on the whole e-graph. Return the number of new rows.
+    """
+    for rewrite in rewrites:
+        reads = getattr(rewrite.fn, "reads", None)
+        if reads is None or callable(reads) or not set(reads) <= set(_TABLES) or rewrite.kwargs.get("subsume"):
+            raise ValueError(f"Rewrite {rewrite.name} cannot run on clock partitions")
+    if db.backend != "sqlite":
+        before = sum(db.max_rowid(table) for table in _TABLES)
+        saturate(db, rewrites, max_iters=max_iters, verbose=verbose)
+        return sum(db.max_rowid(table) for table in _TABLES) - before
+
+    workers = workers or os.cpu_count() or 1
+    start_time = time.time()
+    total = 0
+    touched: dict[bytes, set[int]] | None = None  # bundle -> jobs that merged rows on it
+    owners: dict[bytes, dict[bytes, int]] = {}  # bundle -> clk -> job that rewrote the partition of `clk` on it
+    for round_ in range(max_rounds):
+        phase_time = time.time()
+        partitions = clock_partitions(db)
+        if touched is not None:
+            # a job already saturated its own rows, rerun the partitions that got rows from other jobs
+            partitions = {
+                (clk, region): partition for (clk, region), partition in partitions.items()
+                if any(
+                    touched.get(bundle, set()) - {owners.get(bundle, {}).get(clk)}
+                    for table in _TABLES for row in partition[table] for bundle in _bundles(row)
+                )
+            }
+        if not partitions:
+            break
+        # fresh wires of the workers are above every wire of the e-graph
+        base = max([db.cnt, *(max(NetlistDB.bits_of(bundle), default=0) for p in partitions.values() for table in _TABLES for row in p[table] for bundle in row if isinstance(bundle, bytes))])
+        db.cnt = base
+        jobs, assigned = _pack(list(partitions.values()), 1 if workers == 1 else 4 * workers)
+        args = [(job, rewrites, schema_file, base, max_iters) for job in jobs]
+        if workers == 1 or len(jobs) == 1:
+            results = list(map(_retime_job, args))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_retime_job, args))
+
+        touched, owners, cnt, slowest = {}, {}, 0, 0.0
+        for ((clk, _), partition), i in zip(partitions.items(), assigned):
+            for table in _TABLES:
+                for row in partition[table]:
+                    for bundle in _bundles(row):
+                        owners.setdefault(bundle, {})[clk] = i
+        for i, (new, elapsed) in enumerate(results):
+            inserted, rows = _merge(db, new, base)
+            cnt += inserted
+            slowest = max(slowest, elapsed)
+            for row in rows:
+                bundles = _bundles(row)
+                # a new row belongs to the partitions of the job it was derived in
+                clocks = {clk for bundle in bundles for clk, j in owners.get(bundle, {}).items() if j == i}
+                for bundle in bundles:
+                    owners.setdefault(bundle, {}).update(dict.fromkeys(clocks, i))
+                    touched.setdefault(bundle, set()).add(i)
+        db.commit()
+        total += cnt
+        if verbose:
+            print(f"retime_by_clock() round {round_ + 1}: {len(partitions)} partitions in {len(jobs)} jobs, +{cnt} rows in {time.time() - phase_time:.2f} seconds, the slowest job took {slowest:.2f} seconds.")
+        if cnt == 0:
+            break
+    if verbose:
+        print(f"retime_by_clock() added {total} rows in {time.time() - start_time:.2f} seconds.")
+    return total
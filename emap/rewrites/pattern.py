@@ -0,0 +1,353 @@
+from ..db import NetlistDB
+from .delta import Delta
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator
+import re
+
+
+"""
+declarative cell patterns
+a pattern is a comma-separated list of terms, a term is either a variable `?x` or a cell
+`[?y:]$type(port=term, ...)` whose value is its output bundle (`y` of a cell, `q` of a `$dff`), e.g.
+    ?q:$dff(d=$adds(a=?x, b=?y), clk=?clk)
+a variable used twice binds the same bundle, omitted ports are unconstrained
+select and where expressions refer to variables as `?x` and to their widths as `width(?x)`, e.g.
+    Pattern("?q:$dff(d=$muls(a=?a, b=?b), clk=?clk)").match(db, ["?clk", "?a", "?b", "?q"], ["width(?a) <= 27"])
+acyclic patterns are compiled to one SQL query with a cost-based join order,
+cyclic patterns are evaluated by a generic (worst-case optimal) join over the cells of their types
+"""
+
+@dataclass
+class Atom:
+    table: str
+    type_: str | None           # None for dffs
+    cols: dict[str, str]        # column -> variable
+
+    @property
+    def vars(self) -> list[str]:
+        return list(dict.fromkeys(self.cols.values()))
+
+_TOKEN = re.compile(r"\s*(\?\w+|\$\w+|\w+|\S)")
+_WIDTH = re.compile(r"width\(\s*\?(\w+)\s*\)")
+_VAR = re.compile(r"\?(\w+)")
+_EQ = re.compile(r"(?<![<>!=])=(?!=)")
+
+def table_of(type_: str) -> str:
+    if type_ == "$dff":
+        return "dffs"
+    if type_ == "$mux":
+        return "absy_cells"
+    if type_ in {"$not", "$logic_not"}:
+        return "ay_cells"
+    return "aby_cells"
+
+def _acyclic(edges: list[set[str]]) -> bool:
+    """
+    GYO reduction, an alpha-acyclic hypergraph reduces to at most one edge.
+    """
+    edges = [set(edge) for edge in edges]
+    changed = True
+    while changed and len(edges) > 1:
+        changed = False
+        for edge in edges:
+            for var in [var for var in edge if sum(var in other for other in edges) == 1]:
+                edge.discard(var)
+                changed = True
+        for i, edge in enumerate(edges):
+            if any(j != i and edge <= other for j, other in enumerate(edges)):
+                edges.pop(i)
+                changed = True
+                break
+    return len(edges) <= 1
+
+
+class Pattern:
+    def __init__(self, text: str):
+        self.text = text
+        self.atoms: list[Atom] = []
+        self._tokens = [m[1] for m in _TOKEN.finditer(text)]
+        self._pos = 0
+        self._fresh = 0
+        self.roots = [self._term()]
+        while self._peek() == ",":
+            self._next()
+            self.roots.append(self._term())
+        if self._peek() is not None:
+            raise ValueError(f"Unexpected `{self._peek()}` in pattern: {text}")
+        del self._tokens
+        self.cyclic = not _acyclic([set(atom.vars) for atom in self.atoms])
+
+    # parser
+    def _peek(self) -> str | None:
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else None
+
+    def _next(self, expected: str | None = None) -> str:
+        token = self._peek()
+        if token is None or expected is not None and token != expected:
+            raise ValueError(f"Expected `{expected or 'a term'}` but got `{token}` in pattern: {self.text}")
+        self._pos += 1
+        return token
+
+    def _term(self) -> str:
+        token = self._next()
+        if token.startswith("?"):
+            if self._peek() != ":":
+                return token[1:]
+            self._next(":")
+            return self._cell(self._next(), token[1:])
+        return self._cell(token, None)
+
+    def _cell(self, type_: str, out: str | None) -> str:
+        if not type_.startswith("$"):
+            raise ValueError(f"Expected a cell type but got `{type_}` in pattern: {self.text}")
+        table = table_of(type_)
+        *inputs, output = NetlistDB.CELL_COLUMNS[table][1:] if table != "dffs" else NetlistDB.CELL_COLUMNS[table]
+        if out is None:
+            self._fresh += 1
+            out = f"_{self._fresh}"
+        atom = Atom(table, None if table == "dffs" else type_, {})
+        self._next("(")
+        while self._peek() != ")":
+            port = self._next().lower()
+            if port not in inputs:
+                raise ValueError(f"{type_} has no input port `{port}` in pattern: {self.text}")
+            self._next("=")
+            atom.cols[port] = self._term()
+            if self._peek() == ",":
+                self._next(",")
+        self._next(")")
+        atom.cols[output] = out
+        self.atoms.append(atom)
+        return out
+
+    # planning
+    def _sizes(self, db: NetlistDB) -> list[int]:
+        sizes = []
+        for atom in self.atoms:
+            where, params = ("WHERE type = ?", (atom.type_,)) if atom.type_ else ("", ())
+            if db.backend == "sqlite":
+                sizes.append(db.query(f"SELECT count(*) FROM {atom.table} {where}", params)[0][0])
+            else:
+                sizes.append(len(db.query(f"SELECT rowid FROM {atom.table} {where}", params)))
+        return sizes
+
+    def join_order(self, db: NetlistDB | None = None) -> list[int]:
+        """
+        Greedy cost-based join order: start from the smallest atom, then join the smallest atom
+        sharing a variable with the joined ones. Without `db`, atoms keep their order in the pattern.
+        """
+        if db is None:
+            return list(range(len(self.atoms)))
+        sizes = self._sizes(db)
+        order = [min(range(len(self.atoms)), key=lambda i: sizes[i])]
+        bound = set(self.atoms[order[0]].vars)
+        while len(order) < len(self.atoms):
+            rest = [i for i in range(len(self.atoms)) if i not in order]
+            connected = [i for i in rest if bound & set(self.atoms[i].vars)] or rest
+            order.append(min(connected, key=lambda i: sizes[i]))
+            bound.update(self.atoms[order[-1]].vars)
+        return order
+
+    def sql(self, select: Iterable[str], where: Iterable[str] = (), db: NetlistDB | None = None) -> str:
+        """
+        Compile the pattern to a SELECT of the `select` expressions, CROSS JOIN pins the join order.
+        """
+        order = self.join_order(db)
+        refs: dict[str, str] = {}    # variable -> first column bound to it
+        conds = []
+        for alias, i in enumerate(order):
+            atom = self.atoms[i]
+            if atom.type_ is not None:
+                conds.append(f"c{alias}.type = '{atom.type_}'")
+            for col, var in atom.cols.items():
+                if var in refs:
+                    conds.append(f"c{alias}.{col} = {refs[var]}")
+                else:
+                    refs[var] = f"c{alias}.{col}"
+
+        def compile_expr(expr: str, guard: str = "") -> str:
+            expr = _WIDTH.sub(lambda m: "{}{}.width_{}".format(guard, *self._ref(refs, m[1]).split(".")), expr)
+            return _VAR.sub(lambda m: self._ref(refs, m[1]), expr)
+
+        # unary + keeps the width filters off the indexes of the inner loops
+        conds += [compile_expr(cond, "+") for cond in where]
+        return "SELECT {} FROM {}{}".format(
+            ", ".join(compile_expr(expr) for expr in select),
+            " CROSS JOIN ".join(f"{self.atoms[i].table} AS c{alias}" for alias, i in enumerate(order)),
+            " WHERE " + " AND ".join(conds) if conds else ""
+        )
+
+    def _ref(self, refs: dict[str, str], var: str) -> str:
+        if var not in refs:
+            raise ValueError(f"Unknown variable `?{var}` in pattern: {self.text}")
+        return refs[var]
+
+    # evaluation
+    def match(
+        self, db: NetlistDB, select: Iterable[str], where: Iterable[str] = (),
+        delta: Delta | None = None, generic: bool | None = None
+    ) -> list[tuple]:
+        """
+        Return the values of `select` for every match where all `where` conditions hold,
+        only the matches with a new row if `delta` is given.
+        `generic` forces the generic join (True) or SQL (False), by default cyclic patterns use the generic join.
+        """
+        select, where = tuple(select), tuple(where)
+        if not (self.cyclic if generic is None else generic):
+            if delta is None:
+                return db.query(self.sql(select, where, db))
+            # the watermarks are kept per query, so the join order is planned once per fixpoint loop
+            return delta.query(db, delta.plan((self.text, select, where), lambda: self.sql(select, where, db)))
+
+        tables = [atom.table for atom in self.atoms]
+        if delta is None:
+            variants = [[None] * len(self.atoms)]
+        else:
+            marks, now = delta.advance(db, (self.text, select, where), tables)
+            if marks is None:
+                variants = [[None] * len(self.atoms)]
+            else:
+                # the same split as `Delta.variants()`
+                variants = [
+                    [("<=", marks[t]) for t in tables[:i]] + [(">", marks[tables[i]])] + [None] * (len(tables) - i - 1)
+                    for i in range(len(tables)) if marks[tables[i]] < now[tables[i]]
+                ]
+        fns = [self._python(expr) for expr in select]
+        res = []
+        loaded = {}
+        for bounds in variants:
+            relations = [self._load(db, atom, bound, loaded) for atom, bound in zip(self.atoms, bounds)]
+            for binding in self._generic_join(relations, [self._python(cond) for cond in where]):
+                res.append(tuple(fn(binding) for fn in fns))
+        return res
+
+    def _python(self, expr: str) -> Callable[[dict], object]:
+        variables = set(_VAR.findall(expr))
+        for var in variables:
+            if not any(var in atom.cols.values() for atom in self.atoms):
+                raise ValueError(f"Unknown variable `?{var}` in pattern: {self.text}")
+        code = _WIDTH.sub(r"(len(_v['\1']) // 4)", expr)
+        code = _VAR.sub(r"_v['\1']", code).replace("<>", "!=")
+        code = compile(_EQ.sub("==", code), "<pattern>", "eval")
+        fn = lambda binding: eval(code, {}, {"_v": binding})
+        fn.variables = variables
+        return fn
+
+    def _load(self, db: NetlistDB, atom: Atom, bound: tuple[str, int] | None, loaded: dict) -> list[tuple]:
+        """
+        Return the distinct variable values of the rows of `atom`, rows are limited by rowid if `bound` is given.
+        """
+        key = (atom.table, atom.type_, tuple(atom.cols), bound)
+        if key not in loaded:
+            conds, params = [], []
+            if atom.type_ is not None:
+                conds.append("type = ?")
+                params.append(atom.type_)
+            if bound is not None:
+                conds.append(f"rowid {bound[0]} ?")
+                params.append(bound[1])
+            sql = f"SELECT {', '.join(atom.cols)} FROM {atom.table}" + (" WHERE " + " AND ".join(conds) if conds else "")
+            loaded[key] = db.query(sql, params)
+        cols = list(atom.cols.values())
+        first = [cols.index(var) for var in atom.vars]
+        if len(first) == len(cols):
+            return loaded[key]
+        # a variable bound to several columns keeps the rows where they are equal
+        same = [(i, cols.index(var)) for i, var in enumerate(cols) if cols.index(var) != i]
+        return [
+            tuple(row[i] for i in first) for row in loaded[key]
+            if all(row[i] == row[j] for i, j in same)
+        ]
+
+    def _variable_order(self, relations: list[list[tuple]], sample: int = 1024) -> list[str]:
+        """
+        Greedy cost-based variable order: bind next the variable with the smallest estimated fanout,
+        the fanout of a variable in an atom is the number of distinct values of (bound variables + it)
+        over the number of distinct values of the bound variables, estimated on a sample of the rows.
+        """
+        samples = [rows[::max(1, len(rows) // sample)] for rows in relations]
+        distinct = {}
+
+        def count(i: int, variables: frozenset) -> int:
+            if not variables:
+                return 1
+            if (i, variables) not in distinct:
+                positions = [self.atoms[i].vars.index(var) for var in sorted(variables)]
+                distinct[i, variables] = len({tuple(row[p] for p in positions) for row in samples[i]})
+            return distinct[i, variables]
+
+        def fanout(var: str) -> float:
+            res = float("inf")
+            for i, atom in enumerate(self.atoms):
+                if var in atom.vars:
+                    known = frozenset(bound & set(atom.vars))
+                    res = min(res, count(i, known | {var}) / max(1, count(i, known)))
+            return res
+
+        variables = list(dict.fromkeys(var for atom in self.atoms for var in atom.vars))
+        order, bound = [], set()
+        while len(order) < len(variables):
+            # ties go to the variable shared by more atoms
+            var = min(
+                (var for var in variables if var not in bound),
+                key=lambda var: (fanout(var), -sum(var in atom.vars for atom in self.atoms))
+            )
+            order.append(var)
+            bound.add(var)
+        return order
+
+    def _generic_join(self, relations: list[list[tuple]], conds: list[Callable]) -> Iterator[dict]:
+        """
+        Bind one variable at a time to the intersection of its values in every atom,
+        atoms are indexed as tries in the variable order.
+        """
+        order = self._variable_order(relations)
+        depth_of = {var: depth for depth, var in enumerate(order)}
+
+        tries = []
+        atoms_of: list[list[int]] = [[] for _ in order]
+        for i, (atom, rows) in enumerate(zip(self.atoms, relations)):
+            trie_vars = sorted(atom.vars, key=lambda var: depth_of[var])
+            for var in trie_vars:
+                atoms_of[depth_of[var]].append(i)
+            positions = [atom.vars.index(var) for var in trie_vars]
+            trie = {}
+            for row in rows:
+                node = trie
+                for p in positions:
+                    node = node.setdefault(row[p], {})
+            tries.append(trie)
+        # every condition is checked once all of its variables are bound
+        checks: list[list[Callable]] = [[] for _ in order]
+        for cond in conds:
+            checks[max((depth_of[var] for var in cond.variables), default=0)].append(cond)
+
+        binding = {}
+
+        def join(depth: int, nodes: list[dict]) -> Iterator[dict]:
+            if depth == len(order):
+                yield dict(binding)
+                return
+            var = order[depth]
+            index = atoms_of[depth]
+            candidates = sorted((nodes[i] for i in index), key=len)
+            for value in candidates[0]:
+                if not all(value in node for node in candidates[1:]):
+                    continue
+                binding[var] = value
+                if not all(check(binding) for check in checks[depth]):
+                    continue
+                children = list(nodes)
+                for i in index:
+                    children[i] = nodes[i][value]
+                yield from join(depth + 1, children)
+
+        yield from join(0, tries)
+
+@lru_cache(maxsize=None)
+def parse(text: str) -> Pattern:
+    """
+    Return the pattern of `text`, parsed once.
+    """
+    return Pattern(text)
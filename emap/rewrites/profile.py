@@ -0,0 +1,190 @@
+from ..db import NetlistDB
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Iterator
+import functools
+import json
+import time
+
+
+"""
+per-rule profiling of the rewrites
+a profiler attached to an e-graph times its database calls and counts the rows every rule tries to insert,
+the rows it really inserts and the duplicates ignored by the hash-consing keys
+"""
+
+@dataclass
+class RuleProfile:
+    calls: int = 0
+    skipped: int = 0        # calls skipped by `tracked()`, the tables of the rule did not change
+    wall: float = 0.0       # seconds in the rule
+    sql: float = 0.0        # seconds in database calls, the rest is Python
+    matches: int = 0        # rows the rule tried to insert
+    inserted: int = 0       # rows really inserted
+
+    @property
+    def python(self) -> float:
+        return self.wall - self.sql
+
+    @property
+    def duplicates(self) -> int:
+        return self.matches - self.inserted
+
+class Profiler:
+    """
+    Accumulate a `RuleProfile` per rule name, across the iterations of `saturate()` and any number of calls.
+    On SQLite the attempted and inserted rows are counted by TEMP triggers (a BEFORE INSERT trigger also sees
+    the rows ignored by INSERT OR IGNORE), the database time is the time in `execute()`, `executemany()` and `query()`.
+    On the columnar backend both come from `insert_rows()` and `query()`.
+    """
+    _DB_CALLS = {
+        "sqlite": ("execute", "executemany", "query"),
+        "numpy": ("query", "insert_rows"),
+    }
+
+    def __init__(self):
+        self.rules: dict[str, RuleProfile] = {}
+        self._db: NetlistDB | None = None
+        self._tables: set[str] = set()
+        self._sql = 0.0
+        self._depth = 0
+        self._matches = self._inserted = 0
+
+    def _timed(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            # nested calls, e.g. `query()` on `execute()`, are timed once
+            self._depth += 1
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._sql += time.perf_counter() - start
+        return wrapper
+
+    def _count_rows(self, insert_rows):
+        # columnar backend, every insertion goes through `insert_rows()`
+        @functools.wraps(insert_rows)
+        def wrapper(table: str, columns, rows) -> int:
+            rows = list(rows)
+            cnt = insert_rows(table, columns, rows)
+            self._matches += len(rows)
+            self._inserted += cnt
+            return cnt
+        return wrapper
+
+    def _count(self, kind: str):
+        if kind == "match":
+            self._matches += 1
+        else:
+            self._inserted += 1
+
+    def _add_triggers(self, db: NetlistDB):
+        tables = set(db.tables_startswith("")) - self._tables
+        if tables:
+            db.executescript("".join(
+                f"CREATE TEMP TRIGGER IF NOT EXISTS {table}_profile_match BEFORE INSERT ON main.{table} BEGIN SELECT profile_count('match'); END;"
+                f"CREATE TEMP TRIGGER IF NOT EXISTS {table}_profile_insert AFTER INSERT ON main.{table} BEGIN SELECT profile_count('insert'); END;"
+                for table in sorted(tables)
+            ))
+            self._tables |= tables
+
+    def attach(self, db: NetlistDB):
+        """
+        Start timing and counting the calls of `db`, `measure()` attaches on its first call.
+        """
+        if self._db is db:
+            return
+        if self._db is not None:
+            self.detach()
+        for name in Profiler._DB_CALLS[db.backend]:
+            setattr(db, name, self._timed(getattr(db, name)))
+        if db.backend == "sqlite":
+            db.create_function("profile_count", 1, self._count)
+            self._add_triggers(db)
+        else:
+            db.insert_rows = self._count_rows(db.insert_rows)
+        self._db = db
+
+    def detach(self):
+        """
+        Restore the calls of the attached e-graph and drop the triggers.
+        """
+        db, self._db = self._db, None
+        if db is None:
+            return
+        for name in Profiler._DB_CALLS[db.backend]:
+            db.__dict__.pop(name, None)
+        if db.backend == "sqlite":
+            db.executescript("".join(
+                f"DROP TRIGGER IF EXISTS temp.{table}_profile_match; DROP TRIGGER IF EXISTS temp.{table}_profile_insert;"
+                for table in sorted(self._tables)
+            ))
+        else:
+            db.__dict__.pop("insert_rows", None)
+        self._tables = set()
+
+    @contextmanager
+    def measure(self, db: NetlistDB, name: str) -> Iterator[RuleProfile]:
+        """
+        Profile the block as one call of the rule `name` on `db`.
+        """
+        self.attach(db)
+        if db.backend == "sqlite":
+            self._add_triggers(db)  # tables created since, e.g. the DSP tables
+        sql, matches, inserted = self._sql, self._matches, self._inserted
+        profile = self.rules.setdefault(name, RuleProfile())
+        start = time.perf_counter()
+        try:
+            yield profile
+        finally:
+            self.record(
+                name, time.perf_counter() - start, self._sql - sql,
+                self._matches - matches, self._inserted - inserted
+            )
+
+    def skip(self, name: str):
+        """
+        Count a call of the rule `name` that `tracked()` skips, it is not one of its `calls`.
+        """
+        self.rules.setdefault(name, RuleProfile()).skipped += 1
+
+    def record(self, name: str, wall: float, sql: float, matches: int, inserted: int):
+        """
+        Add one call of the rule `name`, for work done outside the attached e-graph such as worker processes.
+        """
+        profile = self.rules.setdefault(name, RuleProfile())
+        profile.calls += 1
+        profile.wall += wall
+        profile.sql += sql
+        profile.matches += matches
+        profile.inserted += inserted
+
+    def to_json(self) -> list[dict]:
+        """
+        Return one record per rule, slowest first.
+        """
+        return [
+            {"name": name, **asdict(profile), "python": profile.python, "duplicates": profile.duplicates}
+            for name, profile in sorted(self.rules.items(), key=lambda item: -item[1].wall)
+        ]
+
+    def dump(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, indent=2)
+
+    def table(self) -> str:
+        """
+        Return the profiles as a text table, slowest first.
+        """
+        records = self.to_json()
+        width = max([4, *(len(record["name"]) for record in records)])
+        lines = [f"{'rule':<{width}} {'calls':>6} {'skipped':>7} {'wall':>9} {'sql':>9} {'python':>9} {'matches':>9} {'inserted':>9} {'dups':>9}"]
+        for record in records:
+            lines.append(
+                f"{record['name']:<{width}} {record['calls']:>6} {record['skipped']:>7} {record['wall']:>9.3f} {record['sql']:>9.3f} {record['python']:>9.3f} "
+                f"{record['matches']:>9} {record['inserted']:>9} {record['duplicates']:>9}"
+            )
+        return "\n".join(lines)
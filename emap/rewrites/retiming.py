@@ -1,11 +1,28 @@
 from ..db import NetlistDB
+from .delta import Delta, match, stage
+from .subsume import subsume_cells
+from .tracking import tables_of, tracked
 
 
 """
 retiming rewrites for dff cells
 """
 
-def rewrite_dff_forward_aby_cell(db: NetlistDB, target_types: list[str], subsume: bool = False) -> int:
+# match queries, `{}` is replaced with the placeholders of `target_types`
+_DFF_FORWARD_ABY_CELL_SQL = """
+    SELECT cell.type, dff1.clk, dff1.d, dff2.d, cell.y, cell.a, cell.b
+    FROM dffs AS dff1 JOIN dffs AS dff2 JOIN aby_cells as cell ON dff1.q = cell.a AND dff2.q = cell.b AND dff1.clk = dff2.clk
+    WHERE cell.type IN ({})
+"""
+_DFF_BACKWARD_ABY_CELL_SQL = """
+    SELECT cell.type, dff.clk, cell.a, cell.b, dff.q, dff.d
+    FROM dffs AS dff JOIN aby_cells as cell ON dff.d = cell.y
+    WHERE cell.type IN ({})
+"""
+_SPLIT_WIDE_DFF_SQL = "SELECT d, clk, q FROM dffs WHERE width_d > ?"
+
+@tracked(tables_of(_DFF_FORWARD_ABY_CELL_SQL))
+def rewrite_dff_forward_aby_cell(db: NetlistDB, target_types: list[str], subsume: bool = False, delta: Delta | None = None) -> int:
     """
     FROM
     -> dff -> aby_cell ->
@@ -13,35 +30,35 @@ def rewrite_dff_forward_aby_cell(db: NetlistDB, target_types: list[str], subsume
     TO
     -> aby_cell -> dff ->
     ->
+    subsume: delete the aby_cell, and the dffs if nothing else reads them
     """
-    assert not subsume, "Subsumption is not supported for retiming rewrites"
+    sql = _DFF_FORWARD_ABY_CELL_SQL.format(",".join("?" * len(target_types)))
+    if db.backend == "sqlite":
+        # set-based: stage the matches, build the missing aby_cells in bulk, then insert in one statement
+        stage(db, "dff_forward_matches", ("type", "clk", "a", "b", "y", "qa", "qb"), sql, target_types, delta, outputs=("aby_cell_y",))
+        db.find_or_create_aby_cells("dff_forward_matches", "aby_cell_y", "m.type", "m.a", "m.b", "length(m.y) / 4")
+        cnt = db.execute("INSERT OR IGNORE INTO dffs (d, clk, q) SELECT aby_cell_y, clk, y FROM temp.dff_forward_matches").rowcount
+        if subsume:
+            subsume_cells(db, "aby_cells", db.query("SELECT type, qa, qb, y FROM temp.dff_forward_matches"))
+        db.commit()
+        return cnt
 
-    cur = db.execute("""
-        SELECT cell.type, dff1.clk, dff1.d, dff2.d, cell.y
-        FROM dffs AS dff1 JOIN dffs AS dff2 JOIN aby_cells as cell ON dff1.q = cell.a AND dff2.q = cell.b AND dff1.clk = dff2.clk
-        WHERE cell.type IN ({})
-        """.format(",".join("?" * len(target_types))),
-        target_types
-    )
+    rows = match(db, sql, target_types, delta=delta)
 
     # first, build aby_cell if not exists
-    rows = cur.fetchall()
     newrows = []
-    for type_, clk, a, b, y in rows:
-        cur.execute("SELECT y from aby_cells WHERE type = ? AND a = ? AND b = ?", (type_, a, b))
-        res = cur.fetchone()
-        if res is None:
-            aby_cell_y = db.next_wires(NetlistDB.width_of(y))
-            cur.execute("INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", (type_, a, b, aby_cell_y))
-        else:
-            aby_cell_y = res[0]
+    for type_, clk, a, b, y, _, _ in rows:
+        aby_cell_y = db.find_or_create_aby_cell(NetlistDB.width_of(y), type_, a, b)
         newrows.append((aby_cell_y, clk, y))
-    cur.executemany("INSERT OR IGNORE INTO dffs (d, clk, q) VALUES (?, ?, ?)", newrows)
+    cnt = db.insert_rows("dffs", ("d", "clk", "q"), newrows)
+    if subsume:
+        subsume_cells(db, "aby_cells", ((type_, qa, qb, y) for type_, _, _, _, y, qa, qb in rows))
     db.commit()
 
-    return cur.rowcount
+    return cnt
 
-def rewrite_dff_backward_aby_cell(db: NetlistDB, target_types: list[str], subsume: bool = False) -> int:
+@tracked(tables_of(_DFF_BACKWARD_ABY_CELL_SQL))
+def rewrite_dff_backward_aby_cell(db: NetlistDB, target_types: list[str], subsume: bool = False, delta: Delta | None = None) -> int:
     """
     FROM
     -> aby_cell -> dff ->
@@ -49,41 +66,39 @@ def rewrite_dff_backward_aby_cell(db: NetlistDB, target_types: list[str], subsum
     TO
     -> dff -> aby_cell ->
     -> dff ->
+    subsume: delete the dff, and the aby_cell if nothing else reads it
     """
-    assert not subsume, "Subsumption is not supported for retiming rewrites"
 
-    cur = db.execute("""
-        SELECT cell.type, dff.clk, cell.a, cell.b, dff.q
-        FROM dffs AS dff JOIN aby_cells as cell ON dff.d = cell.y
-        WHERE cell.type IN ({})
-        """.format(",".join("?" * len(target_types))),
-        target_types
-    )
+    rows = match(db, _DFF_BACKWARD_ABY_CELL_SQL.format(",".join("?" * len(target_types))), target_types, delta=delta)
     newrows = []
-    for type_, clk, a, b, y in cur.fetchall():
+    for type_, clk, a, b, y, _ in rows:
         dffa = db.find_or_create_dff(NetlistDB.width_of(a), a, clk)
         dffb = db.find_or_create_dff(NetlistDB.width_of(b), b, clk)
         newrows.append((type_, dffa, dffb, y))
-    cur.executemany("INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", newrows)
+    cnt = db.insert_rows("aby_cells", ("type", "a", "b", "y"), newrows)
+    if subsume:
+        subsume_cells(db, "dffs", ((d, clk, y) for _, clk, _, _, y, d in rows))
     db.commit()
 
-    return cur.rowcount
+    return cnt
 
-def rewrite_split_wide_dff(db: NetlistDB, width: int, subsume: bool = False) -> int:
+@tracked(tables_of(_SPLIT_WIDE_DFF_SQL))
+def rewrite_split_wide_dff(db: NetlistDB, width: int, subsume: bool = False, delta: Delta | None = None) -> int:
     """
     Split dff into two dffs if the width is larger than `width`
+    subsume: delete the wide dff
     """
-    assert not subsume, "Subsumption is not supported for split dff rewrites"
 
-    cur = db.execute("SELECT d, clk, q FROM dffs WHERE width_of(d) > ?", (width,))
+    rows = match(db, _SPLIT_WIDE_DFF_SQL, (width,), delta=delta)
 
     cnt = 0
-    for d, clk, q in cur.fetchall():
-        d1, d2 = d.split(",")[:width], d.split(",")[width:]
-        q1, q2 = q.split(",")[:width], q.split(",")[width:]
-        cur.execute("INSERT OR IGNORE INTO dffs (d, clk, q) VALUES (?, ?, ?)", (",".join(d1), clk, ",".join(q1)))
-        cur.execute("INSERT OR IGNORE INTO dffs (d, clk, q) VALUES (?, ?, ?)", (",".join(d2), clk, ",".join(q2)))
-        cnt += cur.rowcount > 0
+    for d, clk, q in rows:
+        d1, d2 = NetlistDB.split_at(d, width)
+        q1, q2 = NetlistDB.split_at(q, width)
+        db.insert_rows("dffs", ("d", "clk", "q"), [(d1, clk, q1)])
+        cnt += db.insert_rows("dffs", ("d", "clk", "q"), [(d2, clk, q2)]) > 0
+    if subsume:
+        subsume_cells(db, "dffs", rows)
 
     db.commit()
     return cnt
\ No newline at end of file
@@ -0,0 +1,149 @@
+from ..db import NetlistDB
+from .delta import Delta
+from .dsp import rewrite_dsp
+from .profile import Profiler
+from dataclasses import dataclass, field
+from typing import Callable
+import time
+
+
+"""
+equality saturation runner
+iterates a list of rewrites with semi-naive evaluation until nothing changes or a budget runs out
+a scheduler decides which rewrites run in each iteration
+"""
+
+@dataclass
+class Rewrite:
+    name: str
+    fn: Callable[..., int]  # fn(db, *args, delta=..., **kwargs) -> number of rows rewritten
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+
+    def apply(self, db: NetlistDB, delta: Delta | None = None) -> int:
+        return self.fn(db, *self.args, delta=delta, **self.kwargs)
+
+    def skips(self, db: NetlistDB, delta: Delta | None = None) -> bool:
+        # whether `apply()` would return 0 at once, the tables of a tracked rewrite did not change, see `tracked()`
+        changed = getattr(self.fn, "changed", None)
+        return changed is not None and changed(db, *self.args, delta=delta, **self.kwargs) is None
+
+def dsp_rewrites(rules: list[dict]) -> list[Rewrite]:
+    """
+    Wrap the DSP rules of a ruleset, their tables must exist, see `create_dsp_tables()`.
+    """
+    return [Rewrite(rule["name"], rewrite_dsp, (rule,)) for rule in rules]
+
+
+class RoundRobinScheduler:
+    """
+    Run every rewrite in every iteration.
+    """
+    def can_run(self, rewrite: Rewrite, iteration: int) -> bool:
+        return True
+
+    def record(self, rewrite: Rewrite, iteration: int, cnt: int):
+        pass
+
+    def unban(self) -> bool:
+        # return True if any rewrite was banned
+        return False
+
+class BackoffScheduler(RoundRobinScheduler):
+    """
+    Throttle the rewrites that rewrite too much.
+    A rewrite that rewrites more than `match_limit << n` rows in an iteration, where n is the number of
+    its previous bans, is banned for the next `ban_length << (n + 1)` iterations. Its rows are kept.
+    """
+    def __init__(self, match_limit: int = 1000, ban_length: int = 5):
+        self.match_limit = match_limit
+        self.ban_length = ban_length
+        self.times_banned: dict[str, int] = {}
+        self.banned_until: dict[str, int] = {}
+
+    def can_run(self, rewrite: Rewrite, iteration: int) -> bool:
+        return self.banned_until.get(rewrite.name, 0) <= iteration
+
+    def record(self, rewrite: Rewrite, iteration: int, cnt: int):
+        n = self.times_banned.get(rewrite.name, 0)
+        if cnt > self.match_limit << n:
+            self.times_banned[rewrite.name] = n + 1
+            self.banned_until[rewrite.name] = iteration + 1 + (self.ban_length << (n + 1))
+
+    def unban(self) -> bool:
+        banned = bool(self.banned_until)
+        self.banned_until.clear()
+        return banned
+
+
+@dataclass
+class Iteration:
+    applied: dict[str, int]     # rewrite -> rows rewritten
+    added: dict[str, int]       # changed table -> rows added, net of the deleted (subsumed) rows
+    elapsed: float
+
+@dataclass
+class Report:
+    iterations: list[Iteration]
+    stop_reason: str    # "saturated", "iterations", "rows" or "time"
+    rows: int
+    elapsed: float
+
+def saturate(
+    db: NetlistDB, rewrites: list[Rewrite], scheduler: RoundRobinScheduler | None = None,
+    max_iters: int = 30, max_rows: int | None = None, time_limit: float | None = None, verbose: bool = True,
+    profiler: Profiler | None = None
+) -> Report:
+    """
+    Apply `rewrites` in order, iteration after iteration, until an iteration changes no table (saturated),
+    `max_iters` iterations ran, the tables hold more than `max_rows` rows or `time_limit` seconds passed.
+    The budgets are checked between rewrites. Rewrites only join the rows added since they last ran,
+    a rewrite none of whose tables changed is skipped, see `tracked()`.
+    Every rewrite is profiled under its name by `profiler` if given.
+    """
+    scheduler = scheduler or RoundRobinScheduler()
+    delta = Delta()
+    tables = db.tables_startswith("")
+    size = lambda: sum(db.row_count(table) for table in tables)
+
+    start_time = time.time()
+    iterations: list[Iteration] = []
+    stop_reason = None
+    while stop_reason is None:
+        if len(iterations) >= max_iters:
+            stop_reason = "iterations"
+            break
+        phase_time = time.time()
+        versions = {table: db.table_version(table) for table in tables}
+        before = {table: db.row_count(table) for table in tables}
+        applied = {}
+        for rewrite in rewrites:
+            if max_rows is not None and size() > max_rows:
+                stop_reason = "rows"
+                break
+            if time_limit is not None and time.time() - start_time > time_limit:
+                stop_reason = "time"
+                break
+            if not scheduler.can_run(rewrite, len(iterations)):
+                continue
+            if profiler is None:
+                applied[rewrite.name] = rewrite.apply(db, delta)
+            elif rewrite.skips(db, delta):
+                profiler.skip(rewrite.name)
+                applied[rewrite.name] = 0
+            else:
+                with profiler.measure(db, rewrite.name):
+                    applied[rewrite.name] = rewrite.apply(db, delta)
+            scheduler.record(rewrite, len(iterations), applied[rewrite.name])
+        added = {table: db.row_count(table) - before[table] for table in tables if db.table_version(table) != versions[table]}
+        iterations.append(Iteration(applied, added, time.time() - phase_time))
+        if verbose:
+            summary = ", ".join(f"{cnt:+} {table}" for table, cnt in added.items()) or "no changes"
+            print(f"saturate() iteration {len(iterations)}: {summary} in {iterations[-1].elapsed:.2f} seconds.")
+        if stop_reason is None and not added and not scheduler.unban():
+            stop_reason = "saturated"
+
+    report = Report(iterations, stop_reason, size(), time.time() - start_time)
+    if verbose:
+        print(f"saturate() stopped ({stop_reason}) after {len(iterations)} iterations with {report.rows} rows in {report.elapsed:.2f} seconds.")
+    return report
@@ -0,0 +1,118 @@
+from ..db import NetlistDB
+from collections import Counter
+from typing import Iterable
+
+
+"""
+subsumption of rewritten cells
+a rewrite called with `subsume=True` deletes the cells it rewrote, their outputs are defined by the new cells,
+then the cells that only fed them are deleted in turn
+a cell stays as long as any bit of its output is read by another cell, a dff, a DSP proposal,
+an output port or a blackbox port
+the read counts of the bits are kept in `db.read_counts` between calls and only the rows inserted since are counted
+"""
+
+_NOT_CELLS = {"ports", "eclasses", "instances", "instance_ports", "instance_params"}
+# positions of the input bundles in the `CELL_COLUMNS` of each table
+_INPUTS = {table: [i for i, col in enumerate(cols[:-1]) if col != "type"] for table, cols in NetlistDB.CELL_COLUMNS.items()}
+
+def _readers(db: NetlistDB) -> list[str]:
+    # the tables whose rows read bundles
+    return [table for table in db.tables_startswith("") if table not in _NOT_CELLS or table in ("ports", "instance_ports")]
+
+def _reads(db: NetlistDB, table: str, after: int = 0) -> Iterable[bytes]:
+    # every bundle read by the rows of `table` above the rowid `after`
+    if table in NetlistDB.CELL_COLUMNS:
+        cols = NetlistDB.CELL_COLUMNS[table]
+        for row in db.query(f"SELECT {', '.join(cols[i] for i in _INPUTS[table])} FROM {table} WHERE rowid > ?", (after,)):
+            yield from row
+    elif table == "ports":
+        for (wire,) in db.query("SELECT wire FROM ports WHERE direction <> 'input' AND rowid > ?", (after,)):
+            yield wire
+    elif table == "instance_ports":
+        for (wire,) in db.query("SELECT wire FROM instance_ports WHERE rowid > ?", (after,)):
+            yield wire
+    else:
+        # DSP proposals, the output is the last column
+        cols = db.columns_of(table)[1:-1]
+        if cols:
+            for row in db.query(f"SELECT {', '.join(cols)} FROM {table} WHERE rowid > ?", (after,)):
+                yield from row
+
+def _count(refs: Counter, bundles: Iterable[bytes]):
+    for bundle in bundles:
+        if bundle:
+            refs.update(NetlistDB.bits_of(bundle))
+
+def _uncount(refs: Counter, bundles: Iterable[bytes]):
+    for bundle in bundles:
+        if bundle:
+            refs.subtract(NetlistDB.bits_of(bundle))
+
+def _read_counts(db: NetlistDB) -> Counter:
+    """
+    Return the read counts of the bits in the e-graph, those of the previous `subsume_cells()` plus the rows inserted since.
+    They are counted again if a table lost or changed rows in the meantime.
+    """
+    tables = _readers(db)
+    versions = {table: db.table_version(table) for table in tables}
+    if db.read_counts is not None:
+        before, refs = db.read_counts
+        marks = {table: before.get(table, (0, 0)) for table in tables}
+        if all(marks[table][1] == changes and marks[table][0] <= mark for table, (mark, changes) in versions.items()):
+            for table, (mark, _) in versions.items():
+                if mark > marks[table][0]:
+                    _count(refs, _reads(db, table, marks[table][0]))
+            return refs
+    refs = Counter()
+    for table in tables:
+        _count(refs, _reads(db, table))
+    return refs
+
+def _cells_of(db: NetlistDB, bundles: list[bytes], chunk: int = 256) -> list[tuple[str, tuple]]:
+    # the cells driving any of `bundles`
+    res = []
+    for table, cols in NetlistDB.CELL_COLUMNS.items():
+        for i in range(0, len(bundles), chunk):
+            part = bundles[i:i + chunk]
+            res += ((table, row) for row in db.query(
+                f"SELECT {', '.join(cols)} FROM {table} WHERE {cols[-1]} IN ({', '.join('?' * len(part))})", part
+            ))
+    return res
+
+def subsume_cells(db: NetlistDB, table: str, rows: Iterable[tuple]) -> int:
+    """
+    Delete the cells `rows` of `table`, given by the values of their `CELL_COLUMNS`,
+    and every cell whose output is then read by nothing but deleted cells.
+    Return the number of deleted rows.
+    """
+    rows = set(rows)
+    refs = _read_counts(db)
+    cnt = db.delete_cells(table, rows)
+    if cnt == len(rows):
+        for row in rows:
+            _uncount(refs, (row[i] for i in _INPUTS[table]))
+    else:   # some rows did not exist, so the reads of the deleted ones are unknown
+        db.read_counts = None
+        refs = _read_counts(db)
+
+    # the outputs that lost their last reader, wave by wave
+    work = [row[i] for row in rows for i in _INPUTS[table]]
+    dead: dict[str, list[tuple]] = {}
+    done = set()
+    while work:
+        unread = []
+        for bundle in work:
+            if bundle and bundle not in done and not any(refs[bit] > 0 for bit in NetlistDB.bits_of(bundle)):
+                done.add(bundle)
+                unread.append(bundle)
+        work = []
+        for table_, row in _cells_of(db, unread):
+            dead.setdefault(table_, []).append(row)
+            inputs = [row[i] for i in _INPUTS[table_]]
+            _uncount(refs, inputs)
+            work += inputs
+    for table_, dead_rows in dead.items():
+        cnt += db.delete_cells(table_, dead_rows)
+    db.read_counts = ({table: db.table_version(table) for table in _readers(db)}, refs)
+    return cnt
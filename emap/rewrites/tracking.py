@@ -0,0 +1,65 @@
+from ..db import NetlistDB
+from .delta import aliases_of
+from .pattern import Pattern
+from typing import Callable, Iterable
+import functools
+
+
+"""
+change tracking of the rewrites
+a rewrite declares the tables it reads, a call whose tables have the same versions as in
+its previous call with the same arguments cannot match anything new and returns 0 at once
+"""
+
+@functools.lru_cache(maxsize=None)
+def _tables_of(query: str | Pattern) -> frozenset[str]:
+    if isinstance(query, Pattern):
+        return frozenset(atom.table for atom in query.atoms)
+    return frozenset(aliases_of(query).values())
+
+def tables_of(*queries: str | Pattern) -> frozenset[str]:
+    """
+    Return the tables read by match queries (SQL or patterns).
+    """
+    return frozenset().union(*(_tables_of(query) for query in queries))
+
+def tracked(reads: Iterable[str] | Callable[..., Iterable[str] | None], key: Callable[..., object] | None = None):
+    """
+    Decorate a rewrite `fn(db, *args, **kwargs) -> int` that only reads the tables `reads`,
+    or `reads(*args, **kwargs)` for rewrites whose tables depend on their arguments, None if unknown.
+    A rewrite with unknown tables always runs.
+    The versions are taken before the rewrite runs and kept once it returns, so a rewrite still
+    sees the rows it inserted itself in its next call. `delta` is not part of the arguments.
+    Calls are told apart by the repr of their arguments, or by `key(*args, **kwargs)` if given.
+    `fn.changed(db, *args, **kwargs)` returns None if a call would be skipped, else the (key, versions) to keep
+    in `db.rule_versions` once the call is done, both None if the tables are unknown.
+    Clear `db.rule_versions` to force the next calls to run.
+    """
+    def decorator(fn: Callable[..., int]) -> Callable[..., int]:
+        static = None if callable(reads) else frozenset(reads)
+
+        def changed(db: NetlistDB, *args, **kwargs) -> tuple[tuple | None, dict | None] | None:
+            tables = static if static is not None else reads(*args, **kwargs)
+            if tables is None:
+                return None, None
+            if key is None:
+                call = (fn.__qualname__, repr(args), repr(sorted((k, v) for k, v in kwargs.items() if k != "delta")))
+            else:
+                call = (fn.__qualname__, key(*args, **kwargs))
+            versions = {table: db.table_version(table) for table in tables}
+            return None if db.rule_versions.get(call) == versions else (call, versions)
+
+        @functools.wraps(fn)
+        def wrapper(db: NetlistDB, *args, **kwargs) -> int:
+            state = changed(db, *args, **kwargs)
+            if state is None:
+                return 0
+            cnt = fn(db, *args, **kwargs)
+            if state[0] is not None:
+                db.rule_versions[state[0]] = state[1]
+            return cnt
+
+        wrapper.reads = reads
+        wrapper.changed = changed
+        return wrapper
+    return decorator
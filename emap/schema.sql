@@ -54,43 +54,96 @@
 --     PRIMARY KEY (instance, param)
 -- );
 
+-- bundles are packed int32 bits, so the width of a bundle is length(bundle) / 4
+-- width columns are generated so that every insert path keeps them correct
 CREATE TABLE IF NOT EXISTS ports (
     name VARCHAR(64) PRIMARY KEY,
-    wire VARCHAR(64) NOT NULL,
+    wire BLOB NOT NULL,
     direction VARCHAR(16) NOT NULL
 );
 
 CREATE TABLE IF NOT EXISTS ay_cells (
     type VARCHAR(16),
-    a VARCHAR(64),
-    y VARCHAR(64) NOT NULL,
+    a BLOB,
+    y BLOB NOT NULL,
+    width_a INTEGER GENERATED ALWAYS AS (length(a) / 4) STORED,
+    width_y INTEGER GENERATED ALWAYS AS (length(y) / 4) STORED,
+    eclass INTEGER,
     PRIMARY KEY (type, a, y)
 );
 
 CREATE TABLE IF NOT EXISTS aby_cells (
     type VARCHAR(16),
-    a VARCHAR(64),
-    b VARCHAR(64),
-    y VARCHAR(64) NOT NULL,
+    a BLOB,
+    b BLOB,
+    y BLOB NOT NULL,
+    width_a INTEGER GENERATED ALWAYS AS (length(a) / 4) STORED,
+    width_b INTEGER GENERATED ALWAYS AS (length(b) / 4) STORED,
+    width_y INTEGER GENERATED ALWAYS AS (length(y) / 4) STORED,
+    eclass INTEGER,
     PRIMARY KEY (type, a, b, y)
 );
 
 CREATE TABLE IF NOT EXISTS absy_cells (
     type VARCHAR(16),
-    a VARCHAR(64),
-    b VARCHAR(64),
-    s VARCHAR(64),
-    y VARCHAR(64) NOT NULL,
+    a BLOB,
+    b BLOB,
+    s BLOB,
+    y BLOB NOT NULL,
+    width_a INTEGER GENERATED ALWAYS AS (length(a) / 4) STORED,
+    width_b INTEGER GENERATED ALWAYS AS (length(b) / 4) STORED,
+    width_s INTEGER GENERATED ALWAYS AS (length(s) / 4) STORED,
+    width_y INTEGER GENERATED ALWAYS AS (length(y) / 4) STORED,
+    eclass INTEGER,
     PRIMARY KEY (type, a, b, s, y)
 );
 
 CREATE TABLE IF NOT EXISTS dffs (
-    d VARCHAR(64),
-    clk VARCHAR(64),
-    q VARCHAR(64) NOT NULL,
+    d BLOB,
+    clk BLOB,
+    q BLOB NOT NULL,
+    width_d INTEGER GENERATED ALWAYS AS (length(d) / 4) STORED,
+    width_clk INTEGER GENERATED ALWAYS AS (length(clk) / 4) STORED,
+    width_q INTEGER GENERATED ALWAYS AS (length(q) / 4) STORED,
+    eclass INTEGER,
     PRIMARY KEY (d, clk, q)
 );
 
+CREATE INDEX IF NOT EXISTS ay_cells_widths ON ay_cells (type, width_a);
+CREATE INDEX IF NOT EXISTS aby_cells_widths ON aby_cells (type, width_a, width_b);
+CREATE INDEX IF NOT EXISTS absy_cells_widths ON absy_cells (type, width_a, width_b);
+CREATE INDEX IF NOT EXISTS dffs_widths ON dffs (width_d);
+
+-- join indexes, the primary keys already cover (type, a) and (d, clk)
+CREATE INDEX IF NOT EXISTS ay_cells_y ON ay_cells (y, type);
+CREATE INDEX IF NOT EXISTS aby_cells_y ON aby_cells (y, type);
+CREATE INDEX IF NOT EXISTS aby_cells_b ON aby_cells (type, b);
+CREATE INDEX IF NOT EXISTS absy_cells_y ON absy_cells (y, type);
+CREATE INDEX IF NOT EXISTS absy_cells_b ON absy_cells (type, b);
+CREATE INDEX IF NOT EXISTS absy_cells_s ON absy_cells (type, s);
+CREATE INDEX IF NOT EXISTS dffs_q ON dffs (q);
+
+-- e-classes of bundles, `root` is the canonical id of the e-class
+-- the `eclass` column of a cell table holds the root of its output, see NetlistDB.rebuild()
+CREATE TABLE IF NOT EXISTS eclasses (
+    id INTEGER PRIMARY KEY,
+    bundle BLOB NOT NULL UNIQUE,
+    root INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS eclasses_root ON eclasses (root);
+CREATE INDEX IF NOT EXISTS ay_cells_eclass ON ay_cells (eclass);
+CREATE INDEX IF NOT EXISTS aby_cells_eclass ON aby_cells (eclass);
+CREATE INDEX IF NOT EXISTS absy_cells_eclass ON absy_cells (eclass);
+CREATE INDEX IF NOT EXISTS dffs_eclass ON dffs (eclass);
+
+CREATE TRIGGER IF NOT EXISTS eclasses_new_root AFTER INSERT ON eclasses WHEN new.root IS NULL
+BEGIN
+    UPDATE eclasses SET root = new.id WHERE id = new.id;
+END;
+
+-- rows inserted after the first e-class get the root of their output from TEMP triggers, see NetlistDB.track_eclasses()
+
 CREATE TABLE IF NOT EXISTS instances (
     id VARCHAR(64) PRIMARY KEY,
     module VARCHAR(64) NOT NULL
@@ -99,7 +152,7 @@ CREATE TABLE IF NOT EXISTS instances (
 CREATE TABLE IF NOT EXISTS instance_ports (
     instance VARCHAR(64),
     port VARCHAR(64),
-    wire VARCHAR(64) NOT NULL,
+    wire BLOB NOT NULL,
     PRIMARY KEY (instance, port)
 );
 
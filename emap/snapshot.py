@@ -0,0 +1,126 @@
+from .db import NetlistDB
+from base64 import b64decode, b64encode
+from itertools import chain
+from typing import IO, Iterator
+import gzip
+import json
+import time
+
+
+"""
+streaming e-graph snapshots
+a snapshot is JSON lines, optionally gzip-compressed:
+- a header object {"format": "emap-snapshot", "version": 1, "cnt": <wire counter>}
+- per table, an object {"table", "columns", "blobs", "sql"} followed by one JSON array per row
+rows carry their rowid so that the extractors see the same rowids after a reload, blobs are base64
+tables are written and read one row at a time, so memory stays flat
+"""
+
+FORMAT = "emap-snapshot"
+VERSION = 1
+
+def _open(path: str, mode: str, compress: bool | None) -> IO:
+    if compress is None:
+        compress = path.endswith(".gz")
+    return gzip.open(path, mode + "t", encoding="utf-8", compresslevel=6) if compress else open(path, mode, encoding="utf-8")
+
+def _sqlite_tables(db: NetlistDB) -> Iterator[tuple[str, list[str], list[int], str | None, Iterator[tuple]]]:
+    cur = db.execute("SELECT name, sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+    for table, sql in cur.fetchall():
+        info = list(db.execute(f"PRAGMA table_info({table})"))
+        keys = [row for row in info if row[5] > 0]
+        # an INTEGER PRIMARY KEY is the rowid itself
+        columns = [row[1] for row in info]
+        if not (len(keys) == 1 and keys[0][2].upper() == "INTEGER"):
+            columns = ["rowid", *columns]
+        types = {row[1]: row[2].upper() for row in info}
+        blobs = [i for i, col in enumerate(columns) if types.get(col) == "BLOB"]
+        yield table, columns, blobs, sql, db.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid")
+
+def _columnar_tables(db) -> Iterator[tuple[str, list[str], list[int], str | None, Iterator[tuple]]]:
+    for table, t in db.tables.items():
+        sql = None
+        if table not in db._SCHEMA:
+            sql = "CREATE TABLE {} ({}, PRIMARY KEY ({}))".format(
+                table,
+                ", ".join(f"{col} {'INTEGER' if col in t.ints else 'BLOB'}" for col in t.columns),
+                ", ".join(t.columns[i] for i in t.key)
+            )
+        # every non-integer column of a table holds either bundles or strings, the first row tells which
+        rows = db.iter_rows(table)
+        first = next(rows, None)
+        blobs = [i for i, value in enumerate(first or ()) if isinstance(value, bytes)]
+        yield table, ["rowid", *t.columns], blobs, sql, chain([first] if first else [], rows)
+
+def dump_snapshot(db: NetlistDB, path: str, compress: bool | None = None) -> int:
+    """
+    Write the e-graph to `path`, gzip-compressed if `compress` or if `path` ends with ".gz".
+    Works with both backends. Return the number of rows.
+    """
+    phase_time = time.time()
+    tables = _columnar_tables(db) if db.backend == "numpy" else _sqlite_tables(db)
+    cnt = 0
+    with _open(path, "w", compress) as f:
+        f.write(json.dumps({"format": FORMAT, "version": VERSION, "cnt": db.cnt}) + "\n")
+        for table, columns, blobs, sql, rows in tables:
+            f.write(json.dumps({"table": table, "columns": columns, "blobs": blobs, "sql": sql}) + "\n")
+            for row in rows:
+                row = list(row)
+                for i in blobs:
+                    if row[i] is not None:
+                        row[i] = b64encode(row[i]).decode("ascii")
+                f.write(json.dumps(row, separators=(",", ":")) + "\n")
+                cnt += 1
+    print(f"dump_snapshot() wrote {cnt} rows in {time.time() - phase_time:.2f} seconds.")
+    return cnt
+
+def load_snapshot(db: NetlistDB, path: str, compress: bool | None = None, batch_size: int = 10000) -> int:
+    """
+    Load a snapshot written by `dump_snapshot()` into an empty `NetlistDB`.
+    Tables missing from the schema (DSP proposals) are created, rowids and the wire counter are restored.
+    Return the number of rows.
+    """
+    phase_time = time.time()
+    if db.in_transaction:
+        db.commit()
+    cnt = 0
+    with _open(path, "r", compress) as f:
+        header = json.loads(f.readline())
+        if header.get("format") != FORMAT or header.get("version") != VERSION:
+            raise ValueError(f"{path} is not an {FORMAT} version {VERSION} file")
+        db.cnt = max(db.cnt, header["cnt"])
+
+        insert, blobs, batch = None, [], []
+        try:
+            for line in f:
+                if line.startswith("{"):
+                    if batch:
+                        db.executemany(insert, batch)
+                        batch.clear()
+                    meta = json.loads(line)
+                    table, columns, blobs = meta["table"], meta["columns"], meta["blobs"]
+                    if table not in db.tables_startswith(table):
+                        if meta["sql"] is None:
+                            raise ValueError(f"Table {table} is missing from the schema")
+                        db.execute(meta["sql"])
+                        db.count_changes(table)
+                    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+                    continue
+                row = json.loads(line)
+                for i in blobs:
+                    if row[i] is not None:
+                        row[i] = b64decode(row[i])
+                batch.append(row)
+                cnt += 1
+                if len(batch) >= batch_size:
+                    db.executemany(insert, batch)
+                    batch.clear()
+            if batch:
+                db.executemany(insert, batch)
+            db.track_eclasses()
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+    print(f"load_snapshot() loaded {cnt} rows in {time.time() - phase_time:.2f} seconds.")
+    return cnt
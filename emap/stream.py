@@ -0,0 +1,145 @@
+import json
+import re
+from typing import Any, Iterator, TextIO
+
+
+"""
+incremental reader for Yosys JSON netlists
+"""
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"\s*")
+_STRUCTURE = re.compile(r'["{}\[\]]')
+_STRING_END = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+_SCALAR_END = re.compile(r"[,}\]\s]")
+
+
+class JSONStream:
+    """
+    Walk a JSON document from a text file without loading it as a whole.
+    Only the values that are explicitly decoded are materialized in memory.
+    """
+
+    def __init__(self, f: TextIO, chunk_size: int = 1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+
+    def _fill(self, size: int | None = None) -> bool:
+        """
+        Drop the consumed part of the buffer and append a new chunk.
+        Return False at the end of the file.
+        """
+        chunk = self.f.read(size or self.chunk_size)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def peek(self) -> str:
+        """
+        Return the next non-whitespace character without consuming it.
+        """
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON stream")
+
+    def expect(self, ch: str):
+        if self.peek() != ch:
+            raise ValueError(f"Expected {ch!r} at JSON stream, got {self.buf[self.pos]!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """
+        Decode the next value.
+        """
+        if self.peek() not in "{[\"":
+            # a number or a literal could be cut by the end of the buffer
+            while _SCALAR_END.search(self.buf, self.pos) is None and self._fill():
+                pass
+        while True:
+            try:
+                val, end = _DECODER.raw_decode(self.buf, self.pos)
+                self.pos = end
+                return val
+            except json.JSONDecodeError:
+                # grow geometrically so that retrying a large value stays linear
+                if not self._fill(max(self.chunk_size, len(self.buf) - self.pos)):
+                    raise
+
+    def skip(self):
+        """
+        Skip the next value without decoding it.
+        """
+        if self.peek() not in "{[\"":
+            self.value()
+            return
+        depth = 0
+        while True:
+            m = _STRUCTURE.search(self.buf, self.pos)
+            if m is None:
+                self.pos = len(self.buf)
+                if not self._fill():
+                    raise ValueError("Unexpected end of JSON stream")
+                continue
+            self.pos = m.end()
+            ch = m.group()
+            if ch == '"':
+                while (end := _STRING_END.match(self.buf, self.pos)) is None:
+                    if not self._fill(max(self.chunk_size, len(self.buf) - self.pos)):
+                        raise ValueError("Unexpected end of JSON stream")
+                self.pos = end.end()
+            elif ch in "{[":
+                depth += 1
+            else:
+                depth -= 1
+            if depth == 0:
+                return
+
+    def members(self) -> Iterator[str]:
+        """
+        Iterate over the keys of the next object.
+        The caller must consume each value with `value()`, `skip()` or `members()` before resuming.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == "}":
+                self.pos += 1
+                return
+            self.expect(",")
+
+
+def iter_module(f: TextIO, top: str) -> Iterator[tuple[str, str, dict]]:
+    """
+    Yield ("port", name, port) and ("cell", name, cell) for module `top` of a Yosys JSON file.
+    Each cell is decoded on its own, the rest of the file is skipped.
+    """
+    stream = JSONStream(f)
+    for key in stream.members():
+        if key != "modules":
+            stream.skip()
+            continue
+        for name in stream.members():
+            if name != top:
+                stream.skip()
+                continue
+            for section in stream.members():
+                if section == "ports":
+                    for port in stream.members():
+                        yield "port", port, stream.value()
+                elif section == "cells":
+                    for cell in stream.members():
+                        yield "cell", cell, stream.value()
+                else:
+                    stream.skip()
+            return
+    raise ValueError(f"Module {top} not found")
@@ -16,13 +16,29 @@ def synth_verilog(infile: str, outfile: str):
     if res.returncode != 0:
         raise RuntimeError(f"Yosys synthesis failed: {res.stderr}")
 
-def import_design(design_path: str, top: str = "top") -> NetlistDB:
-    db = NetlistDB("emap/schema.sql", ":memory:", cnt=1000000)
-    with open(design_path, "r") as f:
-        mod = json.load(f)
-    db.build_from_json(mod["modules"][top])
+def import_design(design_path: str, top: str = "top", backend: str = "sqlite") -> NetlistDB:
+    if backend == "numpy":
+        from emap.columnar import ColumnarDB
+        db = ColumnarDB(cnt=1000000)
+    else:
+        db = NetlistDB("emap/schema.sql", ":memory:", cnt=1000000)
+    db.load_json(design_path, top)
     return db
 
+DSP_RULE_PATH = "./tests/rulesets/xilinx-xcup/dsp.json"
+
+def load_dsp_rules(dsp_rule_path: str = DSP_RULE_PATH) -> list[dict]:
+    with open(dsp_rule_path, "r") as f:
+        return json.load(f)
+
+def simple_cost_model(x: tuple) -> float:
+    if x[0] in {"$muls", "$mulu"}:
+        return NetlistDB.width_of(x[1]) * NetlistDB.width_of(x[2]) * 1.0
+    elif x[0] == "$dff":
+        return NetlistDB.width_of(x[1]) * 0.5
+    else:
+        return NetlistDB.width_of(x[1]) + NetlistDB.width_of(x[2]) * 1.0
+
 """
 Unit Tests for Handcrafted Designs
 """
@@ -44,7 +60,8 @@ def test_complex_multiplier(dsp_rules: list, cost_model: Callable):
     rewrites.create_dsp_tables(db, dsp_rules)
     # rewrite
     rewrites.rewrite_complex_mul(db)    # TODO: Can we provide more generic rewrites?
-    while rewrites.rewrite_dff_backward_aby_cell(db, ["$adds", "$subs", "$muls"]) > 0:
+    delta = rewrites.Delta()
+    while rewrites.rewrite_dff_backward_aby_cell(db, ["$adds", "$subs", "$muls"], delta=delta) > 0:
         pass
     rewrites.rewrite_comm(db, ["$adds", "$muls"])
     [rewrites.rewrite_dsp(db, rule) for rule in dsp_rules]
@@ -58,7 +75,8 @@ def test_square_diff(dsp_rules: list, cost_model: Callable):
     db = import_design("./tests/out/handcrafted/square_diff_orignal.json")
     rewrites.create_dsp_tables(db, dsp_rules)
     # rewrite
-    while rewrites.rewrite_dff_backward_aby_cell(db, ["$subs", "$muls"]) > 0:
+    delta = rewrites.Delta()
+    while rewrites.rewrite_dff_backward_aby_cell(db, ["$subs", "$muls"], delta=delta) > 0:
         pass
     [rewrites.rewrite_dsp(db, rule) for rule in dsp_rules]
     # extract
@@ -71,7 +89,8 @@ def test_signed_mac(dsp_rules: list, cost_model: Callable):
     db = import_design("./tests/out/handcrafted/signed_mac_orignal.json")
     rewrites.create_dsp_tables(db, dsp_rules)
     # rewrite
-    while rewrites.rewrite_dff_backward_aby_cell(db, ["$adds", "$muls"]) > 0:
+    delta = rewrites.Delta()
+    while rewrites.rewrite_dff_backward_aby_cell(db, ["$adds", "$muls"], delta=delta) > 0:
         pass
     rewrites.rewrite_comm(db, ["$adds", "$muls"])
     [rewrites.rewrite_dsp(db, rule) for rule in dsp_rules]
@@ -85,7 +104,8 @@ def test_unsigned_mac(dsp_rules: list, cost_model: Callable):
     db = import_design("./tests/out/handcrafted/unsigned_mac_orignal.json")
     rewrites.create_dsp_tables(db, dsp_rules)
     # rewrite
-    while rewrites.rewrite_dff_backward_aby_cell(db, ["$addu", "$mulu"]) > 0:
+    delta = rewrites.Delta()
+    while rewrites.rewrite_dff_backward_aby_cell(db, ["$addu", "$mulu"], delta=delta) > 0:
         pass
     rewrites.rewrite_comm(db, ["$addu", "$mulu"])
     [rewrites.rewrite_dsp(db, rule) for rule in dsp_rules]
@@ -101,7 +121,8 @@ def test_wide_multiplier(dsp_rules: list, cost_model: Callable):
     # rewrite
     rewrites.rewrite_split_wide_mul(db, a_width=17, b_width=26)   # maximum width of unsigned multiplication
     rewrites.rewrite_split_wide_dff(db, width=17)
-    while rewrites.rewrite_dff_backward_aby_cell(db, ["$addu", "$mulu"]) > 0:
+    delta = rewrites.Delta()
+    while rewrites.rewrite_dff_backward_aby_cell(db, ["$addu", "$mulu"], delta=delta) > 0:
         pass
     # rewrites.rewrite_comm(db, ["$addu", "$mulu"])
     [rewrites.rewrite_dsp(db, rule) for rule in dsp_rules]
@@ -116,7 +137,6 @@ def test_handcrafted_all(synth: bool = False):
     # NOTE: all designs only have one module named "top"
     design_path = "./tests/designs/handcrafted"
     out_path = "./tests/out/handcrafted"
-    dsp_rule_path = "./tests/rulesets/xilinx-xcup/dsp.json"
 
     # preprocess
     if synth:
@@ -127,16 +147,7 @@ def test_handcrafted_all(synth: bool = False):
                 print(f"Synthesizing {infile} to {outfile}")
                 synth_verilog(infile, outfile)
 
-    with open(dsp_rule_path, "r") as f:
-        dsp_rules = json.load(f)
-
-    def simple_cost_model(x: tuple) -> float:
-        if x[0] in {"$muls", "$mulu"}:
-            return NetlistDB.width_of(x[1]) * NetlistDB.width_of(x[2]) * 1.0
-        elif x[0] == "$dff":
-            return NetlistDB.width_of(x[1]) * 0.5
-        else:
-            return NetlistDB.width_of(x[1]) + NetlistDB.width_of(x[2]) * 1.0
+    dsp_rules = load_dsp_rules()
 
     # run tests
     os.makedirs("./tests/out/handcrafted", exist_ok=True)
@@ -147,28 +158,315 @@ def test_handcrafted_all(synth: bool = False):
     test_unsigned_mac(dsp_rules, simple_cost_model)
     test_wide_multiplier(dsp_rules, simple_cost_model)
 
+"""
+Tests against the Sequential Flow
+"""
+HANDCRAFTED = ("dot_product", "complex_multiplier", "square_diff", "signed_mac", "unsigned_mac", "wide_multiplier")
+
+def rewrite_handcrafted(db: NetlistDB):
+    # the rewrites of all handcrafted tests, on every design
+    rewrites.rewrite_complex_mul(db)
+    delta = rewrites.Delta()
+    while rewrites.rewrite_dff_backward_aby_cell(db, ["$adds", "$subs", "$muls", "$addu", "$mulu"], delta=delta) > 0:
+        pass
+    rewrites.rewrite_comm(db, ["$adds", "$muls", "$addu", "$mulu"])
+
+def test_parallel_dsp():
+    print("Testing parallel DSP matching...")
+    dsp_rules = load_dsp_rules()
+    for design in HANDCRAFTED:
+        # the same e-graph twice, matched rule by rule and on a process pool
+        db = import_design(f"./tests/out/handcrafted/{design}_orignal.json")
+        rewrites.create_dsp_tables(db, dsp_rules)
+        rewrite_handcrafted(db)
+        cnts = {rule["name"]: rewrites.rewrite_dsp(db, rule) for rule in dsp_rules}
+        parallel_db = import_design(f"./tests/out/handcrafted/{design}_orignal.json")
+        rewrites.create_dsp_tables(parallel_db, dsp_rules)
+        rewrite_handcrafted(parallel_db)
+        parallel_cnts = rewrites.rewrite_dsps_parallel(parallel_db, dsp_rules, workers=2, verbose=False)
+        assert parallel_cnts == cnts, f"{design}: rewrite_dsps_parallel() added {parallel_cnts}, rewrite_dsp() {cnts}"
+        for rule in dsp_rules:
+            sql = f"SELECT * FROM {rule['name']}"
+            assert sorted(parallel_db.query(sql)) == sorted(db.query(sql)), f"{design}: the proposals of {rule['name']} differ"
+        print(f"{design}: {sum(cnts.values())} DSP proposals")
+
+def test_subsume():
+    print("Testing subsumption...")
+    dsp_rules = load_dsp_rules()
+    for backend in ("sqlite", "numpy"):
+        # the original $adds and $subs of the complex multiplication are subsumed, the extraction must not change
+        results = []
+        for subsume in (False, True):
+            db = import_design("./tests/out/handcrafted/complex_multiplier_orignal.json", backend=backend)
+            rewrites.create_dsp_tables(db, dsp_rules)
+            report = rewrites.saturate(db, [
+                rewrites.Rewrite("complex_mul", rewrites.rewrite_complex_mul, kwargs={"subsume": subsume}),
+                rewrites.Rewrite("dff_backward", rewrites.rewrite_dff_backward_aby_cell, (["$adds", "$subs", "$muls"],)),
+                rewrites.Rewrite("comm", rewrites.rewrite_comm, (["$adds", "$muls"],)),
+                *rewrites.dsp_rewrites(dsp_rules)
+            ], verbose=False)
+            rows = sum(db.row_count(table) for table in db.tables_startswith(""))
+            assert report.rows == rows, f"saturate() reported {report.rows} rows, the tables hold {rows}"
+            if subsume:
+                # the read counts kept across the calls must match a fresh count
+                refs = +rewrites.subsume._read_counts(db)
+                db.read_counts = None
+                assert refs == +rewrites.subsume._read_counts(db), "subsume_cells() kept wrong read counts"
+            design = extracts.ilp.extract_dsps_by_count(db, "dsp48e2", count=3, cost_model=simple_cost_model)
+            results.append((rows, sorted(cell["type"] for cell in design["cells"].values())))
+        (rows, cells), (subsumed_rows, subsumed_cells) = results
+        assert subsumed_rows < rows, f"subsumption kept {subsumed_rows} of {rows} rows"
+        assert subsumed_cells == cells, f"subsumption extracted {subsumed_cells} instead of {cells}"
+        print(f"complex_multiplier ({backend}): {rows} -> {subsumed_rows} rows, extracted {', '.join(cells)}")
+
+def merge_handcrafted() -> dict:
+    # all handcrafted designs side by side in one module, each with wires (and so a clock) of its own
+    merged = {"ports": {}, "cells": {}}
+    offset = 0
+    for design in HANDCRAFTED:
+        with open(f"./tests/out/handcrafted/{design}_orignal.json", "r") as f:
+            module = json.load(f)["modules"]["top"]
+        shift = lambda bits: [bit + offset if isinstance(bit, int) else bit for bit in bits]
+        for name, port in module["ports"].items():
+            merged["ports"][f"{design}.{name}"] = {**port, "bits": shift(port["bits"])}
+        for name, cell in module["cells"].items():
+            merged["cells"][f"{design}.{name}"] = {**cell, "connections": {port: shift(bits) for port, bits in cell["connections"].items()}}
+        bits = [bit for port in module["ports"].values() for bit in port["bits"]]
+        bits += [bit for cell in module["cells"].values() for connection in cell["connections"].values() for bit in connection]
+        offset += 1 + max(bit for bit in bits if isinstance(bit, int))
+    return merged
+
+def test_retime_by_clock():
+    print("Testing retiming by clock...")
+    dsp_rules = load_dsp_rules()
+    retiming = [
+        rewrites.Rewrite("split_wide_dff", rewrites.rewrite_split_wide_dff, (17,)),
+        rewrites.Rewrite("dff_backward", rewrites.rewrite_dff_backward_aby_cell, (["$adds", "$subs", "$muls", "$addu", "$mulu"],)),
+        rewrites.Rewrite("comm", rewrites.rewrite_comm, (["$adds", "$muls", "$addu", "$mulu"],)),
+    ]
+    # the same e-graph twice, retimed as a whole and by clock partitions on a process pool
+    # fresh wires are numbered differently, so the tables are compared by their sizes and DSP proposals
+    # the designs without their dffs are combinational regions, which get partitions of their own
+    merged = merge_handcrafted()
+    combinational = {**merged, "cells": {name: cell for name, cell in merged["cells"].items() if cell["type"] != "$dff"}}
+    for design, netlist in (("sequential", merged), ("combinational", combinational)):
+        results = []
+        for partitioned in (False, True):
+            db = NetlistDB("emap/schema.sql", ":memory:", cnt=1000000)
+            db.build_from_json(netlist)
+            rewrites.create_dsp_tables(db, dsp_rules)
+            partitions = len(rewrites.clock_partitions(db))
+            if partitioned:
+                rewrites.retime_by_clock(db, retiming, workers=2, verbose=False)
+            else:
+                rewrites.saturate(db, retiming, verbose=False)
+            rows = {table: db.row_count(table) for table in ("aby_cells", "dffs")}
+            results.append((rows, {rule["name"]: rewrites.rewrite_dsp(db, rule) for rule in dsp_rules}))
+        assert results[1] == results[0], f"retime_by_clock() of the {design} designs gave {results[1]}, saturate() {results[0]}"
+        rows, cnts = results[0]
+        print(f"{len(HANDCRAFTED)} {design} designs in {partitions} partitions: {rows['aby_cells']} aby_cells, {rows['dffs']} dffs, {sum(cnts.values())} DSP proposals")
+
+def test_profiler():
+    print("Testing the profiler...")
+    dsp_rules = load_dsp_rules()
+    db = import_design("./tests/out/handcrafted/dot_product_orignal.json")
+    rewrites.create_dsp_tables(db, dsp_rules)
+    profiler = rewrites.Profiler()
+    report = rewrites.saturate(db, [
+        rewrites.Rewrite("comm", rewrites.rewrite_comm, (["$adds", "$muls"],)),
+        *rewrites.dsp_rewrites(dsp_rules)
+    ], profiler=profiler, verbose=False)
+    profiler.detach()
+    # every rule comes up once per iteration, the calls skipped by `tracked()` are not counted as calls
+    for name, profile in profiler.rules.items():
+        assert profile.calls + profile.skipped == len(report.iterations), f"{name}: {profile.calls} calls and {profile.skipped} skipped in {len(report.iterations)} iterations"
+    # nothing changes in the last iteration, so no DSP rule runs again
+    for rule in dsp_rules:
+        assert profiler.rules[rule["name"]].skipped > 0, f"{rule['name']} was never skipped"
+    skipped = sum(profile.skipped for profile in profiler.rules.values())
+    print(f"dot_product saturated in {len(report.iterations)} iterations: {sum(profile.calls for profile in profiler.rules.values())} calls, {skipped} skipped")
+
+"""
+Pattern Tests
+"""
+# the hand-written match queries of the rules and rewrites written as patterns, columns in the order of their select
+HANDWRITTEN_SQL = {
+    "dsp48e2_signed_submuladd_1_stage_26_18_48_26_bit": "SELECT sub1.width_a + sub1.width_b + mul1.width_a * mul1.width_b + add1.width_b + 5 * dff1.width_q AS value, dff1.clk, sub1.a, sub1.b, mul1.b, add1.b, dff1.q FROM dffs AS dff1 JOIN aby_cells AS sub1 JOIN aby_cells AS mul1 JOIN aby_cells AS add1 ON dff1.d = add1.y AND sub1.y = mul1.a AND mul1.y = add1.a WHERE sub1.type = '$subs' AND mul1.type = '$muls' AND add1.type = '$adds' AND sub1.width_a <= 26 AND sub1.width_b <= 26 AND mul1.width_b <= 18 AND add1.width_b <= 48 AND dff1.width_q <= 48",
+    "dsp48e2_signed_squarediff_1_stage_18_bit": "SELECT sub1.width_a + sub1.width_b + mul1.width_a * mul1.width_b + 5 * dff1.width_q AS value, dff1.clk, sub1.a, sub1.b, dff1.q FROM dffs AS dff1 JOIN aby_cells AS sub1 JOIN aby_cells AS mul1 ON dff1.d = mul1.y AND sub1.y = mul1.a AND sub1.y = mul1.b WHERE sub1.type = '$subs' AND mul1.type = '$muls' AND sub1.width_a <= 18 AND sub1.width_b <= 18 AND +mul1.width_a <= 18 AND dff1.width_q <= 36",
+    "rewrite_complex_mul": rewrites.arith._COMPLEX_MUL_SQL,
+    "rewrite_split_wide_mul": "SELECT a, b, y FROM aby_cells WHERE type = '$mulu' AND width_a <= 17 AND width_b > 26 AND width_y > 26",
+}
+
+def check_pattern(db: NetlistDB, name: str, pattern: rewrites.Pattern, select: list[str], where: list[str]) -> int:
+    # both the SQL plan and the generic join must find the matches of the hand-written SQL
+    expected = sorted(db.query(HANDWRITTEN_SQL[name]))
+    for generic in (False, True):
+        rows = sorted(pattern.match(db, select, where, generic=generic))
+        plan = "generic join" if generic else "SQL plan"
+        assert rows == expected, f"{name}: the {plan} of the pattern found {len(rows)} matches, the hand-written SQL {len(expected)}"
+    return len(expected)
+
+def test_patterns():
+    print("Testing patterns...")
+    pattern_rules = [rule for rule in load_dsp_rules() if "pattern" in rule]
+    arith = rewrites.arith
+    split_where = [cond.format(a_width=17, b_width=26) for cond in arith._SPLIT_WIDE_MUL_WHERE]
+    for backend in ("sqlite", "numpy"):
+        for design in HANDCRAFTED:
+            db = import_design(f"./tests/out/handcrafted/{design}_orignal.json", backend=backend)
+            rewrite_handcrafted(db)
+            cnts = {rule["name"]: check_pattern(db, rule["name"], *rewrites.pattern_of(rule)) for rule in pattern_rules}
+            cnts["rewrite_complex_mul"] = check_pattern(db, "rewrite_complex_mul", arith._COMPLEX_MUL, arith._COMPLEX_MUL_SELECT, arith._COMPLEX_MUL_WHERE)
+            cnts["rewrite_split_wide_mul"] = check_pattern(db, "rewrite_split_wide_mul", arith._SPLIT_WIDE_MUL, arith._SPLIT_WIDE_MUL_SELECT, split_where)
+            print(f"{design} ({backend}): " + ", ".join(f"{cnt} {name}" for name, cnt in cnts.items() if cnt > 0))
+
+"""
+E-graph Tests
+"""
+def test_rebuild():
+    print("Testing rebuild...")
+    dsp_rules = load_dsp_rules()
+    results = []
+    for merge in ("none", "union", "congruence"):
+        db = import_design("./tests/out/handcrafted/dot_product_orignal.json")
+        rewrites.create_dsp_tables(db, dsp_rules)
+        # a copy of a $muls with an output of its own, read by an extra output port
+        type_, a, b, y = db.query("SELECT type, a, b, y FROM aby_cells WHERE type = '$muls'")[0]
+        copy = db.next_wires(NetlistDB.width_of(y))
+        db.insert_rows("aby_cells", ("type", "a", "b", "y"), [(type_, a, b, copy)])
+        db.insert_rows("ports", ("name", "wire", "direction"), [("copy", copy, "output")])
+        if merge == "union":
+            assert db.union(y, copy), "union() did not merge the outputs of the copies"
+        if merge != "none":
+            merges = db.rebuild()
+            assert merges == (merge == "congruence"), f"rebuild() merged {merges} e-classes after a {merge}"
+            assert db.same_eclass(y, copy), f"the outputs of the copies are apart after a {merge}"
+        rewrites.rewrite_comm(db, ["$adds"])
+        # rows inserted after rebuild() have the e-class of their output
+        stale = db.query("SELECT count(*) FROM aby_cells JOIN eclasses ON bundle = y WHERE eclass IS NOT root")[0][0]
+        assert stale == 0, f"{stale} aby_cells have a stale e-class after a {merge}"
+        [rewrites.rewrite_dsp(db, rule) for rule in dsp_rules]
+        extracts.greedy.fix_dsps(db, "dsp48e2", 10)
+        design = extracts.ilp.extract_dsps_by_cost(db, "dsp48e2", cost_model=simple_cost_model)
+        results.append(sorted(cell["type"] for cell in design["cells"].values()))
+    assert results[1] == results[0] and results[2] == results[0], f"the extractions differ: {results}"
+    print(f"dot_product with a copied $muls: extracted {', '.join(results[0])}")
+
+def two_level_design() -> dict:
+    # dot_product as a module instantiated twice by a top module, the instances share their inputs
+    with open("./tests/out/handcrafted/dot_product_orignal.json", "r") as f:
+        dot = json.load(f)["modules"]["top"]
+    ports = {name: port for name, port in dot["ports"].items() if port["direction"] == "input"}
+    offset = 1 + max(bit for port in ports.values() for bit in port["bits"])
+    top = {"attributes": {"top": "00000000000000000000000000000001"}, "ports": dict(ports), "cells": {}}
+    for i in range(2):
+        p = list(range(offset, offset + len(dot["ports"]["p"]["bits"])))
+        offset += len(p)
+        top["ports"][f"p{i}"] = {"direction": "output", "bits": p}
+        top["cells"][f"u{i}"] = {
+            "type": "dot", "parameters": {}, "attributes": {},
+            "port_directions": {name: port["direction"] for name, port in dot["ports"].items()},
+            "connections": {**{name: port["bits"] for name, port in ports.items()}, "p": p},
+        }
+    return {"modules": {"top": top, "dot": dot}}
+
+def test_map_hierarchy():
+    print("Testing hierarchical mapping...")
+    from emap.__main__ import map_module
+    from emap.hier import map_hierarchy
+    from functools import partial
+    design = two_level_design()
+    budget = 2
+    flow = partial(map_module, dsp_rules=load_dsp_rules(), count=budget)
+    for name in ("group.json", "egraph_extraction.lp"):
+        if os.path.exists(name):
+            os.remove(name)
+    # mapped in this process and on a process pool, every module once
+    results = [map_hierarchy(design, "top", flow, workers=workers) for workers in (1, 2)]
+    assert results[1] == results[0], "map_hierarchy() on a process pool differs from the sequential mapping"
+    for name in ("group.json", "egraph_extraction.lp"):
+        assert not os.path.exists(name), f"a worker of map_hierarchy() wrote {name} to the working directory"
+    modules = results[0]["modules"]
+    assert list(modules) == ["dot", "top"], f"map_hierarchy() returned the modules {list(modules)}"
+    instances = sorted(cell["type"] for cell in modules["top"]["cells"].values())
+    assert instances == ["dot", "dot"], f"the instances of the top module became {instances}"
+    dsps = [cell["type"] for cell in modules["dot"]["cells"].values() if cell["type"].startswith("dsp48e2")]
+    assert 0 < len(dsps) <= budget, f"the dot module got {len(dsps)} DSPs with a budget of {budget}"
+    print(f"dot_product instantiated twice: {', '.join(sorted(cell['type'] for cell in modules['dot']['cells'].values()))} in module dot")
+
+def table_rows(db: NetlistDB, table: str, columns: list[str]) -> list[tuple]:
+    # (rowid, *columns) of every row of the table, on both backends
+    if db.backend == "numpy":
+        return [row for row in db.iter_rows(table)]
+    return db.query(f"SELECT rowid, {', '.join(columns)} FROM {table} ORDER BY rowid")
+
+def test_snapshot():
+    print("Testing snapshots...")
+    import tempfile
+    dsp_rules = load_dsp_rules()
+    for backend in ("sqlite", "numpy"):
+        db = import_design("./tests/out/handcrafted/complex_multiplier_orignal.json", backend=backend)
+        rewrites.create_dsp_tables(db, dsp_rules)
+        rewrite_handcrafted(db)
+        [rewrites.rewrite_dsp(db, rule) for rule in dsp_rules]
+        # rowids with gaps survive the roundtrip
+        db.delete_rows("aby_cells", [1])
+        tables = {table: db.columns_of(table) for table in db.tables_startswith("")}
+        for name in ("egraph.jsonl", "egraph.jsonl.gz"):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, name)
+                cnt = snapshot.dump_snapshot(db, path)
+                loaded = NetlistDB("emap/schema.sql", ":memory:")
+                assert snapshot.load_snapshot(loaded, path) == cnt, f"{name} ({backend}): loaded a different number of rows than dumped"
+            assert loaded.cnt == db.cnt, f"{name} ({backend}): the wire counter is {loaded.cnt} after loading, {db.cnt} before"
+            for table, columns in tables.items():
+                rows, loaded_rows = table_rows(db, table, columns), table_rows(loaded, table, columns)
+                assert loaded_rows == rows, f"{name} ({backend}): the table {table} differs after the roundtrip"
+            extra = [table for table in loaded.tables_startswith("") if table not in tables and loaded.row_count(table) > 0]
+            assert not extra, f"{name} ({backend}): the tables {extra} got rows from nowhere"
+            loaded.close()
+        print(f"complex_multiplier ({backend}): {cnt} rows in {len(tables)} tables")
+
+def test_cache_eviction():
+    print("Testing bounded hash-consing caches...")
+    # the same rewrites with unbounded caches and with caches of 2 entries, the evicted keys are found in the tables
+    dumps, stats = [], []
+    for cache_size in (None, 2):
+        db = NetlistDB("emap/schema.sql", ":memory:", cnt=1000000, cache_size=cache_size)
+        db.load_json("./tests/out/handcrafted/complex_multiplier_orignal.json", "top")
+        rewrite_handcrafted(db)
+        rows = sum(db.row_count(table) for table in ("aby_cells", "dffs"))
+        # every cell again, a cache miss must return the existing output and insert nothing
+        for type_, a, b, y, width in db.query("SELECT type, a, b, y, width_y FROM aby_cells"):
+            assert db.find_or_create_aby_cell(width, type_, a, b) == y, f"find_or_create_aby_cell() gave a new output for an existing {type_}"
+        for d, clk, q, width in db.query("SELECT d, clk, q, width_q FROM dffs"):
+            assert db.find_or_create_dff(width, d, clk) == q, "find_or_create_dff() gave a new output for an existing dff"
+        assert sum(db.row_count(table) for table in ("aby_cells", "dffs")) == rows, f"hash-consing with a cache of {cache_size} inserted duplicates"
+        dumps.append(db.dump_tables())
+        stats.append(db.cache_stats())
+    assert stats[0]["evictions"] == 0 and stats[1]["evictions"] > 0, f"unexpected evictions: {stats}"
+    assert stats[1]["aby_cells"] <= 2 and stats[1]["dffs"] <= 2, f"the bounded caches grew to {stats[1]}"
+    assert dumps[1] == dumps[0], "the e-graph with bounded caches differs from the one with unbounded caches"
+    print(f"complex_multiplier: {stats[1]['evictions']} evictions, hit rate {stats[1]['hit_rate']:.2f} (unbounded {stats[0]['hit_rate']:.2f})")
+
 def test_systolic():
-    dsp_rule_path = "./tests/rulesets/xilinx-xcup/dsp.json"
-    with open(dsp_rule_path, "r") as f:
-        dsp_rules = json.load(f)
+    dsp_rules = load_dsp_rules()
     # no need to synthesize
-    def simple_cost_model(x: tuple) -> float:
-        if x[0] in {"$muls", "$mulu"}:
-            return NetlistDB.width_of(x[1]) * NetlistDB.width_of(x[2]) * 1.0
-        elif x[0] == "$dff":
-            return NetlistDB.width_of(x[1]) * 0.5
-        else:
-            return NetlistDB.width_of(x[1]) + NetlistDB.width_of(x[2]) * 1.0
-
     print("Testing Systolic...")
     db = import_design("./tests/designs/systolic/systolic.json", top="systolic")
     rewrites.create_dsp_tables(db, dsp_rules)
     # rewrite
     # while rewrites.rewrite_dff_backward_aby_cell(db, ["$adds", "$addu", "$subs", "$subu", "$muls", "$mulu"]) > 0:
     #     pass
-    rewrites.rewrite_comm(db, ["$adds", "$addu", "$subs", "$subu", "$muls", "$mulu"])
-    for rule in dsp_rules:
-        print(f"Applied {rule['name']} {rewrites.rewrite_dsp(db, rule)} times.")
+    profiler = rewrites.Profiler()
+    rewrites.saturate(db, [
+        rewrites.Rewrite("comm", rewrites.rewrite_comm, (["$adds", "$addu", "$subs", "$subu", "$muls", "$mulu"],)),
+        *rewrites.dsp_rewrites(dsp_rules)
+    ], scheduler=rewrites.BackoffScheduler(), time_limit=600, profiler=profiler)
+    profiler.detach()
+    print(profiler.table())
+    os.makedirs("./tests/out/systolic", exist_ok=True)
+    profiler.dump("./tests/out/systolic/profile.json")
     # with open("out.json", "w") as f:
     #     json.dump(db.dump_tables(), f, indent=2)
     # extract
@@ -180,6 +478,15 @@ def test_systolic():
 
 if __name__ == "__main__":
     # test_handcrafted_all()
+    test_patterns()
+    test_parallel_dsp()
+    test_subsume()
+    test_retime_by_clock()
+    test_profiler()
+    test_rebuild()
+    test_map_hierarchy()
+    test_snapshot()
+    test_cache_eviction()
     test_systolic()
     # from emap.cpp.build import emapcc
     # print(emapcc.prune_cells([(1, [1, 2], [3, 4]), (2, [1, 2], [3])]))